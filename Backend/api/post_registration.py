@@ -7,18 +7,19 @@ from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional
 import os
-import pandas as pd
+import asyncio
 from dotenv import load_dotenv
-from openai import AzureOpenAI
+from llm_resilience import llm_call, LLMUnavailable, LLM_UNAVAILABLE_MESSAGE
+from tracing import traced
+from cancellation import check_cancelled
+from llm_usage import token_ledger, history_limit, max_tokens_for, BUDGET_NORMAL
+from lazy_imports import lazy_import
+from session_store import session_store
+from transaction_intent import MONTH_MAP, basic_transaction_intent
 import json
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use("Agg")
-from azure.storage.blob import BlobServiceClient
 import uuid
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
-from azure.storage.blob import generate_blob_sas, BlobSasPermissions
 from datetime import timedelta
 
 from database import (
@@ -26,21 +27,14 @@ from database import (
     get_beneficiary_details,
     get_beneficiary_transactions
 )
+# pandas is only needed once a beneficiary's transactions are loaded
+pd = lazy_import("pandas")
+
 # --------------------------------------------------
 # Load ENV
 # --------------------------------------------------
 load_dotenv()
 
-# --------------------------------------------------
-# Azure OpenAI
-# --------------------------------------------------
-AZURE_CLIENT = AzureOpenAI(
-    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
-)
-AZURE_DEPLOYMENT = os.getenv("AZURE_OPENAI_DEPLOYMENT")
-
 # --------------------------------------------------
 # Azure Storage
 # --------------------------------------------------
@@ -48,13 +42,10 @@ AZURE_SA_NAME = os.getenv("AZURE_SA_NAME")
 AZURE_SA_ACCESSKEY = os.getenv("AZURE_SA_ACCESSKEY")
 
 # --------------------------------------------------
-# Month Map
+# Prompt limits
 # --------------------------------------------------
-MONTH_MAP = {
-    "january": 1, "february": 2, "march": 3, "april": 4,
-    "may": 5, "june": 6, "july": 7, "august": 8,
-    "september": 9, "october": 10, "november": 11, "december": 12
-}
+# Transactions kept in the prompt once a session is over its token budget
+POST_CHAT_BUDGET_TRANSACTIONS = 12
 
 # --------------------------------------------------
 # FastAPI App
@@ -70,7 +61,7 @@ app.add_middleware(
 # --------------------------------------------------
 # Session Memory
 # --------------------------------------------------
-SESSION_HISTORY = {}
+SESSION_HISTORY = session_store.namespace("post_application")
 
 # --------------------------------------------------
 # Request Schema
@@ -83,7 +74,7 @@ class ChatRequest(BaseModel):
 # --------------------------------------------------
 # LLM Chat
 # --------------------------------------------------
-def call_llm(prompt: str) -> str:
+async def call_llm(prompt: str, session_id: Optional[str] = None) -> str:
     system_prompt = (
         "You are a Ladli Behna Yojana assistant.\n"
         "Rules:\n"
@@ -107,14 +98,15 @@ def call_llm(prompt: str) -> str:
         "- Do NOT ask for last 4 digits or partial identifiers\n"
     )
 
-    response = AZURE_CLIENT.chat.completions.create(
-        model=AZURE_DEPLOYMENT,
+    response = await llm_call(
+        "post_application",
+        session_id=session_id,
         messages=[
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": prompt}
         ],
         temperature=0.3,
-        max_tokens=800
+        max_tokens=max_tokens_for(session_id, 800)
     )
 
     return response.choices[0].message.content.strip()
@@ -122,7 +114,7 @@ def call_llm(prompt: str) -> str:
 # --------------------------------------------------
 # LLM Intent Extraction
 # --------------------------------------------------
-def extract_transaction_intent_llm(user_prompt: str):
+async def extract_transaction_intent_llm(user_prompt: str):
     intent_prompt = f"""
 Extract transaction intent from the user message.
 
@@ -147,25 +139,33 @@ JSON:
   "last_n_months": number or null
 }}
 """
-    response = AZURE_CLIENT.chat.completions.create(
-        model=AZURE_DEPLOYMENT,
-        messages=[
-            {"role": "system", "content": "Return valid JSON only."},
-            {"role": "user", "content": intent_prompt}
-        ],
-        temperature=0,
-        max_tokens=200
-    )
+    try:
+        response = await llm_call(
+            "transaction_intent",
+            messages=[
+                {"role": "system", "content": "Return valid JSON only."},
+                {"role": "user", "content": intent_prompt}
+            ],
+            temperature=0,
+            max_tokens=200
+        )
+    except LLMUnavailable as e:
+        print(f"Transaction intent LLM unavailable, using regex extraction: {e}")
+        return basic_transaction_intent(user_prompt)
     return json.loads(response.choices[0].message.content)
 
+
 # --------------------------------------------------
 # Upload Chart to Azure Blob
 # --------------------------------------------------
-def upload_chart(df: pd.DataFrame):
+@traced("blob.upload_chart")
+def upload_chart(df: "pd.DataFrame"):
+    check_cancelled("blob_upload")
     print("Generating chart...")
     import matplotlib
     matplotlib.use("Agg")
     import matplotlib.pyplot as plt
+    from azure.storage.blob import BlobServiceClient, generate_blob_sas, BlobSasPermissions
 
     plt.figure(figsize=(10, 5))
     plt.bar(df["PaymentMonth"], df["Amount"])
@@ -218,34 +218,34 @@ def upload_chart(df: pd.DataFrame):
 # --------------------------------------------------
 # Chat API
 # --------------------------------------------------
-@app.post("/post-application-chat")
-def post_chat(req: ChatRequest):
+async def draft_post_chat(req: ChatRequest):
+    """
+    Run the post-application agent without writing SESSION_HISTORY.
+    Returns (bot_reply, chart_url); bot_reply is None when no records are found.
+    """
     session_id = req.session_id
     user_message = req.message
     aadhaar_last4 = req.aadhaar_last4
 
-    if session_id not in SESSION_HISTORY:
-        SESSION_HISTORY[session_id] = []
-
     db_context = ""
     chart_url = None
 
     if aadhaar_last4:
-        beneficiary_id = get_beneficiary_by_aadhaar_last4(aadhaar_last4)
+        beneficiary_id = await asyncio.to_thread(get_beneficiary_by_aadhaar_last4, aadhaar_last4)
         if not beneficiary_id:
-            return {"response": "No records found", "history": SESSION_HISTORY[session_id]}
+            return None, None
 
         print(f"Found BeneficiaryId: {beneficiary_id}")
 
-        beneficiary = get_beneficiary_details(beneficiary_id)
+        beneficiary = await asyncio.to_thread(get_beneficiary_details, beneficiary_id)
         print("Beneficiary Details:", beneficiary)
-        transactions = get_beneficiary_transactions(beneficiary_id)
+        transactions = await asyncio.to_thread(get_beneficiary_transactions, beneficiary_id)
         
         transc_df = pd.DataFrame(transactions)
         # print("Transactions DF:", transc_df)
         transc_df["TransactionDate"] = pd.to_datetime(transc_df["TransactionDate"])
 
-        intent = extract_transaction_intent_llm(user_message)
+        intent = await extract_transaction_intent_llm(user_message)
 
         if intent["transaction_flag"] == 1:
 
@@ -271,7 +271,12 @@ def post_chat(req: ChatRequest):
                 transc_df["TxnMonth"] = transc_df["TransactionDate"].dt.month
                 transc_df = transc_df[transc_df["TxnMonth"].isin(months)]
 
-            chart_url = upload_chart(transc_df)
+            # matplotlib rendering + blob upload are blocking
+            chart_url = await asyncio.to_thread(upload_chart, transc_df)
+
+        # Over the token budget: only the most recent transactions go into the prompt
+        if token_ledger.budget_level(session_id) != BUDGET_NORMAL:
+            transc_df = transc_df.sort_values("TransactionDate").tail(POST_CHAT_BUDGET_TRANSACTIONS)
 
         db_context = f"""
 Beneficiary:
@@ -281,7 +286,8 @@ Transactions:
 {transc_df.to_dict(orient="records")}
 """
         
-    last_5_history = SESSION_HISTORY[session_id][-5:]
+    history_turns = history_limit(session_id, 5, soft=2, hard=1)
+    last_5_history = (await SESSION_HISTORY.aget(session_id, []))[-history_turns:]
 
     prompt = f"""
 Conversation history:
@@ -294,16 +300,35 @@ User question:
 {user_message}
 """
 
-    bot_reply = call_llm(prompt)
+    try:
+        bot_reply = await call_llm(prompt, session_id)
+    except LLMUnavailable:
+        bot_reply = LLM_UNAVAILABLE_MESSAGE
+    return bot_reply, chart_url
+
 
-    SESSION_HISTORY[session_id].append({
+async def commit_post_chat(session_id: str, user_message: str, bot_reply: Optional[str],
+                           chart_url: Optional[str] = None):
+    """Record a post-application turn and build the API response"""
+    history = await SESSION_HISTORY.aget(session_id, [])
+
+    if bot_reply is None:
+        return {"response": "No records found", "history": history}
+
+    history.append({
         "user": user_message,
         "bot": bot_reply
     })
+    await SESSION_HISTORY.aset(session_id, history)
 
     return {
         "response": bot_reply,
         "transaction_chart_url": chart_url,
-        "history": SESSION_HISTORY[session_id][-5:]
+        "history": history[-5:]
     }
 
+
+@app.post("/post-application-chat")
+async def post_chat(req: ChatRequest):
+    bot_reply, chart_url = await draft_post_chat(req)
+    return await commit_post_chat(req.session_id, req.message, bot_reply, chart_url)
@@ -9,7 +9,10 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 from typing import Optional, Dict, Any, List, Set
-from openai import AzureOpenAI
+from llm_resilience import llm_call, llm_stream, record_usage, LLMUnavailable, LLM_UNAVAILABLE_MESSAGE
+from llm_usage import history_limit, max_tokens_for
+from llm_admission import set_traffic_class
+from cancellation import RequestCancelled, record_cancelled_work
 import requests
 from dotenv import load_dotenv
 from eligibility_rules import ELIGIBILITY_RULES, ELIGIBILITY_QUESTIONS
@@ -27,14 +30,19 @@ from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from fastapi import FastAPI, WebSocket, Request, HTTPException
 from starlette.responses import HTMLResponse
-from plivo import plivoxml
 from config import create_azure_speech_recognizer, azure_text_to_speech
 from database import get_user_by_phone
+from metrics import VOICE_ACTIVE_CALLS
 from models import (
     ChatRequest,
     ChatResponse,
 )
-import azure.cognitiveservices.speech as speechsdk
+from lazy_imports import lazy_import
+from session_store import session_store
+
+# Voice-only dependencies, loaded on the first call
+speechsdk = lazy_import("azure.cognitiveservices.speech")
+plivoxml = lazy_import("plivo.plivoxml")
 
 load_dotenv()
 
@@ -56,18 +64,11 @@ app.add_middleware(
 # Mount static files
 app.mount("/static", StaticFiles(directory="frontend/static"), name="static")
 
-# Initialize Azure OpenAI client
-client = AzureOpenAI(
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
-    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    api_version="2024-12-01-preview"
-)
-
-# Store conversation sessions (in-memory for POC)
-sessions: Dict[str, Dict] = {}
+# Conversation sessions and live calls (see session_store.py); write changes back with set()
+sessions = session_store.namespace("eligibility")
 HOST_URL = os.getenv('HOST_URL', 'wss://your-domain.com')
 
-voice_sessions = {}
+voice_sessions = session_store.namespace("voice")
 
 call_center_clients: Set[WebSocket] = set()
 
@@ -163,47 +164,113 @@ class ResetRequest(BaseModel):
     session_id: str = "default"
 
 
-def get_ai_response(session_id: str, user_message: str) -> str:
-    """Get response from Azure OpenAI for the eligibility agent"""
-    
+async def build_eligibility_messages(session_id: str, user_message: str) -> List[Dict]:
+    """System prompt + stored history (trimmed once over the token budget) + the new user turn"""
+    history = (await sessions.aget(session_id, {})).get("messages", [])
+    limit = history_limit(session_id)
+    if limit is not None:
+        history = history[-limit:] if limit else []
+    return (
+        [{"role": "system", "content": SYSTEM_PROMPT}]
+        + history
+        + [{"role": "user", "content": user_message}]
+    )
+
+
+async def draft_ai_response(session_id: str, user_message: str) -> str:
+    """Get the eligibility agent reply without touching session history"""
+    # Call Azure OpenAI API
+    response = await llm_call(
+        "eligibility",
+        session_id=session_id,
+        max_tokens=max_tokens_for(session_id, 1024),
+        messages=await build_eligibility_messages(session_id, user_message)
+    )
+
+    return response.choices[0].message.content
+
+
+async def commit_ai_response(session_id: str, user_message: str, assistant_message: Optional[str] = None):
+    """Record a turn in the session history (assistant part only if one was produced)"""
+
     # Initialize session if new
-    if session_id not in sessions:
-        sessions[session_id] = {
+    session = await sessions.aget(session_id)
+    if session is None:
+        session = {
             "messages": [],
             "eligibility_status": None,
             "checked_criteria": {}
         }
-    
+
     # Add user message to history
-    sessions[session_id]["messages"].append({
+    session["messages"].append({
         "role": "user",
         "content": user_message
     })
-    
-    try:
-        # Build messages with system prompt
-        messages_with_system = [{"role": "system", "content": SYSTEM_PROMPT}] + sessions[session_id]["messages"]
-        
-        # Call Azure OpenAI API
-        response = client.chat.completions.create(
-            model=os.getenv("AZURE_OPENAI_DEPLOYMENT"),
-            max_tokens=1024,
-            messages=messages_with_system
-        )
-        
-        assistant_message = response.choices[0].message.content
-        
-        # Add assistant response to history
-        sessions[session_id]["messages"].append({
+
+    # Add assistant response to history
+    if assistant_message is not None:
+        session["messages"].append({
             "role": "assistant",
             "content": assistant_message
         })
-        
-        return assistant_message
-        
+
+    await sessions.aset(session_id, session)
+
+
+async def stream_ai_response(session_id: str, user_message: str):
+    """
+    Stream the eligibility agent reply token by token.
+    The turn is committed to session history once the stream completes.
+    """
+    chunks = []
+    try:
+        stream = await llm_stream(
+            "eligibility_stream",
+            max_tokens=max_tokens_for(session_id, 1024),
+            messages=await build_eligibility_messages(session_id, user_message)
+        )
+
+        async for chunk in stream:
+            if chunk.usage:
+                record_usage("eligibility_stream", chunk.usage, session_id)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                chunks.append(delta)
+                yield delta
+
+    except LLMUnavailable:
+        await commit_ai_response(session_id, user_message)
+        yield LLM_UNAVAILABLE_MESSAGE
+        return
+    except RequestCancelled:
+        raise
+    except Exception as e:
+        await commit_ai_response(session_id, user_message)
+        yield f"Error: {str(e)}. Please check your API key."
+        return
+
+    await commit_ai_response(session_id, user_message, "".join(chunks))
+
+
+async def get_ai_response(session_id: str, user_message: str) -> str:
+    """Get response from Azure OpenAI for the eligibility agent"""
+    try:
+        assistant_message = await draft_ai_response(session_id, user_message)
+    except LLMUnavailable:
+        await commit_ai_response(session_id, user_message)
+        return LLM_UNAVAILABLE_MESSAGE
+    except RequestCancelled:
+        raise
     except Exception as e:
+        await commit_ai_response(session_id, user_message)
         return f"Error: {str(e)}. Please check your API key."
 
+    await commit_ai_response(session_id, user_message, assistant_message)
+    return assistant_message
+
 
 def check_eligibility_rule(criteria: str, value: Any) -> tuple:
     """Check a specific eligibility rule"""
@@ -246,7 +313,7 @@ async def chat(request: ChatRequest):
     if not request.message:
         raise HTTPException(status_code=400, detail="Message is required")
     
-    response = get_ai_response(request.session_id, request.message)
+    response = await get_ai_response(request.session_id, request.message)
     
     return ChatResponse(
         response=response,
@@ -343,8 +410,7 @@ async def get_rules():
 @app.post("/api/reset")
 async def reset_session(request: ResetRequest):
     """Reset a chat session"""
-    if request.session_id in sessions:
-        del sessions[request.session_id]
+    await sessions.adelete(request.session_id)
     
     return {"status": "Session reset successfully"}
 
@@ -383,7 +449,7 @@ async def get_speech_token():
     
     try:
         # Add timeout to prevent hanging
-        response = requests.post(fetch_token_url, headers=headers, timeout=10)
+        response = await asyncio.to_thread(requests.post, fetch_token_url, headers=headers, timeout=10)
         
         if response.status_code == 200:
             return {
@@ -459,7 +525,7 @@ async def handle_incoming_call(request: Request):
         call_uuid = form_data.get("CallUUID", f"call_{datetime.now().timestamp()}")
 
         # Validate beneficiary by mobile number
-        user_details = get_user_by_phone(caller_phone)
+        user_details = await asyncio.to_thread(get_user_by_phone, caller_phone)
 
         # Use BeneficiaryId
         beneficiary_id = user_details.get("BeneficiaryId", f"unknown_{datetime.now().timestamp()}")
@@ -474,7 +540,7 @@ async def handle_incoming_call(request: Request):
             "conversation_history": []
         }
 
-        voice_sessions[str(beneficiary_id)] = session_data
+        await voice_sessions.aset(str(beneficiary_id), session_data)
 
         print(f"✅ Session created for beneficiary_id: {beneficiary_id}")
 
@@ -566,8 +632,8 @@ async def handle_media_stream(websocket: WebSocket):
     # Wait for session
     session = None
     for _ in range(20):
-        if beneficiary_id_str in voice_sessions:
-            session = voice_sessions[beneficiary_id_str]
+        session = await voice_sessions.aget(beneficiary_id_str)
+        if session:
             break
         await asyncio.sleep(0.5)
 
@@ -581,6 +647,7 @@ async def handle_media_stream(websocket: WebSocket):
     recognizer, stream = create_azure_speech_recognizer()
 
     processing_response = False
+    pending_turn = None
     loop = asyncio.get_running_loop()
     def recognizing_handler(evt):
         partial = evt.result.text.strip()
@@ -588,7 +655,7 @@ async def handle_media_stream(websocket: WebSocket):
             print(f"[Partial] {partial}")
 
     def recognized_handler(evt):
-        nonlocal processing_response
+        nonlocal processing_response, pending_turn
 
         if evt.result.reason != speechsdk.ResultReason.RecognizedSpeech:
             return
@@ -619,6 +686,7 @@ async def handle_media_stream(websocket: WebSocket):
             "timestamp": datetime.now().isoformat()
         }
         session["conversation_history"].append(user_message)
+        voice_sessions.set(beneficiary_id_str, session)
 
         # ⭐ IMPORTANT: Broadcast transcript update immediately after user message
         asyncio.run_coroutine_threadsafe(
@@ -632,8 +700,9 @@ async def handle_media_stream(websocket: WebSocket):
 
         async def process_chat():
             nonlocal processing_response
+            set_traffic_class("voice")
             try:
-                reply = get_ai_response(
+                reply = await get_ai_response(
                     session_id=session["session_id"],
                     user_message=final_text,
                 )
@@ -647,6 +716,7 @@ async def handle_media_stream(websocket: WebSocket):
                     "timestamp": datetime.now().isoformat()
                 }
                 session["conversation_history"].append(assistant_message)
+                await voice_sessions.aset(beneficiary_id_str, session)
 
                 # ⭐ IMPORTANT: Broadcast transcript update after assistant response
                 await broadcast_to_call_center({
@@ -656,7 +726,7 @@ async def handle_media_stream(websocket: WebSocket):
                 })
 
                 # Convert text to speech and send to caller
-                audio = azure_text_to_speech(reply)
+                audio = await asyncio.to_thread(azure_text_to_speech, reply)
                 audio_b64 = base64.b64encode(audio).decode("utf-8")
 
                 if websocket.client_state == WebSocketState.CONNECTED:
@@ -675,11 +745,12 @@ async def handle_media_stream(websocket: WebSocket):
             finally:
                 processing_response = False
 
-        asyncio.run_coroutine_threadsafe(process_chat(), loop)
+        pending_turn = asyncio.run_coroutine_threadsafe(process_chat(), loop)
 
     recognizer.recognizing.connect(recognizing_handler)
     recognizer.recognized.connect(recognized_handler)
     recognizer.start_continuous_recognition()
+    VOICE_ACTIVE_CALLS.inc()
 
     try:
         async for message in websocket.iter_text():
@@ -695,16 +766,21 @@ async def handle_media_stream(websocket: WebSocket):
                 break
 
     finally:
+        VOICE_ACTIVE_CALLS.dec()
+        # The caller hung up: drop the reply still being generated
+        if pending_turn is not None and not pending_turn.done():
+            pending_turn.cancel()
+            record_cancelled_work("voice_turn")
         recognizer.stop_continuous_recognition()
         stream.close()
         # ⭐ IMPORTANT: Broadcast call_ended event
-        if beneficiary_id_str in voice_sessions:
+        if await voice_sessions.aget(beneficiary_id_str) is not None:
             await broadcast_to_call_center({
                 "type": "call_ended",
                 "beneficiary_id": beneficiary_id_str
             })
 
-            del voice_sessions[beneficiary_id_str]
+            await voice_sessions.adelete(beneficiary_id_str)
         print(f"📞 Session closed for beneficiary_id {beneficiary_id_str}")
 
 def serialize_for_json(obj):
@@ -722,8 +798,8 @@ async def call_center_websocket(websocket: WebSocket):
     try:
         # Send current active calls
         active_calls_data = []
-        for beneficiary_id, session in voice_sessions.items():
-            user_info = get_user_by_phone(session["caller_phone"])
+        for beneficiary_id, session in await voice_sessions.aitems():
+            user_info = await asyncio.to_thread(get_user_by_phone, session["caller_phone"])
 
             # Serialize user_info safely
             user_name = "Unknown User"
@@ -3,15 +3,18 @@ Ladki Bahin Yojana - Complete Application System (Language Selection: English/Hi
 FastAPI Backend with OCR, AI Parsing, Azure Blob Storage, and Database Integration
 """
 
-from fastapi import FastAPI, UploadFile, File, Form
+from fastapi import FastAPI, UploadFile, File, Form, Request, HTTPException, Header
 from fastapi.responses import JSONResponse
 import os
 import uuid
+import asyncio
 import re
 import json
 import logging
 import shutil
 import subprocess
+import threading
+from functools import lru_cache
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Optional, Dict, Any
@@ -21,16 +24,24 @@ import io
 # Load environment variables
 load_dotenv()
 
-# Azure Blob Storage
-from azure.storage.blob import BlobServiceClient, ContentSettings, BlobSasPermissions, generate_blob_sas
-
-# Tesseract OCR
-import pytesseract
-from PIL import Image
-from pdf2image import convert_from_path
-
-# Azure OpenAI for intelligent parsing
-from openai import AzureOpenAI
+from lazy_imports import lazy_import
+
+# Azure Blob Storage and Tesseract OCR are loaded on first upload / first OCR page
+azure_blob = lazy_import("azure.storage.blob")
+pytesseract = lazy_import("pytesseract")
+Image = lazy_import("PIL.Image")
+pdf2image = lazy_import("pdf2image")
+
+# Azure OpenAI for intelligent parsing (shared client)
+from llm_client import llm_client
+from llm_resilience import llm_call
+from tracing import traced, set_session_id
+from metrics import OCR_QUEUE_DEPTH
+from cancellation import check_cancelled, RequestCancelled
+from idempotency import idempotency_store, request_fingerprint, upload_fingerprint
+from session_store import session_store
+from registration_session import RegistrationSession
+from session_actors import SessionActors, protected
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -892,7 +903,7 @@ def initialize_blob_storage():
     
     try:
         account_url = f"https://{AZURE_SA_NAME}.blob.core.windows.net"
-        blob_service_client = BlobServiceClient(
+        blob_service_client = azure_blob.BlobServiceClient(
             account_url=account_url,
             credential=AZURE_SA_ACCESSKEY
         )
@@ -910,10 +921,24 @@ def initialize_blob_storage():
         return False
 
 
+_blob_init_lock = threading.Lock()
+
+def ensure_blob_storage() -> bool:
+    """Initialize blob storage on first use (startup warms it in the background)"""
+    if container_client is not None:
+        return True
+    with _blob_init_lock:
+        if container_client is not None:
+            return True
+        return initialize_blob_storage()
+
+
+@traced("blob.upload_to_blob")
 def upload_to_blob(file_content: bytes, application_id: str, document_type: str, file_extension: str) -> str:
     """Upload document to Azure Blob Storage (PRIVATE) and return SAS URL"""
+    check_cancelled("blob_upload")
     try:
-        if not container_client:
+        if not ensure_blob_storage():
             logger.error("❌ Blob storage not initialized")
             raise Exception("Blob storage not initialized")
         
@@ -922,18 +947,18 @@ def upload_to_blob(file_content: bytes, application_id: str, document_type: str,
         
         blob_client = container_client.get_blob_client(blob_name)
         
-        content_settings = ContentSettings(
+        content_settings = azure_blob.ContentSettings(
             content_type='application/pdf' if file_extension == '.pdf' else f'image/{file_extension[1:]}'
         )
         
         blob_client.upload_blob(file_content, overwrite=True, content_settings=content_settings)
         
-        sas_token = generate_blob_sas(
+        sas_token = azure_blob.generate_blob_sas(
             account_name=AZURE_SA_NAME,
             container_name=AZURE_STORAGE_CONTAINER_NAME,
             blob_name=blob_name,
             account_key=AZURE_SA_ACCESSKEY,
-            permission=BlobSasPermissions(read=True),
+            permission=azure_blob.BlobSasPermissions(read=True),
             expiry=datetime.utcnow() + timedelta(hours=10000)
         )
         
@@ -953,6 +978,8 @@ def download_from_blob(blob_url: str) -> bytes:
     """Download document from Azure Blob Storage for OCR processing"""
     try:
         blob_name = blob_url.split(f"{AZURE_STORAGE_CONTAINER_NAME}/")[1].split("?")[0]
+        if not ensure_blob_storage():
+            return b""
         blob_client = container_client.get_blob_client(blob_name)
         blob_data = blob_client.download_blob()
         return blob_data.readall()
@@ -965,6 +992,9 @@ def download_from_blob(blob_url: str) -> bytes:
 # CROSS-PLATFORM TESSERACT SETUP
 # ============================================
 
+# Installing Tesseract with apt-get blocks for minutes, so it is opt-in
+TESSERACT_AUTO_INSTALL = os.getenv("TESSERACT_AUTO_INSTALL", "false").lower() == "true"
+
 def setup_tesseract():
     """Configure Tesseract OCR for both Windows and Linux"""
     try:
@@ -980,6 +1010,8 @@ def setup_tesseract():
             if result:
                 pytesseract.pytesseract.tesseract_cmd = result
                 logger.info(f"✅ Linux: Tesseract found at {result}")
+            elif not TESSERACT_AUTO_INSTALL:
+                logger.error("❌ Linux: Tesseract not found. Install tesseract-ocr or set TESSERACT_AUTO_INSTALL=true")
             else:
                 logger.warning("⚠️ Linux: Tesseract not found. Attempting to install...")
                 try:
@@ -995,7 +1027,12 @@ def setup_tesseract():
     except Exception as e:
         logger.error(f"❌ Error configuring Tesseract: {e}")
 
-setup_tesseract()
+
+
+@lru_cache(maxsize=None)
+def ensure_tesseract():
+    """Run setup_tesseract() once, before the first OCR call"""
+    setup_tesseract()
 
 
 # ============================================
@@ -1009,8 +1046,8 @@ async def startup_event():
     try:
         logger.info("🚀 Starting application initialization...")
         
-        if not initialize_blob_storage():
-            logger.warning("⚠️ Blob storage initialization failed. Document uploads will not work.")
+        # Connect off the boot path; uploads call ensure_blob_storage() themselves
+        asyncio.get_running_loop().run_in_executor(None, ensure_blob_storage)
         
         logger.info("✅ Application startup complete!")
         
@@ -1020,22 +1057,15 @@ async def startup_event():
         logger.error(f"❌ Traceback: {traceback.format_exc()}")
         raise
 
-# Azure OpenAI Configuration
-AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT", "")
-AZURE_OPENAI_KEY = os.getenv("AZURE_OPENAI_API_KEY", "")
-AZURE_OPENAI_DEPLOYMENT = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME", "gpt-4o-mini")
-AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION", "2024-12-01-preview")
-
-openai_client = None
-if AZURE_OPENAI_ENDPOINT and AZURE_OPENAI_KEY:
-    openai_client = AzureOpenAI(
-        azure_endpoint=AZURE_OPENAI_ENDPOINT,
-        api_key=AZURE_OPENAI_KEY,
-        api_version=AZURE_OPENAI_API_VERSION
-    )
-    logger.info("✅ Azure OpenAI client initialized")
+# Azure OpenAI Configuration (see llm_client.py; deployment per call site in llm_tiers.py)
+openai_client = llm_client
 
-sessions = {}
+# Registration state machine per session (see session_store.py); saved at the end of each turn
+sessions = session_store.namespace("registration")
+
+# One turn at a time per session, across workers on a shared store; duplicate
+# messages share a turn (see session_actors.py)
+registration_actors = SessionActors("registration", locks=session_store)
 
 
 # ============================================
@@ -1104,25 +1134,33 @@ class DocumentIntelligence:
             "photograph": []
         }
     
+    @traced("ocr.extract_text_from_bytes")
     def extract_text_from_bytes(self, file_content: bytes, file_extension: str) -> str:
         """Extract raw text from file bytes using Tesseract OCR"""
         try:
+            ensure_tesseract()
             if file_extension.lower() == '.pdf':
                 import tempfile
                 with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp:
                     tmp.write(file_content)
                     tmp_path = tmp.name
                 
-                images = convert_from_path(tmp_path, dpi=300)
-                text = ""
-                for img in images:
-                    text += pytesseract.image_to_string(img, lang=self.tesseract_lang, config=self.tesseract_config)
-                
-                os.unlink(tmp_path)
+                try:
+                    images = pdf2image.convert_from_path(tmp_path, dpi=300)
+                    text = ""
+                    for img in images:
+                        # Stop between pages once the request is gone
+                        check_cancelled("ocr_page")
+                        text += pytesseract.image_to_string(img, lang=self.tesseract_lang, config=self.tesseract_config)
+                finally:
+                    os.unlink(tmp_path)
                 return text
             else:
+                check_cancelled("ocr_page")
                 img = Image.open(io.BytesIO(file_content))
                 return pytesseract.image_to_string(img, lang=self.tesseract_lang, config=self.tesseract_config)
+        except RequestCancelled:
+            raise
         except Exception as e:
             logger.error(f"OCR Error: {e}")
             return f"OCR Error: {str(e)}"
@@ -1178,7 +1216,8 @@ class DocumentIntelligence:
         
         return False, f"❌ **Name Mismatch!** The name on the document ('{extracted_name}') does not match the name you provided ('{expected_name}')."
     
-    def parse_with_ai(self, text: str, document_type: str) -> Dict[str, Any]:
+    @traced("ocr.parse_with_ai")
+    async def parse_with_ai(self, text: str, document_type: str) -> Dict[str, Any]:
         """Use AI to intelligently extract fields from OCR text"""
         
         if not openai_client:
@@ -1291,8 +1330,8 @@ Return JSON only."""
         prompt = prompts.get(document_type, f"Extract key information from:\n{text}\n\nReturn JSON.")
         
         try:
-            response = openai_client.chat.completions.create(
-                model=AZURE_OPENAI_DEPLOYMENT,
+            response = await llm_call(
+                "document_parse",
                 messages=[
                     {"role": "system", "content": "Extract structured data from OCR text. Return ONLY valid JSON with no markdown formatting."},
                     {"role": "user", "content": prompt}
@@ -1305,6 +1344,8 @@ Return JSON only."""
             result_text = result_text.replace('```json', '').replace('```', '').strip()
             return json.loads(result_text)
             
+        except RequestCancelled:
+            raise
         except Exception as e:
             logger.error(f"AI parsing error: {e}")
             return self.basic_extract(text, document_type)
@@ -1354,10 +1395,12 @@ Return JSON only."""
         key = name_keys.get(document_type, "name")
         return fields.get(key, "") or fields.get("name", "")
     
-    def analyze_document(self, file_content: bytes, file_extension: str, document_type: str, 
+    async def analyze_document(self, file_content: bytes, file_extension: str, document_type: str, 
                         blob_url: str, expected_name: str = None) -> Dict[str, Any]:
         """Complete document analysis with validation"""
-        raw_text = self.extract_text_from_bytes(file_content, file_extension)
+        # Tesseract / pdf2image are CPU-bound and blocking - keep them off the event loop
+        with OCR_QUEUE_DEPTH.track_inprogress():
+            raw_text = await asyncio.to_thread(self.extract_text_from_bytes, file_content, file_extension)
         
         is_valid_type, type_error = self.validate_document_type(raw_text, document_type)
         if not is_valid_type:
@@ -1370,7 +1413,7 @@ Return JSON only."""
                 "blob_url": blob_url
             }
         
-        structured_data = self.parse_with_ai(raw_text, document_type)
+        structured_data = await self.parse_with_ai(raw_text, document_type)
         
         if expected_name and document_type != "photograph":
             extracted_name = self.get_name_field(structured_data, document_type)
@@ -1436,64 +1479,44 @@ def mask_account(account: str) -> str:
 # CHATBOT LOGIC
 # ============================================
 
-def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dict = None):
+async def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dict = None):
+    """Run a registration turn after any turn already in progress for the session"""
+    key = (user_message,)
+    if file_uploaded:
+        key += (file_uploaded["name"], file_uploaded["doc_type"], len(file_uploaded["content"]))
+    return await registration_actors.submit(
+        session_id, key, lambda: registration_turn(session_id, user_message, file_uploaded)
+    )
+
+
+@traced("agent.form_filling")
+async def registration_turn(session_id: str, user_message: str = "", file_uploaded: dict = None):
     """Main chatbot conversation logic with language selection"""
+    set_session_id(session_id)
     
-    session = sessions.get(session_id)
+    session = await sessions.aget(session_id)
     if not session:
-        session = {
-            "step": "welcome",
-            "documents": {},
-            "extracted_data": {},
-            "personal_info": {},
-            "contact_info": {},
-            "bank_info": {},
-            "income_info": {},
-            "domicile_info": {},
-            "uploaded_docs": [],
-            "conversation": [],
-            "ration_card_color": None,
-            "domicile_proof_type": None,
-            "beneficiary_id": None,
-            "application_id": None
-        }
-        sessions[session_id] = session
+        session = RegistrationSession(session_id)
     
     if user_message:
-        session["conversation"].append({"role": "user", "message": user_message})
+        session.add_turn("user", user_message)
     
     # Handle RESTART command
     if user_message.upper() == "RESTART":
-        sessions[session_id] = {
-            "step": "welcome",
-            "documents": {},
-            "extracted_data": {},
-            "personal_info": {},
-            "contact_info": {},
-            "bank_info": {},
-            "income_info": {},
-            "domicile_info": {},
-            "uploaded_docs": [],
-            "conversation": [],
-            "ration_card_color": None,
-            "domicile_proof_type": None,
-            "beneficiary_id": None,
-            "application_id": None
-        }
-        session = sessions[session_id]
+        session = RegistrationSession(session_id)
     
     # Get language-specific messages
-    if "language" in session:
-        MESSAGES = get_messages_for_language(session["language"])
+    if session.language:
+        MESSAGES = get_messages_for_language(session.language)
     else:
         MESSAGES = MESSAGES_ENGLISH  # Default for welcome/language selection
     
-    current_step = session["step"]
+    current_step = session.step
     response = {}
     
     # STEP 1: WELCOME (All 3 languages)
     if current_step == "welcome":
-        session["step"] = "select_language"
+        session.step = "select_language"
         response = {
             "message": """🙏 नमस्कार! लाडकी बहीण योजनेत आपले स्वागत आहे!
 🙏 नमस्कार! लाडकी बहन योजना में आपका स्वागत है!
@@ -1530,8 +1553,8 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
             selected_lang = lang_map.get(user_message)
             
             if selected_lang:
-                session["language"] = selected_lang
-                session["step"] = "eligible_message"
+                session.language = selected_lang
+                session.step = "eligible_message"
                 
                 MESSAGES = get_messages_for_language(selected_lang)
                 
@@ -1552,8 +1575,8 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
     # STEP 3: COLLECT NAME
     elif current_step == "eligible_message" or current_step == "collect_name":
         if user_message:
-            session["personal_info"]["name"] = user_message
-            session["step"] = "collect_dob"
+            session.personal_info["name"] = user_message
+            session.step = "collect_dob"
             response = {
                 "message": MESSAGES["name_confirmed"].format(name=user_message),
                 "type": "success",
@@ -1570,9 +1593,9 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
     elif current_step == "collect_dob":
         if re.match(r'^\d{2}/\d{2}/\d{4}$', user_message):
             age = calculate_age(user_message)
-            session["personal_info"]["dob"] = user_message
-            session["personal_info"]["age"] = age
-            session["step"] = "collect_marital_status"
+            session.personal_info["dob"] = user_message
+            session.personal_info["age"] = age
+            session.step = "collect_marital_status"
             response = {
                 "message": MESSAGES["dob_confirmed"].format(dob=user_message, age=age),
                 "type": "success",
@@ -1589,8 +1612,8 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
     elif current_step == "collect_marital_status":
         status_map = {"1": "Married", "2": "Unmarried", "3": "Widow", "4": "Divorced"}
         status = status_map.get(user_message, user_message)
-        session["personal_info"]["marital_status"] = status
-        session["step"] = "collect_mobile"
+        session.personal_info["marital_status"] = status
+        session.step = "collect_mobile"
         response = {
             "message": MESSAGES["marital_confirmed"].format(status=status),
             "type": "success",
@@ -1600,8 +1623,8 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
     # STEP 6: COLLECT MOBILE
     elif current_step == "collect_mobile":
         if re.match(r'^[6-9]\d{9}$', user_message):
-            session["contact_info"]["mobile"] = user_message
-            session["step"] = "collect_email"
+            session.contact_info["mobile"] = user_message
+            session.step = "collect_email"
             response = {
                 "message": MESSAGES["mobile_confirmed"].format(mobile=user_message),
                 "type": "success",
@@ -1617,11 +1640,11 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
     # STEP 7: COLLECT EMAIL
     elif current_step == "collect_email":
         if user_message.lower() == "skip":
-            session["contact_info"]["email"] = ""
+            session.contact_info["email"] = ""
         else:
-            session["contact_info"]["email"] = user_message
-        session["step"] = "collect_address"
-        email_display = session["contact_info"]["email"] or "Skipped"
+            session.contact_info["email"] = user_message
+        session.step = "collect_address"
+        email_display = session.contact_info["email"] or "Skipped"
         response = {
             "message": MESSAGES["email_confirmed"].format(email=email_display),
             "type": "success",
@@ -1630,12 +1653,12 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
     
     # STEP 8: COLLECT ADDRESS
     elif current_step == "collect_address":
-        session["contact_info"]["address"] = user_message
+        session.contact_info["address"] = user_message
         
-        application_id = db_manager.generate_application_id() if db_manager else f"{datetime.now().strftime('%Y%m%d%H%M%S')}"
-        session["application_id"] = application_id
+        application_id = await asyncio.to_thread(db_manager.generate_application_id) if db_manager else f"{datetime.now().strftime('%Y%m%d%H%M%S')}"
+        session.application_id = application_id
         
-        session["step"] = "upload_aadhaar"
+        session.step = "upload_aadhaar"
         response = {
             "message": MESSAGES["address_saved"].format(app_id=application_id),
             "type": "info",
@@ -1645,10 +1668,11 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
     # STEP 9: UPLOAD AADHAAR
     elif current_step == "upload_aadhaar":
         if file_uploaded and file_uploaded.get("doc_type") == "aadhaar":
-            expected_name = session["personal_info"].get("name", "")
-            application_id = session.get("application_id")
+            expected_name = session.personal_info.get("name", "")
+            application_id = session.application_id
             
-            blob_url = upload_to_blob(
+            blob_url = await asyncio.to_thread(
+                upload_to_blob,
                 file_uploaded["content"],
                 application_id,
                 "aadhaar",
@@ -1662,7 +1686,7 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
                     "waiting_for": "aadhaar_upload"
                 }
             else:
-                result = doc_intelligence.analyze_document(
+                result = await doc_intelligence.analyze_document(
                     file_uploaded["content"],
                     file_uploaded["extension"],
                     "aadhaar",
@@ -1677,14 +1701,14 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
                         "waiting_for": "aadhaar_upload"
                     }
                 else:
-                    session["documents"]["aadhaar"] = result
-                    session["uploaded_docs"].append("aadhaar")
+                    await session.attach_document("aadhaar", result)
+                    session.uploaded_docs.append("aadhaar")
                     
                     fields = result.get("fields", {})
-                    session["extracted_data"]["aadhaar_number"] = fields.get("aadhaar_number", "")
-                    session["extracted_data"]["name_from_aadhaar"] = fields.get("name", "")
+                    session.extracted_data["aadhaar_number"] = fields.get("aadhaar_number", "")
+                    session.extracted_data["name_from_aadhaar"] = fields.get("name", "")
                     
-                    session["step"] = "select_domicile_proof"
+                    session.step = "select_domicile_proof"
                     
                     aadhaar_display = mask_aadhaar(fields.get("aadhaar_number", ""))
                     
@@ -1715,8 +1739,8 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
         
         if user_message in proof_map:
             doc_type, doc_name = proof_map[user_message]
-            session["domicile_proof_type"] = doc_type
-            session["step"] = "upload_domicile_proof"
+            session.domicile_proof_type = doc_type
+            session.step = "upload_domicile_proof"
             response = {
                 "message": MESSAGES["domicile_selected"].format(doc_name=doc_name),
                 "type": "info",
@@ -1731,14 +1755,15 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
     
     # STEP 11: UPLOAD DOMICILE PROOF
     elif current_step == "upload_domicile_proof":
-        domicile_type = session.get("domicile_proof_type")
+        domicile_type = session.domicile_proof_type
         
         if file_uploaded:
             doc_type = file_uploaded.get("doc_type")
-            expected_name = session["personal_info"].get("name", "")
-            application_id = session.get("application_id")
+            expected_name = session.personal_info.get("name", "")
+            application_id = session.application_id
             
-            blob_url = upload_to_blob(
+            blob_url = await asyncio.to_thread(
+                upload_to_blob,
                 file_uploaded["content"],
                 application_id,
                 doc_type,
@@ -1752,7 +1777,7 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
                     "waiting_for": f"{domicile_type}_upload"
                 }
             else:
-                result = doc_intelligence.analyze_document(
+                result = await doc_intelligence.analyze_document(
                     file_uploaded["content"],
                     file_uploaded["extension"],
                     doc_type,
@@ -1767,12 +1792,12 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
                         "waiting_for": f"{domicile_type}_upload"
                     }
                 else:
-                    session["documents"][doc_type] = result
-                    session["uploaded_docs"].append(doc_type)
+                    await session.attach_document(doc_type, result)
+                    session.uploaded_docs.append(doc_type)
                     
                     fields = result.get("fields", {})
                     
-                    session["domicile_info"] = {
+                    session.domicile_info = {
                         "type": doc_type,
                         "certificate_number": fields.get("certificate_number") or fields.get("card_number") or fields.get("voter_id_number"),
                         "district": fields.get("district", ""),
@@ -1781,7 +1806,7 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
                     }
                     
                     if doc_type == "ration_card":
-                        session["step"] = "ask_ration_color"
+                        session.step = "ask_ration_color"
                         response = {
                             "message": MESSAGES["ration_color"].format(
                                 card_number=fields.get("card_number", "Extracted"),
@@ -1791,7 +1816,7 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
                             "waiting_for": "ration_color"
                         }
                     else:
-                        session["step"] = "upload_income_certificate"
+                        session.step = "upload_income_certificate"
                         extra_info = ""
                         if doc_type == "voter_id" and fields.get("voter_id_number"):
                             extra_info = f"• Voter ID: {fields.get('voter_id_number')}\n"
@@ -1822,13 +1847,13 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
         color = color_map.get(user_message, user_message.capitalize())
         
         if color in ["Yellow", "Orange", "White"]:
-            session["ration_card_color"] = color
-            session["income_info"]["ration_card_type"] = color
+            session.ration_card_color = color
+            session.income_info["ration_card_type"] = color
             
-            ration_fields = session["documents"].get("ration_card", {}).get("fields", {})
+            ration_fields = (await session.document("ration_card")).get("fields", {})
             
             if color == "White":
-                session["step"] = "upload_income_certificate"
+                session.step = "upload_income_certificate"
                 response = {
                     "message": MESSAGES["ration_white"].format(color=color),
                     "type": "info",
@@ -1836,10 +1861,10 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
                 }
             else:
                 extracted_income = ration_fields.get("annual_income", "")
-                session["income_info"]["annual_income"] = extracted_income or "As per Ration Card"
-                session["income_info"]["source"] = "ration_card"
+                session.income_info["annual_income"] = extracted_income or "As per Ration Card"
+                session.income_info["source"] = "ration_card"
                 
-                session["step"] = "upload_bank_passbook"
+                session.step = "upload_bank_passbook"
                 response = {
                     "message": MESSAGES["ration_yellow_orange"].format(color=color),
                     "type": "success",
@@ -1855,10 +1880,11 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
     # STEP 13: UPLOAD INCOME CERTIFICATE
     elif current_step == "upload_income_certificate":
         if file_uploaded and file_uploaded.get("doc_type") == "income_certificate":
-            expected_name = session["personal_info"].get("name", "")
-            application_id = session.get("application_id")
+            expected_name = session.personal_info.get("name", "")
+            application_id = session.application_id
             
-            blob_url = upload_to_blob(
+            blob_url = await asyncio.to_thread(
+                upload_to_blob,
                 file_uploaded["content"],
                 application_id,
                 "income_certificate",
@@ -1872,7 +1898,7 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
                     "waiting_for": "income_certificate_upload"
                 }
             else:
-                result = doc_intelligence.analyze_document(
+                result = await doc_intelligence.analyze_document(
                     file_uploaded["content"],
                     file_uploaded["extension"],
                     "income_certificate",
@@ -1887,16 +1913,16 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
                         "waiting_for": "income_certificate_upload"
                     }
                 else:
-                    session["documents"]["income_certificate"] = result
-                    session["uploaded_docs"].append("income_certificate")
+                    await session.attach_document("income_certificate", result)
+                    session.uploaded_docs.append("income_certificate")
                     
                     fields = result.get("fields", {})
-                    session["income_info"]["certificate_number"] = fields.get("certificate_number", "")
-                    session["income_info"]["annual_income"] = fields.get("annual_income", "")
-                    session["income_info"]["issue_date"] = fields.get("issue_date", "")
-                    session["income_info"]["source"] = "income_certificate"
+                    session.income_info["certificate_number"] = fields.get("certificate_number", "")
+                    session.income_info["annual_income"] = fields.get("annual_income", "")
+                    session.income_info["issue_date"] = fields.get("issue_date", "")
+                    session.income_info["source"] = "income_certificate"
                     
-                    session["step"] = "upload_bank_passbook"
+                    session.step = "upload_bank_passbook"
                     
                     response = {
                         "message": MESSAGES["income_success"].format(
@@ -1917,10 +1943,11 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
     # STEP 14: UPLOAD BANK PASSBOOK
     elif current_step == "upload_bank_passbook":
         if file_uploaded and file_uploaded.get("doc_type") == "bank_passbook":
-            expected_name = session["personal_info"].get("name", "")
-            application_id = session.get("application_id")
+            expected_name = session.personal_info.get("name", "")
+            application_id = session.application_id
             
-            blob_url = upload_to_blob(
+            blob_url = await asyncio.to_thread(
+                upload_to_blob,
                 file_uploaded["content"],
                 application_id,
                 "bank_passbook",
@@ -1934,7 +1961,7 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
                     "waiting_for": "bank_passbook_upload"
                 }
             else:
-                result = doc_intelligence.analyze_document(
+                result = await doc_intelligence.analyze_document(
                     file_uploaded["content"],
                     file_uploaded["extension"],
                     "bank_passbook",
@@ -1949,15 +1976,15 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
                         "waiting_for": "bank_passbook_upload"
                     }
                 else:
-                    session["documents"]["bank_passbook"] = result
-                    session["uploaded_docs"].append("bank_passbook")
+                    await session.attach_document("bank_passbook", result)
+                    session.uploaded_docs.append("bank_passbook")
                     
                     fields = result.get("fields", {})
-                    session["bank_info"]["account_number"] = fields.get("account_number", "")
-                    session["bank_info"]["ifsc"] = fields.get("ifsc_code", "")
-                    session["bank_info"]["bank_name"] = fields.get("bank_name", "")
+                    session.bank_info["account_number"] = fields.get("account_number", "")
+                    session.bank_info["ifsc"] = fields.get("ifsc_code", "")
+                    session.bank_info["bank_name"] = fields.get("bank_name", "")
                     
-                    session["step"] = "upload_photograph"
+                    session.step = "upload_photograph"
                     
                     account_display = mask_account(fields.get("account_number", ""))
                     
@@ -1981,43 +2008,44 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
     # STEP 15: UPLOAD PHOTOGRAPH
     elif current_step == "upload_photograph":
         if file_uploaded and file_uploaded.get("doc_type") == "photograph":
-            application_id = session.get("application_id")
+            application_id = session.application_id
             
-            blob_url = upload_to_blob(
+            blob_url = await asyncio.to_thread(
+                upload_to_blob,
                 file_uploaded["content"],
                 application_id,
                 "photograph",
                 file_uploaded["extension"]
             )
             
-            session["documents"]["photograph"] = {"file_path": blob_url, "is_valid": True, "blob_url": blob_url}
-            session["uploaded_docs"].append("photograph")
+            await session.attach_document("photograph", {"file_path": blob_url, "is_valid": True, "blob_url": blob_url})
+            session.uploaded_docs.append("photograph")
             
-            session["step"] = "final_review"
+            session.step = "final_review"
             
-            name = session["personal_info"].get("name", "N/A")
-            dob = session["personal_info"].get("dob", "N/A")
-            age = session["personal_info"].get("age", "N/A")
-            marital = session["personal_info"].get("marital_status", "N/A")
-            mobile = session["contact_info"].get("mobile", "N/A")
-            email = session["contact_info"].get("email", "Not provided")
-            address = session["contact_info"].get("address", "N/A")
+            name = session.personal_info.get("name", "N/A")
+            dob = session.personal_info.get("dob", "N/A")
+            age = session.personal_info.get("age", "N/A")
+            marital = session.personal_info.get("marital_status", "N/A")
+            mobile = session.contact_info.get("mobile", "N/A")
+            email = session.contact_info.get("email", "Not provided")
+            address = session.contact_info.get("address", "N/A")
             
-            aadhaar_masked = mask_aadhaar(session["extracted_data"].get("aadhaar_number", ""))
-            account_masked = mask_account(session["bank_info"].get("account_number", ""))
+            aadhaar_masked = mask_aadhaar(session.extracted_data.get("aadhaar_number", ""))
+            account_masked = mask_account(session.bank_info.get("account_number", ""))
             
-            ifsc = session["bank_info"].get("ifsc", "N/A")
-            bank_name = session["bank_info"].get("bank_name", "N/A")
+            ifsc = session.bank_info.get("ifsc", "N/A")
+            bank_name = session.bank_info.get("bank_name", "N/A")
             
-            annual_income = session["income_info"].get("annual_income", "N/A")
-            ration_type = session["income_info"].get("ration_card_type", "N/A")
+            annual_income = session.income_info.get("annual_income", "N/A")
+            ration_type = session.income_info.get("ration_card_type", "N/A")
             
-            doc_count = len(session["uploaded_docs"])
+            doc_count = len(session.uploaded_docs)
             
             doc_list_items = []
             doc_list_items.append("✓ Aadhaar Card")
-            doc_list_items.append(f"✓ {DOCUMENT_TYPES.get(session.get('domicile_proof_type', ''), 'Domicile Proof')}")
-            if "income_certificate" in session["uploaded_docs"]:
+            doc_list_items.append(f"✓ {DOCUMENT_TYPES.get(session.domicile_proof_type or '', 'Domicile Proof')}")
+            if "income_certificate" in session.uploaded_docs:
                 doc_list_items.append("✓ Income Certificate")
             doc_list_items.append("✓ Bank Passbook")
             doc_list_items.append("✓ Photograph")
@@ -2054,7 +2082,7 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
     # STEP 16: FINAL REVIEW
     elif current_step == "final_review":
         if user_message.upper() == "YES":
-            session["step"] = "declaration"
+            session.step = "declaration"
             response = {
                 "message": MESSAGES["declaration"],
                 "type": "info",
@@ -2076,8 +2104,8 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
     # STEP 17: DECLARATION
     elif current_step == "declaration":
         if user_message.upper() == "I AGREE":
-            session["step"] = "submit_application"
-            session["declaration_accepted"] = True
+            session.step = "submit_application"
+            session.declaration_accepted = True
             response = {
                 "message": MESSAGES["declaration_accepted"],
                 "type": "success",
@@ -2093,106 +2121,113 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
     # STEP 18: SUBMIT APPLICATION
     elif current_step == "submit_application":
         if user_message.upper() == "SUBMIT":
-            session["step"] = "processing"
+            session.step = "processing"
             
-            aadhaar_number = session["extracted_data"].get("aadhaar_number", "")
-            if aadhaar_number and db_manager and db_manager.check_aadhaar_exists(aadhaar_number):
-                session["step"] = "completed"
+            aadhaar_number = session.extracted_data.get("aadhaar_number", "")
+            if aadhaar_number and db_manager and await asyncio.to_thread(db_manager.check_aadhaar_exists, aadhaar_number):
+                session.step = "completed"
                 response = {
                     "message": MESSAGES["aadhaar_exists"],
                     "type": "error",
                     "waiting_for": "restart"
                 }
             else:
-                application_id = session.get("application_id")
-                
-                if db_manager:
-                    try:
-                        dob_str = session["personal_info"].get("dob", "")
-                        dob_date = parse_date(dob_str)
-                        
-                        annual_income_raw = session["income_info"].get("annual_income", 0)
+                application_id = session.application_id
+
+                # The application rows and the session that records them are written
+                # together: the turn is not cancelled in between, or a retry would
+                # insert the application again
+                with protected():
+                    if db_manager:
                         try:
-                            annual_income = float(annual_income_raw) if annual_income_raw and str(annual_income_raw).replace('.','').isdigit() else 0
-                        except:
-                            annual_income = 0
+                            dob_str = session.personal_info.get("dob", "")
+                            dob_date = parse_date(dob_str)
                         
-                        beneficiary_data = {
-                            "username": session["contact_info"].get("mobile", ""),
-                            "password_hash": "",
-                            "aadhaar_number": aadhaar_number,
-                            "full_name": session["personal_info"].get("name", ""),
-                            "date_of_birth": dob_date,
-                            "gender": "F",
-                            "mobile_number": session["contact_info"].get("mobile", ""),
-                            "email": session["contact_info"].get("email", ""),
-                            "address": session["contact_info"].get("address", ""),
-                            "district": session["domicile_info"].get("district", ""),
-                            "taluka": session["domicile_info"].get("taluka", ""),
-                            "village": session["domicile_info"].get("village", ""),
-                            "annual_income": annual_income,
-                            "bank_account_no": session["bank_info"].get("account_number", ""),
-                            "bank_ifsc": session["bank_info"].get("ifsc", "")
-                        }
+                            annual_income_raw = session.income_info.get("annual_income", 0)
+                            try:
+                                annual_income = float(annual_income_raw) if annual_income_raw and str(annual_income_raw).replace('.','').isdigit() else 0
+                            except:
+                                annual_income = 0
                         
-                        beneficiary_id = db_manager.save_beneficiary_application(beneficiary_data, application_id)
-                        session["beneficiary_id"] = beneficiary_id
+                            beneficiary_data = {
+                                "username": session.contact_info.get("mobile", ""),
+                                "password_hash": "",
+                                "aadhaar_number": aadhaar_number,
+                                "full_name": session.personal_info.get("name", ""),
+                                "date_of_birth": dob_date,
+                                "gender": "F",
+                                "mobile_number": session.contact_info.get("mobile", ""),
+                                "email": session.contact_info.get("email", ""),
+                                "address": session.contact_info.get("address", ""),
+                                "district": session.domicile_info.get("district", ""),
+                                "taluka": session.domicile_info.get("taluka", ""),
+                                "village": session.domicile_info.get("village", ""),
+                                "annual_income": annual_income,
+                                "bank_account_no": session.bank_info.get("account_number", ""),
+                                "bank_ifsc": session.bank_info.get("ifsc", "")
+                            }
                         
-                        if beneficiary_id:
-                            for doc_type in session["uploaded_docs"]:
-                                doc_data = session["documents"].get(doc_type, {})
-                                fields = doc_data.get("fields", {})
-                                blob_url = doc_data.get("blob_url", "")
+                            beneficiary_id = await asyncio.to_thread(
+                                db_manager.save_beneficiary_application, beneficiary_data, application_id
+                            )
+                            session.beneficiary_id = beneficiary_id
+                        
+                            if beneficiary_id:
+                                for doc_type in session.uploaded_docs:
+                                    doc_data = await session.document(doc_type)
+                                    fields = doc_data.get("fields", {})
+                                    blob_url = doc_data.get("blob_url", "")
                                 
-                                document_entry = {
-                                    "beneficiary_id": application_id,
-                                    "mobile_number": session["contact_info"].get("mobile", ""),
-                                    "aadhaar_number": aadhaar_number,
-                                    "document_type": doc_type,
-                                    "document_url": blob_url,
-                                    "full_name": session["personal_info"].get("name", ""),
-                                }
+                                    document_entry = {
+                                        "beneficiary_id": application_id,
+                                        "mobile_number": session.contact_info.get("mobile", ""),
+                                        "aadhaar_number": aadhaar_number,
+                                        "document_type": doc_type,
+                                        "document_url": blob_url,
+                                        "full_name": session.personal_info.get("name", ""),
+                                    }
                                 
-                                if doc_type == "income_certificate":
-                                    document_entry["income_certificate_number"] = fields.get("certificate_number")
-                                    document_entry["income_cert_issue_date"] = parse_date(fields.get("issue_date", ""))
-                                    try:
-                                        document_entry["annual_income_amount"] = float(fields.get("annual_income", 0) or 0)
-                                    except:
-                                        document_entry["annual_income_amount"] = 0
+                                    if doc_type == "income_certificate":
+                                        document_entry["income_certificate_number"] = fields.get("certificate_number")
+                                        document_entry["income_cert_issue_date"] = parse_date(fields.get("issue_date", ""))
+                                        try:
+                                            document_entry["annual_income_amount"] = float(fields.get("annual_income", 0) or 0)
+                                        except:
+                                            document_entry["annual_income_amount"] = 0
                                 
-                                elif doc_type == "bank_passbook":
-                                    document_entry["bank_account_number"] = fields.get("account_number")
-                                    document_entry["bank_ifsc"] = fields.get("ifsc_code")
-                                    document_entry["bank_name"] = fields.get("bank_name")
+                                    elif doc_type == "bank_passbook":
+                                        document_entry["bank_account_number"] = fields.get("account_number")
+                                        document_entry["bank_ifsc"] = fields.get("ifsc_code")
+                                        document_entry["bank_name"] = fields.get("bank_name")
                                 
-                                elif doc_type == "domicile_certificate":
-                                    document_entry["domicile_certificate_number"] = fields.get("certificate_number")
-                                    document_entry["domicile_issuing_district"] = fields.get("district")
-                                    document_entry["domicile_issue_date"] = parse_date(fields.get("issue_date", ""))
-                                    document_entry["residence_district"] = fields.get("district")
-                                    document_entry["residence_taluka"] = fields.get("taluka")
-                                    document_entry["residence_village"] = fields.get("village")
+                                    elif doc_type == "domicile_certificate":
+                                        document_entry["domicile_certificate_number"] = fields.get("certificate_number")
+                                        document_entry["domicile_issuing_district"] = fields.get("district")
+                                        document_entry["domicile_issue_date"] = parse_date(fields.get("issue_date", ""))
+                                        document_entry["residence_district"] = fields.get("district")
+                                        document_entry["residence_taluka"] = fields.get("taluka")
+                                        document_entry["residence_village"] = fields.get("village")
                                 
-                                elif doc_type == "ration_card":
-                                    document_entry["ration_card_number"] = fields.get("card_number")
-                                    document_entry["ration_card_type"] = session["income_info"].get("ration_card_type")
-                                    document_entry["ration_card_issue_date"] = parse_date(fields.get("issue_date", ""))
+                                    elif doc_type == "ration_card":
+                                        document_entry["ration_card_number"] = fields.get("card_number")
+                                        document_entry["ration_card_type"] = session.income_info.get("ration_card_type")
+                                        document_entry["ration_card_issue_date"] = parse_date(fields.get("issue_date", ""))
                                 
-                                elif doc_type == "voter_id":
-                                    document_entry["voter_id_number"] = fields.get("voter_id_number")
+                                    elif doc_type == "voter_id":
+                                        document_entry["voter_id_number"] = fields.get("voter_id_number")
                                 
-                                db_manager.save_document(document_entry)
+                                    await asyncio.to_thread(db_manager.save_document, document_entry)
                     
-                    except Exception as e:
-                        logger.error(f"Database save error: {e}")
+                        except Exception as e:
+                            logger.error(f"Database save error: {e}")
                 
-                session["step"] = "completed"
-                session["status"] = "SUBMITTED"
-                session["submitted_at"] = datetime.now().isoformat()
+                    session.step = "completed"
+                    session.status = "SUBMITTED"
+                    session.submitted_at = datetime.now().isoformat()
+                    await sessions.aset(session_id, session)
                 
-                name = session["personal_info"].get("name", "Applicant")
-                mobile = session["contact_info"].get("mobile", "XXXXXXXXXX")
+                name = session.personal_info.get("name", "Applicant")
+                mobile = session.contact_info.get("mobile", "XXXXXXXXXX")
                 
                 response = {
                     "message": MESSAGES["success"].format(name=name, app_id=application_id, mobile=mobile),
@@ -2210,7 +2245,7 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
     # STEP 19: COMPLETED
     elif current_step == "completed":
         response = {
-            "message": MESSAGES["restart_prompt"].format(app_id=session.get('application_id', 'N/A')),
+            "message": MESSAGES["restart_prompt"].format(app_id=session.application_id or 'N/A'),
             "type": "success",
             "waiting_for": "restart"
         }
@@ -2222,7 +2257,8 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
             "waiting_for": "restart"
         }
     
-    session["conversation"].append({"role": "assistant", "message": response["message"]})
+    session.add_turn("assistant", response["message"])
+    await sessions.aset(session_id, session)
     return response
 
 
@@ -2232,10 +2268,12 @@ def get_bot_response(session_id: str, user_message: str = "", file_uploaded: dic
 
 @app.post("/api/chat")
 async def chat_endpoint(
+    request: Request,
     session_id: str = Form(...),
     message: str = Form(""),
     file: Optional[UploadFile] = File(None),
-    doc_type: str = Form("aadhaar")
+    doc_type: str = Form("aadhaar"),
+    idempotency_key: Optional[str] = Header(None)
 ):
     try:
         file_uploaded = None
@@ -2251,9 +2289,17 @@ async def chat_endpoint(
                 "doc_type": doc_type
             }
         
-        response = get_bot_response(session_id, message, file_uploaded)
+        response = await idempotency_store.run(
+            request,
+            idempotency_key,
+            request_fingerprint(session_id, message, doc_type, upload_fingerprint(file)),
+            lambda: get_bot_response(session_id, message, file_uploaded),
+            endpoint="registration"
+        )
         return response
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error: {e}")
         return JSONResponse({"error": str(e), "message": "An error occurred. Please try again."}, status_code=500)
@@ -2262,7 +2308,7 @@ async def chat_endpoint(
 @app.post("/api/start-session")
 async def start_session():
     session_id = str(uuid.uuid4())
-    response = get_bot_response(session_id)
+    response = await get_bot_response(session_id)
     return {"session_id": session_id, "message": response["message"]}
 
 
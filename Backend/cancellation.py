@@ -0,0 +1,145 @@
+# cancellation.py - Request deadlines and cancellation on client disconnect
+#
+# Chat endpoints run their work through run_cancellable(). It opens a
+# CancelScope (a deadline carried in a contextvar) and cancels the work when
+# the HTTP client disconnects or the deadline expires.
+#
+# Downstream code reads the same scope:
+#   - llm_resilience caps each call's deadline at the time the request has left
+#   - blocking OCR / blob-upload threads call check_cancelled() between steps
+#     (asyncio.to_thread copies the contextvar, so threads see the scope)
+#
+# Skipped and aborted work is counted in cancelled_work_total{kind} and
+# cancelled_llm_tokens_total.
+import os
+import time
+import asyncio
+import logging
+import contextvars
+from contextlib import contextmanager
+from typing import Optional
+
+from fastapi import HTTPException, Response
+
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "60"))
+DISCONNECT_POLL_SECONDS = float(os.getenv("DISCONNECT_POLL_SECONDS", "0.25"))
+
+REASON_DISCONNECT = "disconnect"
+REASON_DEADLINE = "deadline"
+
+REQUESTS_CANCELLED = Counter(
+    "requests_cancelled", "Requests cancelled before completion by endpoint and reason", ("endpoint", "reason")
+)
+CANCELLED_WORK = Counter(
+    "cancelled_work", "Downstream work aborted or skipped because its request was cancelled", ("kind",)
+)
+CANCELLED_LLM_TOKENS = Counter(
+    "cancelled_llm_tokens", "Estimated LLM tokens not spent because calls were cancelled"
+)
+
+_scope = contextvars.ContextVar("cancel_scope", default=None)
+
+
+class RequestCancelled(Exception):
+    """The request's client went away or its deadline expired"""
+
+    def __init__(self, reason: str):
+        super().__init__(f"request cancelled ({reason})")
+        self.reason = reason
+
+
+class CancelScope:
+    __slots__ = ("deadline", "reason")
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.reason = None
+
+    def cancel(self, reason: str):
+        if self.reason is None:
+            self.reason = reason
+
+    @property
+    def cancelled(self) -> bool:
+        if self.reason is None and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.reason = REASON_DEADLINE
+        return self.reason is not None
+
+    def remaining(self) -> Optional[float]:
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+
+@contextmanager
+def cancel_scope(timeout: Optional[float] = None):
+    scope = CancelScope(timeout)
+    token = _scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _scope.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current request's deadline (None outside a scope)"""
+    scope = _scope.get()
+    return scope.remaining() if scope is not None else None
+
+
+def record_cancelled_request(endpoint: str, reason: str):
+    REQUESTS_CANCELLED.labels(endpoint, reason).inc()
+    logger.info(f"🛑 {endpoint} request cancelled ({reason})")
+
+
+def record_cancelled_work(kind: str, llm_tokens: int = 0):
+    CANCELLED_WORK.labels(kind).inc()
+    if llm_tokens:
+        CANCELLED_LLM_TOKENS.inc(llm_tokens)
+
+
+def check_cancelled(kind: str):
+    """Raise RequestCancelled (and count `kind` as saved work) if the request is gone"""
+    scope = _scope.get()
+    if scope is not None and scope.cancelled:
+        record_cancelled_work(kind)
+        raise RequestCancelled(scope.reason)
+
+
+async def run_cancellable(request, work, endpoint: str, timeout: float = REQUEST_DEADLINE_SECONDS):
+    """
+    Await `work` (a coroutine) under a deadline, cancelling it if the client
+    disconnects first. Disconnects return 499, expired deadlines raise 504.
+    """
+    with cancel_scope(timeout) as scope:
+        task = asyncio.ensure_future(work)
+        try:
+            while True:
+                wait = DISCONNECT_POLL_SECONDS
+                left = scope.remaining()
+                if left is not None:
+                    wait = max(0.0, min(wait, left))
+                done, _ = await asyncio.wait({task}, timeout=wait)
+                if done:
+                    break
+                if request is not None and await request.is_disconnected():
+                    scope.cancel(REASON_DISCONNECT)
+                if scope.cancelled:
+                    task.cancel()
+                    await asyncio.wait({task})
+                    break
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+
+        if task.cancelled() or isinstance(task.exception(), RequestCancelled):
+            reason = scope.reason or REASON_DEADLINE
+            record_cancelled_request(endpoint, reason)
+            if reason == REASON_DISCONNECT:
+                return Response(status_code=499)
+            raise HTTPException(status_code=504, detail="Request deadline exceeded")
+        return task.result()
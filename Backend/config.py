@@ -1,25 +1,34 @@
 # config.py - Azure Speech Services Configuration
 import os
 import audioop
-import azure.cognitiveservices.speech as speechsdk
 import base64
-from dotenv import load_dotenv
-from pydub.playback import play
 import io
-from pydub import AudioSegment
+from functools import lru_cache
+from dotenv import load_dotenv
+
+from tracing import traced
+from lazy_imports import lazy_import
 
 load_dotenv()
 
-# Initialize Azure Speech Config
-speech_config = speechsdk.SpeechConfig(
-    subscription=os.getenv("AZURE_SPEECH_KEY"),
-    region=os.getenv("AZURE_SPEECH_REGION")
-)
+# The Speech SDK is only loaded once a call needs it
+speechsdk = lazy_import("azure.cognitiveservices.speech")
 
-# speech_synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config)
-speech_config.speech_synthesis_voice_name = "en-US-JennyNeural"
 
+@lru_cache(maxsize=None)
+def get_speech_config():
+    """Azure Speech Config, created on first use"""
+    speech_config = speechsdk.SpeechConfig(
+        subscription=os.getenv("AZURE_SPEECH_KEY"),
+        region=os.getenv("AZURE_SPEECH_REGION")
+    )
+
+    # speech_synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config)
+    speech_config.speech_synthesis_voice_name = "en-US-JennyNeural"
+    return speech_config
 
+
+@traced("tts.azure_text_to_speech")
 def azure_text_to_speech(text, lang_code='en-US'):
     """
     Convert text to speech using Azure Speech Services
@@ -31,6 +40,8 @@ def azure_text_to_speech(text, lang_code='en-US'):
     Returns:
         bytes: Raw PCM16 audio bytes in mu-law format (8kHz)
     """
+    speech_config = get_speech_config()
+
     # Select voice based on language
     if lang_code == 'hi-IN':
         speech_config.speech_synthesis_voice_name = "hi-IN-SwaraNeural"
@@ -67,6 +78,9 @@ def play_audio_from_base64(audio_base64):
     if audio_base64 is None:
         return
 
+    from pydub import AudioSegment
+    from pydub.playback import play
+
     audio_bytes = base64.b64decode(audio_base64)
     audio = AudioSegment.from_wav(io.BytesIO(audio_bytes))
     play(audio)
@@ -124,7 +138,7 @@ def create_azure_speech_recognizer():
     )
 
     recognizer = speechsdk.SpeechRecognizer(
-        speech_config=speech_config,
+        speech_config=get_speech_config(),
         audio_config=audio_config,
         auto_detect_source_language_config=auto_detect_config
     )
@@ -5,12 +5,17 @@ Uses pymssql driver
 """
 
 import os
+import time
+import functools
 import pymssql
 import logging
 from datetime import datetime
 from typing import Optional, Dict, Any, List
 from dotenv import load_dotenv
 
+from tracing import traced
+from metrics import DB_QUERY_SECONDS, DB_CONNECTIONS_IN_USE, DB_CONNECTIONS_OPENED
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
@@ -30,9 +35,28 @@ DB_CONFIG = {
 # ============================================
 # Connection Helpers
 # ============================================
+def db_query(name: str):
+    """Trace a query function and record its latency / connection usage metrics"""
+    def decorator(func):
+        traced_func = traced(f"db.{name}")(func)
+        histogram = DB_QUERY_SECONDS.labels(name)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            with DB_CONNECTIONS_IN_USE.track_inprogress():
+                try:
+                    return traced_func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
 def get_db_connection(as_dict: bool = True):
     """Get a new database connection"""
     try:
+        DB_CONNECTIONS_OPENED.inc()
         return pymssql.connect(
             server=DB_CONFIG["server"],
             port=DB_CONFIG["port"],
@@ -57,6 +81,7 @@ def row_to_dict(cursor, row) -> Optional[Dict]:
 # ============================================
 # Standalone Query Functions (used by eligibility.py, main.py)
 # ============================================
+@db_query("get_user_by_phone")
 def get_user_by_phone(phone_number: str) -> Optional[Dict]:
     """
     Get beneficiary details by mobile number
@@ -93,6 +118,7 @@ def get_user_by_phone(phone_number: str) -> Optional[Dict]:
             conn.close()
 
 
+@db_query("get_beneficiary_by_aadhaar_last4")
 def get_beneficiary_by_aadhaar_last4(aadhaar_last4: str) -> Optional[int]:
     """
     Get BeneficiaryId by last 4 digits of Aadhaar
@@ -119,6 +145,7 @@ def get_beneficiary_by_aadhaar_last4(aadhaar_last4: str) -> Optional[int]:
             conn.close()
 
 
+@db_query("get_beneficiary_details")
 def get_beneficiary_details(beneficiary_id: int) -> Optional[Dict]:
     """
     Get full beneficiary details by ID
@@ -144,6 +171,7 @@ def get_beneficiary_details(beneficiary_id: int) -> Optional[Dict]:
             conn.close()
 
 
+@db_query("get_beneficiary_transactions")
 def get_beneficiary_transactions(beneficiary_id: int) -> List[Dict]:
     """
     Get all transactions for a beneficiary
@@ -201,6 +229,7 @@ class DatabaseManager:
             self.connect()
         return self.connection.cursor()
 
+    @db_query("generate_application_id")
     def generate_application_id(self) -> int:
         """Generate unique 14-digit application ID: YYYYMMDD + 6 random digits"""
         import random
@@ -218,6 +247,7 @@ class DatabaseManager:
         import time
         return int(datetime.now().strftime("%Y%m%d") + str(int(time.time() * 1000))[-6:])
 
+    @db_query("check_beneficiary_exists")
     def check_beneficiary_exists(self, beneficiary_id: int) -> bool:
         """Check if BeneficiaryId exists"""
         try:
@@ -232,6 +262,7 @@ class DatabaseManager:
             logger.error(f"Error checking beneficiary existence: {e}")
             return False
 
+    @db_query("check_aadhaar_exists")
     def check_aadhaar_exists(self, aadhaar_number: str) -> bool:
         """Check if Aadhaar already registered"""
         try:
@@ -246,6 +277,7 @@ class DatabaseManager:
             logger.error(f"Error checking aadhaar existence: {e}")
             return False
 
+    @db_query("save_beneficiary_application")
     def save_beneficiary_application(self, data: Dict[str, Any], beneficiary_id: int) -> Optional[int]:
         """Save new beneficiary application"""
         try:
@@ -314,6 +346,7 @@ class DatabaseManager:
                 self.connection.rollback()
             return None
 
+    @db_query("save_document")
     def save_document(self, data: Dict[str, Any]) -> Optional[int]:
         """Save document record"""
         try:
@@ -379,6 +412,7 @@ class DatabaseManager:
                 self.connection.rollback()
             return None
 
+    @db_query("update_beneficiary_status")
     def update_beneficiary_status(self, beneficiary_id: int, status: str) -> bool:
         """Update application status"""
         try:
@@ -393,6 +427,7 @@ class DatabaseManager:
             logger.error(f"Error updating status: {e}")
             return False
 
+    @db_query("get_application_by_id")
     def get_application_by_id(self, application_id: str) -> Optional[Dict]:
         """Retrieve application by ID"""
         try:
@@ -0,0 +1,227 @@
+# idempotency.py - Idempotency-Key support for chat and upload requests
+#
+# A POST carrying an Idempotency-Key header runs at most once per key:
+#   - a retry after completion gets the stored response back
+#     (Idempotent-Replayed: true) without re-running OCR / uploads / LLM calls
+#   - a duplicate arriving while the first is still running waits for it
+#   - reusing a key with a different request body is rejected with 422
+#
+# The work runs in its own task and cancel scope, shared by every request
+# waiting on it. When all of them have disconnected it keeps running for
+# IDEMPOTENCY_ORPHAN_GRACE_SECONDS (within its request deadline), so a client
+# retrying after a dropped connection joins it or gets its stored response
+# instead of starting OCR / uploads / LLM calls again.
+# Responses are kept in a bounded LRU store (entries, bytes, TTL); failed
+# executions are not stored, so the next retry runs again.
+#
+# The store is per process: with several workers, a client's retries must be
+# routed to the same worker (sticky sessions), otherwise they run again.
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from fastapi import HTTPException, Response
+from fastapi.encoders import jsonable_encoder
+
+from cancellation import cancel_scope, run_cancellable, REQUEST_DEADLINE_SECONDS, REASON_DISCONNECT
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "5000"))
+IDEMPOTENCY_MAX_BYTES = int(os.getenv("IDEMPOTENCY_MAX_BYTES", str(32 * 1024 * 1024)))
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "900"))
+# Seconds an execution keeps running with nobody waiting for it (0 = cancel at once)
+IDEMPOTENCY_ORPHAN_GRACE_SECONDS = float(os.getenv("IDEMPOTENCY_ORPHAN_GRACE_SECONDS", "30"))
+
+IDEMPOTENT_REQUESTS = Counter(
+    "idempotent_requests", "Requests with an Idempotency-Key by outcome", ("endpoint", "outcome")
+)
+
+
+def request_fingerprint(*parts) -> str:
+    """Hash of the request fields that must match when a key is reused"""
+    raw = "\x1f".join("" if part is None else str(part) for part in parts)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def upload_fingerprint(file) -> Optional[str]:
+    """Identify an UploadFile without reading it"""
+    if file is None or not getattr(file, "filename", None):
+        return None
+    return f"{file.filename}:{getattr(file, 'size', '')}"
+
+
+class _StoredResponse:
+    __slots__ = ("fingerprint", "status_code", "body", "media_type", "expires_at")
+
+    def __init__(self, fingerprint: str, status_code: int, body: bytes, media_type: str):
+        self.fingerprint = fingerprint
+        self.status_code = status_code
+        self.body = body
+        self.media_type = media_type
+        self.expires_at = time.monotonic() + IDEMPOTENCY_TTL_SECONDS
+
+    def to_response(self) -> Response:
+        return Response(
+            content=self.body, status_code=self.status_code, media_type=self.media_type,
+            headers={"Idempotent-Replayed": "true"}
+        )
+
+
+class _Execution:
+    __slots__ = ("fingerprint", "task", "scope", "waiters", "orphaned")
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.task = None
+        self.scope = None
+        self.waiters = 0
+        self.orphaned = None   # timer that cancels the work once the grace period ends
+
+
+def _stored(fingerprint: str, result) -> Optional[_StoredResponse]:
+    """What to keep for replay; None for results that should run again on retry"""
+    if isinstance(result, Response):
+        if result.status_code >= 500 or not hasattr(result, "body"):
+            return None
+        return _StoredResponse(fingerprint, result.status_code, bytes(result.body), result.media_type)
+    body = json.dumps(jsonable_encoder(result), ensure_ascii=False).encode("utf-8")
+    return _StoredResponse(fingerprint, 200, body, "application/json")
+
+
+class IdempotencyStore:
+    """Bounded LRU of finished responses plus the executions still in flight (event loop only)"""
+
+    def __init__(self, max_entries: int = IDEMPOTENCY_MAX_ENTRIES, max_bytes: int = IDEMPOTENCY_MAX_BYTES,
+                 orphan_grace: float = IDEMPOTENCY_ORPHAN_GRACE_SECONDS):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.orphan_grace = orphan_grace
+        self._responses: "OrderedDict[str, _StoredResponse]" = OrderedDict()
+        self._inflight = {}
+        self.bytes = 0
+        self.evictions = 0
+        self.orphans_cancelled = 0
+
+    async def run(self, request, key: Optional[str], fingerprint: str, make_work: Callable, endpoint: str):
+        """Run make_work() once per (endpoint, key); without a key this is run_cancellable()"""
+        if not key:
+            return await run_cancellable(request, make_work(), endpoint)
+
+        store_key = f"{endpoint}:{key}"
+        stored = self._get(store_key)
+        if stored is not None:
+            self._check_fingerprint(stored.fingerprint, fingerprint, endpoint)
+            IDEMPOTENT_REQUESTS.labels(endpoint, "replayed").inc()
+            return stored.to_response()
+
+        execution = self._inflight.get(store_key)
+        if execution is not None:
+            self._check_fingerprint(execution.fingerprint, fingerprint, endpoint)
+            IDEMPOTENT_REQUESTS.labels(endpoint, "joined").inc()
+        else:
+            execution = self._start(store_key, fingerprint, make_work)
+            IDEMPOTENT_REQUESTS.labels(endpoint, "executed").inc()
+
+        return await run_cancellable(request, self._wait(execution), endpoint)
+
+    def _check_fingerprint(self, expected: str, fingerprint: str, endpoint: str):
+        if expected != fingerprint:
+            IDEMPOTENT_REQUESTS.labels(endpoint, "mismatch").inc()
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+
+    def _start(self, store_key: str, fingerprint: str, make_work: Callable) -> _Execution:
+        execution = _Execution(fingerprint)
+        # Own scope: one waiter disconnecting must not cancel work others still wait for
+        with cancel_scope(REQUEST_DEADLINE_SECONDS) as scope:
+            execution.task = asyncio.ensure_future(make_work())
+        execution.scope = scope
+        self._inflight[store_key] = execution
+        execution.task.add_done_callback(lambda task: self._finish(store_key, execution, task))
+        return execution
+
+    async def _wait(self, execution: _Execution):
+        execution.waiters += 1
+        if execution.orphaned is not None:
+            execution.orphaned.cancel()
+            execution.orphaned = None
+        try:
+            return await asyncio.shield(execution.task)
+        finally:
+            execution.waiters -= 1
+            if execution.waiters == 0 and not execution.task.done():
+                # Leave room for the client's retry to join before giving the work up
+                execution.orphaned = asyncio.get_running_loop().call_later(
+                    self.orphan_grace, self._cancel_orphan, execution
+                )
+
+    def _cancel_orphan(self, execution: _Execution):
+        execution.orphaned = None
+        if execution.waiters == 0 and not execution.task.done():
+            self.orphans_cancelled += 1
+            execution.scope.cancel(REASON_DISCONNECT)
+            execution.task.cancel()
+
+    def _finish(self, store_key: str, execution: _Execution, task: asyncio.Task):
+        if self._inflight.get(store_key) is execution:
+            del self._inflight[store_key]
+        if execution.orphaned is not None:
+            execution.orphaned.cancel()
+            execution.orphaned = None
+        if task.cancelled() or task.exception() is not None:
+            return
+        try:
+            stored = _stored(execution.fingerprint, task.result())
+        except (TypeError, ValueError) as e:
+            logger.warning(f"⚠️ Response for idempotency key not storable: {e}")
+            return
+        if stored is not None:
+            self._put(store_key, stored)
+
+    def _get(self, store_key: str) -> Optional[_StoredResponse]:
+        stored = self._responses.get(store_key)
+        if stored is None:
+            return None
+        if stored.expires_at < time.monotonic():
+            self._remove(store_key)
+            return None
+        self._responses.move_to_end(store_key)
+        return stored
+
+    def _put(self, store_key: str, stored: _StoredResponse):
+        if self.max_entries <= 0 or len(stored.body) > self.max_bytes:
+            return
+        self._remove(store_key)
+        self._responses[store_key] = stored
+        self.bytes += len(stored.body)
+        while len(self._responses) > self.max_entries or self.bytes > self.max_bytes:
+            oldest = next(iter(self._responses))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, store_key: str):
+        stored = self._responses.pop(store_key, None)
+        if stored is not None:
+            self.bytes -= len(stored.body)
+
+    def stats(self) -> dict:
+        return {
+            "stored": len(self._responses),
+            "stored_bytes": self.bytes,
+            "in_flight": len(self._inflight),
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": IDEMPOTENCY_TTL_SECONDS,
+            "orphan_grace_seconds": self.orphan_grace,
+            "evictions": self.evictions,
+            "orphans_cancelled": self.orphans_cancelled,
+        }
+
+
+idempotency_store = IdempotencyStore()
@@ -0,0 +1,143 @@
+# import_profile.py - Import-time report and cold-start benchmark for the app
+#
+#   python import_profile.py report [--module main] [--top 25]
+#       Runs `python -X importtime -c "import main"` in a fresh interpreter and
+#       prints the slowest imports, plus the total per top-level package.
+#
+#   python import_profile.py benchmark [--module main] [--runs 5] [--budget 1.0]
+#       Times `import main` in fresh interpreters and exits non-zero when the
+#       median exceeds COLD_START_BUDGET_SECONDS or when a module listed in
+#       DEFERRED_MODULES was imported eagerly (see lazy_imports.py).
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from collections import defaultdict
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+COLD_START_BUDGET_SECONDS = float(os.getenv("COLD_START_BUDGET_SECONDS", "1.0"))
+
+# Must not be loaded just by importing the app; they load on first use
+DEFERRED_MODULES = (
+    "azure.cognitiveservices.speech",
+    "plivo",
+    "pydub",
+    "pandas",
+    "matplotlib",
+    "pytesseract",
+    "PIL",
+    "pdf2image",
+    "azure.storage.blob",
+    "numpy",
+)
+
+_TIMED_IMPORT = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "modules": sorted(sys.modules)}}))
+"""
+
+
+def _run(args: list) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *args], cwd=BACKEND_DIR, capture_output=True, text=True, env=os.environ.copy()
+    )
+
+
+def parse_importtime(stderr: str) -> list:
+    """[(module, self_us, cumulative_us, depth)] from -X importtime output"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        except ValueError:
+            continue
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def report(module: str, top: int) -> int:
+    result = _run(["-X", "importtime", "-c", f"import {module}"])
+    rows = parse_importtime(result.stderr)
+    if result.returncode != 0:
+        print(result.stderr[-2000:])
+        print(f"❌ import {module} failed")
+        return 1
+
+    root = next((cumulative for name, _, cumulative, _ in rows if name == module), None)
+    total_us = root if root is not None else sum(self_us for _, self_us, _, _ in rows)
+
+    per_package = defaultdict(int)
+    for name, self_us, _, _ in rows:
+        per_package[name.split(".")[0]] += self_us
+
+    print(f"import {module}: {total_us / 1e6:.3f}s across {len(rows)} modules\n")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for name, self_us, cumulative_us, depth in sorted(rows, key=lambda r: -r[2])[:top]:
+        print(f"{cumulative_us / 1000:14.1f} {self_us / 1000:9.1f}  {'  ' * depth}{name}")
+
+    print(f"\n{'self ms':>9}  package")
+    for package, self_us in sorted(per_package.items(), key=lambda item: -item[1])[:top]:
+        print(f"{self_us / 1000:9.1f}  {package}")
+    return 0
+
+
+def benchmark(module: str, runs: int, budget: float) -> int:
+    timings = []
+    eager = set()
+    for _ in range(runs):
+        result = _run(["-c", _TIMED_IMPORT.format(module=module)])
+        if result.returncode != 0:
+            print(result.stderr[-2000:])
+            print(f"❌ import {module} failed")
+            return 1
+        sample = json.loads(result.stdout.strip().splitlines()[-1])
+        timings.append(sample["seconds"])
+        loaded = set(sample["modules"])
+        eager.update(name for name in DEFERRED_MODULES if name in loaded)
+
+    median = statistics.median(timings)
+    print(f"import {module} x{runs}: median {median:.3f}s, min {min(timings):.3f}s, "
+          f"max {max(timings):.3f}s (budget {budget:.2f}s)")
+
+    failed = False
+    if median > budget:
+        print(f"❌ Cold start over budget by {median - budget:.3f}s (run `report` for the breakdown)")
+        failed = True
+    if eager:
+        print(f"❌ Imported eagerly, should load on first use: {', '.join(sorted(eager))}")
+        failed = True
+    if not failed:
+        print("✅ Cold start within budget")
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time report and cold-start benchmark")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    report_cmd = sub.add_parser("report", help="Break down import time by module")
+    report_cmd.add_argument("--module", default="main")
+    report_cmd.add_argument("--top", type=int, default=25)
+
+    bench_cmd = sub.add_parser("benchmark", help="Check cold-start import time against the budget")
+    bench_cmd.add_argument("--module", default="main")
+    bench_cmd.add_argument("--runs", type=int, default=5)
+    bench_cmd.add_argument("--budget", type=float, default=COLD_START_BUDGET_SECONDS)
+
+    args = parser.parse_args()
+    if args.command == "report":
+        sys.exit(report(args.module, args.top))
+    sys.exit(benchmark(args.module, args.runs, args.budget))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# lazy_imports.py - Deferred imports for heavy subsystems
+#
+# Speech SDK, plivo, pandas/matplotlib, Tesseract/PIL/pdf2image, azure-blob
+# and numpy together cost most of a worker's boot time but are only needed by
+# the voice, transaction, OCR and embedding paths. Modules bind them with
+#
+#     speechsdk = lazy_import("azure.cognitiveservices.speech")
+#
+# and use them as before; the real import happens on first attribute access.
+# Time spent in those deferred imports is counted per module in
+# lazy_import_seconds_total. See import_profile.py for the boot-time report.
+import time
+import logging
+import importlib
+
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+LAZY_IMPORT_SECONDS = Counter(
+    "lazy_import_seconds", "Seconds spent importing deferred modules on first use", ("module",)
+)
+
+
+class LazyModule:
+    """Module proxy that imports `name` the first time an attribute is read"""
+
+    __slots__ = ("_name", "_module")
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        module = self._module
+        if module is None:
+            start = time.perf_counter()
+            module = importlib.import_module(self._name)
+            elapsed = time.perf_counter() - start
+            self._module = module
+            LAZY_IMPORT_SECONDS.labels(self._name).inc(elapsed)
+            logger.info(f"✅ Loaded {self._name} on first use ({elapsed * 1000:.0f}ms)")
+        return module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+def lazy_import(name: str) -> LazyModule:
+    return LazyModule(name)
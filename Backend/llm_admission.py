@@ -0,0 +1,344 @@
+# llm_admission.py - Priority-aware admission control for outbound LLM calls
+#
+# Every Azure OpenAI request waits here for a slot before it is sent. Azure
+# rate limits are per deployment, so each deployment has its own controller.
+# Priority classes (lower is served first):
+#     voice > web chat > document parsing > batch
+# Admission is limited by:
+#   - request and token buckets (RPM / TPM), calibrated from the
+#     x-ratelimit-* response headers
+#   - a concurrency cap
+#   - an adaptive pause after 429s (retry-after if given, otherwise
+#     exponential backoff that resets on success); the rate-limited call
+#     gives its slot back and queues again (llm_resilience)
+# All state is touched from the event loop only, so no locks are needed.
+import os
+import time
+import heapq
+import random
+import asyncio
+import logging
+import itertools
+import contextvars
+from typing import Optional
+
+from metrics import Gauge, Histogram, Counter
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_VOICE = 0
+PRIORITY_WEB = 1
+PRIORITY_DOCUMENT = 2
+PRIORITY_BATCH = 3
+PRIORITY_NAMES = {
+    PRIORITY_VOICE: "voice",
+    PRIORITY_WEB: "web",
+    PRIORITY_DOCUMENT: "document",
+    PRIORITY_BATCH: "batch",
+}
+TRAFFIC_CLASSES = {name: priority for priority, name in PRIORITY_NAMES.items()}
+
+# Call sites that are worth less than the request they serve
+CALL_SITE_PRIORITY = {
+    "document_parse": PRIORITY_DOCUMENT,
+    "transaction_intent": PRIORITY_BATCH,
+}
+
+# Starting limits until the first rate-limit headers arrive (0 = unknown / unlimited)
+LLM_RPM_LIMIT = int(os.getenv("LLM_RPM_LIMIT", "0"))
+LLM_TPM_LIMIT = int(os.getenv("LLM_TPM_LIMIT", "0"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "64"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "1"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "30"))
+# Times a call that got a 429 is re-admitted before the error is raised
+LLM_RATE_LIMIT_RETRIES = int(os.getenv("LLM_RATE_LIMIT_RETRIES", "2"))
+
+ADMISSION_WAIT_SECONDS = Histogram(
+    "llm_admission_wait_seconds", "Time LLM calls waited for admission by deployment and priority class",
+    ("deployment", "priority")
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "llm_admission_queue_depth", "LLM calls waiting for admission by deployment and priority class",
+    ("deployment", "priority")
+)
+RATE_LIMITED = Counter("llm_rate_limited", "429 responses from the LLM provider", ("deployment",))
+
+_traffic_class = contextvars.ContextVar("llm_traffic_class", default="web")
+
+
+def set_traffic_class(name: str):
+    """Mark the current request's LLM calls as voice / web / document / batch traffic"""
+    _traffic_class.set(name)
+
+
+def traffic_class() -> str:
+    return _traffic_class.get()
+
+
+def most_urgent_traffic_class(names) -> str:
+    """The highest-priority of several callers' traffic classes (for shared calls)"""
+    return min(names, key=lambda name: TRAFFIC_CLASSES.get(name, PRIORITY_WEB), default="web")
+
+
+def priority_for(call_site: str) -> int:
+    traffic = TRAFFIC_CLASSES.get(_traffic_class.get(), PRIORITY_WEB)
+    if traffic == PRIORITY_VOICE:
+        return PRIORITY_VOICE
+    return max(traffic, CALL_SITE_PRIORITY.get(call_site, traffic))
+
+
+def estimate_request_tokens(create_kwargs: dict) -> int:
+    """Prompt estimate (~4 characters per token) plus the completion limit"""
+    chars = 0
+    for message in create_kwargs.get("messages", []):
+        content = message.get("content") if isinstance(message, dict) else None
+        if isinstance(content, str):
+            chars += len(content)
+    return chars // 4 + int(create_kwargs.get("max_tokens") or 0)
+
+
+def _header_number(headers, name: str) -> Optional[float]:
+    value = headers.get(name) if headers is not None else None
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+# ============================================
+# TOKEN BUCKET
+# ============================================
+
+class TokenBucket:
+    """Per-minute bucket; capacity 0 means unknown (never blocks)"""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self._updated = time.monotonic()
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / 60
+
+    def refill(self, now: float):
+        if self.capacity:
+            self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        if not self.capacity:
+            return 0.0
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        if self.capacity:
+            self.level -= amount
+
+    def calibrate(self, limit: Optional[float], remaining: Optional[float]):
+        if limit:
+            self.capacity = limit
+        elif remaining is not None and remaining > self.capacity:
+            # No limit header: the largest remaining value seen is the best capacity estimate
+            self.capacity = remaining
+        if remaining is not None and self.capacity:
+            self.level = min(self.level, remaining)
+
+    def snapshot(self) -> dict:
+        return {"per_minute": self.capacity, "available": round(self.level, 1)}
+
+
+# ============================================
+# ADMISSION CONTROLLER
+# ============================================
+
+class _Waiter:
+    __slots__ = ("priority", "cost", "future", "enqueued")
+
+    def __init__(self, priority: int, cost: int, future):
+        self.priority = priority
+        self.cost = cost
+        self.future = future
+        self.enqueued = time.monotonic()
+
+
+class AdmissionTicket:
+    __slots__ = ("cost", "actual_tokens")
+
+    def __init__(self, cost: int):
+        self.cost = cost
+        self.actual_tokens = None
+
+
+class AdmissionController:
+    def __init__(self, deployment: str = "", rpm: int = LLM_RPM_LIMIT, tpm: int = LLM_TPM_LIMIT,
+                 max_concurrency: int = LLM_MAX_CONCURRENCY):
+        self.deployment = deployment
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.backoff = 0.0
+        self._heap = []
+        self._seq = itertools.count()
+        self._timer = None
+        self.admitted = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.queued = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.expired = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.rate_limited = 0
+        for priority, name in PRIORITY_NAMES.items():
+            ADMISSION_QUEUE_DEPTH.labels(deployment, name).set_function(
+                lambda p=priority: sum(1 for _, _, w in self._heap if w.priority == p and not w.future.done())
+            )
+
+    # ---------- admission ----------
+
+    def _wait_time(self, cost: int, now: float) -> float:
+        if self.paused_until > now:
+            return self.paused_until - now
+        if self.in_flight >= self.max_concurrency:
+            return float("inf")
+        return max(self.requests.wait_time(1), self.tokens.wait_time(cost))
+
+    def _admit(self, priority: int, cost: int):
+        self.requests.take(1)
+        self.tokens.take(cost)
+        self.in_flight += 1
+        self.admitted[PRIORITY_NAMES[priority]] += 1
+
+    def _dispatch(self):
+        self._timer = None
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+
+        while self._heap:
+            waiter = self._heap[0][2]
+            if waiter.future.done():
+                heapq.heappop(self._heap)
+                continue
+            wait = self._wait_time(waiter.cost, now)
+            if wait > 0:
+                if wait != float("inf"):
+                    self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+            heapq.heappop(self._heap)
+            self._admit(waiter.priority, waiter.cost)
+            waiter.future.set_result(None)
+
+    def _schedule(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._dispatch()
+
+    async def acquire(self, priority: int, cost: int) -> AdmissionTicket:
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        name = PRIORITY_NAMES[priority]
+
+        if not self._heap and self._wait_time(cost, now) <= 0:
+            self._admit(priority, cost)
+            ADMISSION_WAIT_SECONDS.labels(self.deployment, name).observe(0.0)
+            return AdmissionTicket(cost)
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = _Waiter(priority, cost, future)
+        heapq.heappush(self._heap, (priority, next(self._seq), waiter))
+        self.queued[name] += 1
+        self._schedule()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Admitted just before the caller gave up: hand the slot back
+            if future.done() and not future.cancelled():
+                self.release(AdmissionTicket(cost))
+            raise
+        ADMISSION_WAIT_SECONDS.labels(self.deployment, name).observe(time.monotonic() - waiter.enqueued)
+        return AdmissionTicket(cost)
+
+    def release(self, ticket: AdmissionTicket):
+        self.in_flight -= 1
+        if ticket.actual_tokens is not None and self.tokens.capacity:
+            # Refund (or charge) the difference between the estimate and real usage
+            self.tokens.level = min(self.tokens.capacity, self.tokens.level + ticket.cost - ticket.actual_tokens)
+        if self._heap:
+            self._schedule()
+
+    def saturated(self) -> bool:
+        """Paused after a 429, at the concurrency cap, or already queueing"""
+        if self.paused_until > time.monotonic() or self.in_flight >= self.max_concurrency:
+            return True
+        return any(not waiter.future.done() for _, _, waiter in self._heap)
+
+    def record_expired(self, priority: int):
+        """A queued call hit its deadline before being admitted"""
+        self.expired[PRIORITY_NAMES[priority]] += 1
+
+    # ---------- feedback from responses ----------
+
+    def observe_headers(self, headers):
+        self.requests.calibrate(
+            _header_number(headers, "x-ratelimit-limit-requests"),
+            _header_number(headers, "x-ratelimit-remaining-requests"),
+        )
+        self.tokens.calibrate(
+            _header_number(headers, "x-ratelimit-limit-tokens"),
+            _header_number(headers, "x-ratelimit-remaining-tokens"),
+        )
+        self.backoff = 0.0
+
+    def on_rate_limited(self, headers):
+        self.rate_limited += 1
+        RATE_LIMITED.labels(self.deployment).inc()
+
+        retry_ms = _header_number(headers, "retry-after-ms")
+        retry = retry_ms / 1000 if retry_ms is not None else _header_number(headers, "retry-after")
+        if retry is None:
+            self.backoff = min(LLM_BACKOFF_MAX_SECONDS, max(LLM_BACKOFF_BASE_SECONDS, self.backoff * 2))
+            retry = self.backoff * random.uniform(0.8, 1.2)
+
+        self.paused_until = max(self.paused_until, time.monotonic() + retry)
+        # The provider says the bucket is empty
+        self.requests.level = min(self.requests.level, 0)
+        self.tokens.level = min(self.tokens.level, 0)
+        logger.warning(f"⚠️ LLM deployment '{self.deployment}' rate limited, pausing admissions for {retry:.1f}s")
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        waiting = {name: 0 for name in PRIORITY_NAMES.values()}
+        for _, _, waiter in self._heap:
+            if not waiter.future.done():
+                waiting[PRIORITY_NAMES[waiter.priority]] += 1
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "waiting": waiting,
+            "admitted": dict(self.admitted),
+            "queued": dict(self.queued),
+            "expired": dict(self.expired),
+            "rate_limited": self.rate_limited,
+            "paused_for_s": round(max(0.0, self.paused_until - now), 2),
+            "requests_bucket": self.requests.snapshot(),
+            "tokens_bucket": self.tokens.snapshot(),
+        }
+
+
+_controllers = {}
+
+
+def admission_for(deployment: str) -> AdmissionController:
+    controller = _controllers.get(deployment)
+    if controller is None:
+        controller = _controllers[deployment] = AdmissionController(deployment)
+    return controller
+
+
+def admission_stats() -> dict:
+    return {deployment: controller.stats() for deployment, controller in sorted(_controllers.items())}
@@ -0,0 +1,104 @@
+# llm_client.py - Shared Azure OpenAI client
+#
+# One AsyncAzureOpenAI client (and one HTTP connection pool) for every agent:
+# the smart router, eligibility, post-application and registration parsing.
+# Call sites go through llm_resilience, which uses `llm_client` from here and
+# takes each call site's deployment from its model tier (llm_tiers);
+# `LLM_DEPLOYMENT` is the default deployment those tiers fall back to.
+import os
+import logging
+
+import httpx
+from dotenv import load_dotenv
+from openai import AsyncAzureOpenAI, DefaultAsyncHttpxClient
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# ============================================
+# CONFIGURATION (single source)
+# ============================================
+
+AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT", "")
+AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY", "")
+AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION") or "2024-12-01-preview"
+
+# AZURE_OPENAI_DEPLOYMENT_NAME is canonical; AZURE_OPENAI_DEPLOYMENT is still read
+# for existing .env files
+LLM_DEPLOYMENT = (
+    os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME")
+    or os.getenv("AZURE_OPENAI_DEPLOYMENT")
+    or "gpt-4o-mini"
+)
+
+# Point every agent at the local stand-in server (llm_standin.py) instead of
+# Azure, e.g. LLM_STANDIN_URL=http://localhost:8089 - no API key needed
+LLM_STANDIN_URL = os.getenv("LLM_STANDIN_URL", "").rstrip("/")
+
+# Connection pool
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "40"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "120"))
+LLM_HTTP2 = os.getenv("LLM_HTTP2", "false").lower() in ("1", "true", "yes")
+
+# Timeouts / retries
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+
+
+def _http2_available() -> bool:
+    if not LLM_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401  (httpx needs it for HTTP/2)
+        return True
+    except ImportError:
+        logger.warning("⚠️ LLM_HTTP2 is enabled but the 'h2' package is not installed. Using HTTP/1.1.")
+        return False
+
+
+def _build_http_client() -> httpx.AsyncClient:
+    return DefaultAsyncHttpxClient(
+        http2=_http2_available(),
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+    )
+
+
+# ============================================
+# SHARED CLIENT
+# ============================================
+
+llm_client = None
+if LLM_STANDIN_URL:
+    llm_client = AsyncAzureOpenAI(
+        azure_endpoint=LLM_STANDIN_URL,
+        api_key=AZURE_OPENAI_API_KEY or "standin",
+        api_version=AZURE_OPENAI_API_VERSION,
+        max_retries=LLM_MAX_RETRIES,
+        http_client=_build_http_client(),
+    )
+    logger.warning(f"⚠️ LLM calls go to the local stand-in at {LLM_STANDIN_URL}, not Azure")
+elif AZURE_OPENAI_ENDPOINT and AZURE_OPENAI_API_KEY:
+    llm_client = AsyncAzureOpenAI(
+        azure_endpoint=AZURE_OPENAI_ENDPOINT,
+        api_key=AZURE_OPENAI_API_KEY,
+        api_version=AZURE_OPENAI_API_VERSION,
+        max_retries=LLM_MAX_RETRIES,
+        http_client=_build_http_client(),
+    )
+    logger.info(f"✅ Shared Azure OpenAI client initialized (deployment: {LLM_DEPLOYMENT})")
+else:
+    logger.error("❌ AZURE_OPENAI_ENDPOINT / AZURE_OPENAI_API_KEY not set. LLM calls will fail.")
+
+
+async def close_llm_client():
+    """Close the shared connection pool (call on application shutdown)"""
+    if llm_client is not None:
+        await llm_client.close()
@@ -0,0 +1,499 @@
+# llm_resilience.py - Deadlines, hedged requests and circuit breaker for LLM calls
+#
+# Every chat.completions call goes through llm_call() / llm_stream() with a
+# call-site name. Each call site gets:
+#   - a deadline (asyncio.wait_for around the whole call, retries included)
+#   - optional hedging: a duplicate request is sent once the first one has
+#     been running longer than the call site's observed p95; the first
+#     answer wins and the other request is cancelled
+# A shared circuit breaker opens after consecutive provider failures so
+# callers fail fast (LLMUnavailable) and use their local fallback instead.
+# Every request (hedges included) first waits for a slot in the priority
+# admission queue (llm_admission), inside the call site's deadline. Admitted
+# requests are sent without SDK retries: a 429 pauses the deployment's queue
+# and the call is re-admitted at its priority (LLM_RATE_LIMIT_RETRIES times);
+# connection errors are retried on the same slot (LLM_MAX_RETRIES times).
+# The deployment comes from the call site's model tier (llm_tiers) unless
+# the caller passes model= explicitly.
+# Inside a request (cancellation.run_cancellable) the deadline is also capped
+# at the time the request has left; calls cut short by the request deadline
+# or a client disconnect do not count against the breaker.
+import os
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Optional, Sequence
+
+import openai
+
+from llm_client import llm_client, LLM_MAX_RETRIES
+from tracing import span, current_session_id
+from metrics import LLM_CALL_SECONDS
+from llm_usage import token_ledger
+from llm_admission import (
+    admission_for, admission_stats, priority_for, estimate_request_tokens, LLM_RATE_LIMIT_RETRIES
+)
+from llm_tiers import model_tiers
+from cancellation import RequestCancelled, REASON_DEADLINE, check_cancelled, record_cancelled_work, remaining
+
+logger = logging.getLogger(__name__)
+
+# ============================================
+# CONFIGURATION
+# ============================================
+
+# Seconds; override per call site with LLM_DEADLINE_<CALL_SITE>, e.g. LLM_DEADLINE_ROUTER=3
+DEFAULT_DEADLINES = {
+    "router": 4.0,
+    "router_batch": 5.0,
+    "single_pass": 15.0,
+    "eligibility": 20.0,
+    "eligibility_stream": 8.0,   # time to first token
+    "post_application": 15.0,
+    "transaction_intent": 4.0,
+    "document_parse": 20.0,
+}
+LLM_DEFAULT_DEADLINE = float(os.getenv("LLM_DEFAULT_DEADLINE", "20"))
+
+# Short, cheap calls are hedged by default; long generations are not
+LLM_HEDGE_CALL_SITES = {
+    name.strip()
+    for name in os.getenv("LLM_HEDGE_CALL_SITES", "router,router_batch,transaction_intent,document_parse").split(",")
+    if name.strip()
+}
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_MIN_DELAY_MS = float(os.getenv("LLM_HEDGE_MIN_DELAY_MS", "200"))
+LATENCY_WINDOW = 200
+
+LLM_BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", "5"))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+
+LLM_UNAVAILABLE_MESSAGE = (
+    "Sorry, our assistant is responding slowly right now. Please try again in a moment."
+)
+
+
+def get_deadline(call_site: str) -> float:
+    override = os.getenv(f"LLM_DEADLINE_{call_site.upper()}")
+    if override:
+        return float(override)
+    return DEFAULT_DEADLINES.get(call_site, LLM_DEFAULT_DEADLINE)
+
+
+class LLMUnavailable(Exception):
+    """The LLM call missed its deadline, failed at the provider, or the breaker is open"""
+
+
+def _is_provider_failure(error: BaseException) -> bool:
+    """Timeouts, connection errors, 429 and 5xx count against the breaker; bad requests do not"""
+    if isinstance(error, (asyncio.TimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+# ============================================
+# CIRCUIT BREAKER
+# ============================================
+
+class CircuitBreaker:
+    """closed -> open after N consecutive failures -> half_open probe after reset_seconds"""
+
+    def __init__(self, failure_threshold: int = LLM_BREAKER_FAILURE_THRESHOLD,
+                 reset_seconds: float = LLM_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._probe_in_flight = False
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                logger.info("✅ LLM circuit breaker closed")
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def abandon_probe(self):
+        """The call never reached the provider (no admission slot); let another call probe"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.times_opened += 1
+                    logger.warning(f"⚠️ LLM circuit breaker opened after {self.consecutive_failures} failures")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+            }
+
+
+# ============================================
+# PER CALL-SITE STATISTICS
+# ============================================
+
+class CallSiteStats:
+    """Rolling latency window (for the hedge delay) and outcome counters for one call site"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def record(self, latency: float):
+        with self._lock:
+            self.calls += 1
+            self.latencies.append(latency)
+
+    def record_failure(self, timed_out: bool):
+        with self._lock:
+            self.calls += 1
+            self.failures += 1
+            if timed_out:
+                self.timeouts += 1
+
+    def record_hedge(self, won: bool = False):
+        with self._lock:
+            if won:
+                self.hedge_wins += 1
+            else:
+                self.hedges += 1
+
+    def percentile(self, pct: float) -> float:
+        with self._lock:
+            if not self.latencies:
+                return 0.0
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+    def hedge_delay(self, deadline: float) -> float:
+        """p95 once enough samples exist, otherwise half the deadline"""
+        with self._lock:
+            samples = len(self.latencies)
+        delay = self.percentile(0.95) if samples >= LLM_HEDGE_MIN_SAMPLES else deadline / 2
+        return max(delay, LLM_HEDGE_MIN_DELAY_MS / 1000)
+
+    def snapshot(self) -> dict:
+        p50, p95 = self.percentile(0.5), self.percentile(0.95)
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "failures": self.failures,
+                "timeouts": self.timeouts,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "p50_ms": round(p50 * 1000, 1),
+                "p95_ms": round(p95 * 1000, 1),
+            }
+
+
+circuit_breaker = CircuitBreaker()
+_call_site_stats = {}
+
+# Retries are driven by the admission queue, not the SDK
+_admitted_client = llm_client.with_options(max_retries=0) if llm_client is not None else None
+
+
+def _stats_for(call_site: str) -> CallSiteStats:
+    stats = _call_site_stats.get(call_site)
+    if stats is None:
+        stats = _call_site_stats.setdefault(call_site, CallSiteStats())
+    return stats
+
+
+# ============================================
+# CALL WRAPPERS
+# ============================================
+
+async def _admitted_create(priority: int, create_kwargs: dict, sent: list):
+    """
+    Wait for an admission slot, send the request and feed the rate-limit
+    headers back. After a 429 the slot is released while the deployment is
+    paused and the call queues again at its priority.
+    """
+    admission = admission_for(create_kwargs["model"])
+    cost = estimate_request_tokens(create_kwargs)
+    rate_limited = 0
+    while True:
+        ticket = await admission.acquire(priority, cost)
+        sent.append(True)
+        try:
+            raw = await _send(create_kwargs)
+            admission.observe_headers(raw.headers)
+            response = raw.parse()
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                ticket.actual_tokens = getattr(usage, "total_tokens", None)
+            return response
+        except openai.RateLimitError as e:
+            admission.on_rate_limited(e.response.headers)
+            rate_limited += 1
+            if rate_limited > LLM_RATE_LIMIT_RETRIES:
+                raise
+        finally:
+            admission.release(ticket)
+
+
+async def _send(create_kwargs: dict):
+    """One request; connection errors are retried, provider responses are not"""
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        try:
+            return await _admitted_client.chat.completions.with_raw_response.create(**create_kwargs)
+        except openai.APIConnectionError:
+            if attempt == LLM_MAX_RETRIES:
+                raise
+
+
+async def _hedged(call_site: str, stats: CallSiteStats, deadline: float, create_kwargs: dict, sent: list):
+    priority = priority_for(call_site)
+
+    def attempt():
+        return asyncio.ensure_future(_admitted_create(priority, create_kwargs, sent))
+
+    first = attempt()
+    pending = {first}
+    try:
+        if call_site in LLM_HEDGE_CALL_SITES:
+            done, _ = await asyncio.wait(pending, timeout=stats.hedge_delay(deadline))
+            # Only hedge a request the provider is actually working on, not one still queued
+            if not done and sent:
+                stats.record_hedge()
+                pending.add(attempt())
+
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not first:
+                        stats.record_hedge(won=True)
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def _with_model(call_site: str, create_kwargs: dict):
+    """Fill in the deployment from the call site's model tier; returns (tier, kwargs)"""
+    if create_kwargs.get("model"):
+        return None, create_kwargs
+    tier, deployment = model_tiers.select(call_site)
+    return tier, dict(create_kwargs, model=deployment)
+
+
+def _record_latency(call_site: str, stats: CallSiteStats, tier: Optional[str], latency: float):
+    stats.record(latency)
+    if tier is not None:
+        model_tiers.record(call_site, tier, latency)
+
+
+def _call_deadline(call_site: str):
+    """(deadline, request_bound): the call site's deadline, capped by the request's remaining time"""
+    deadline = get_deadline(call_site)
+    left = remaining()
+    if left is None or left >= deadline:
+        return deadline, False
+    check_cancelled("llm_call")
+    return left, True
+
+
+def _cancelled(create_kwargs: dict):
+    """The request was cancelled while this call was waiting or in flight"""
+    circuit_breaker.abandon_probe()
+    record_cancelled_work("llm_call", estimate_request_tokens(create_kwargs))
+
+
+def _failure(call_site: str, stats: CallSiteStats, deadline: float, error: Exception,
+             sent: list, create_kwargs: dict, request_bound: bool) -> Optional[Exception]:
+    """Update the breaker and stats for a failed call; None means re-raise the original error"""
+    if not _is_provider_failure(error):
+        circuit_breaker.record_success()
+        return None
+
+    timed_out = isinstance(error, asyncio.TimeoutError)
+    if timed_out and request_bound:
+        _cancelled(create_kwargs)
+        return RequestCancelled(REASON_DEADLINE)
+
+    stats.record_failure(timed_out)
+    if timed_out and not sent:
+        # Shed by our own admission queue: says nothing about the provider's health
+        circuit_breaker.abandon_probe()
+        admission_for(create_kwargs["model"]).record_expired(priority_for(call_site))
+        reason = f"no admission slot within {deadline}s"
+    else:
+        circuit_breaker.record_failure()
+        reason = f"deadline of {deadline}s exceeded" if timed_out else str(error)
+    logger.warning(f"⚠️ LLM call '{call_site}' failed: {reason}")
+    return LLMUnavailable(reason)
+
+
+async def llm_call(call_site: str, session_id: Optional[str] = None,
+                   shared_by: Optional[Sequence[Optional[str]]] = None, **create_kwargs):
+    """
+    chat.completions.create() with the call site's deadline, hedging and the
+    shared circuit breaker. Raises LLMUnavailable on provider failure.
+    Token usage is recorded for the call site and session_id (default: the
+    request's session), or split evenly across shared_by for a call made on
+    behalf of several sessions (e.g. a routing batch).
+    """
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        with span(f"llm.{call_site}"):
+            response = await _llm_call(call_site, create_kwargs)
+        if shared_by is not None:
+            token_ledger.record_shared(call_site, shared_by, getattr(response, "usage", None))
+        else:
+            record_usage(call_site, getattr(response, "usage", None), session_id)
+        return response
+    except LLMUnavailable:
+        outcome = "unavailable"
+        raise
+    except (RequestCancelled, asyncio.CancelledError):
+        outcome = "cancelled"
+        raise
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        LLM_CALL_SECONDS.labels(call_site, outcome).observe(time.perf_counter() - started)
+
+
+async def _llm_call(call_site: str, create_kwargs: dict):
+    if llm_client is None:
+        raise LLMUnavailable("Azure OpenAI client is not configured")
+    deadline, request_bound = _call_deadline(call_site)
+    if not circuit_breaker.allow():
+        raise LLMUnavailable("LLM circuit breaker is open")
+
+    tier, create_kwargs = _with_model(call_site, create_kwargs)
+    stats = _stats_for(call_site)
+    started = time.monotonic()
+    sent = []
+    try:
+        response = await asyncio.wait_for(
+            _hedged(call_site, stats, deadline, create_kwargs, sent), timeout=deadline
+        )
+    except asyncio.CancelledError:
+        _cancelled(create_kwargs)
+        raise
+    except Exception as e:
+        failure = _failure(call_site, stats, deadline, e, sent, create_kwargs, request_bound)
+        if failure is None:
+            raise
+        raise failure from e
+
+    circuit_breaker.record_success()
+    _record_latency(call_site, stats, tier, time.monotonic() - started)
+    return response
+
+
+async def llm_stream(call_site: str, **create_kwargs):
+    """
+    Open a streaming completion; the deadline bounds the time until the
+    stream is established. Streams are never hedged.
+    The final chunk carries token usage; pass it to record_usage().
+    """
+    create_kwargs.setdefault("stream_options", {"include_usage": True})
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        with span(f"llm.{call_site}", stream=True):
+            return await _llm_stream(call_site, create_kwargs)
+    except LLMUnavailable:
+        outcome = "unavailable"
+        raise
+    except (RequestCancelled, asyncio.CancelledError):
+        outcome = "cancelled"
+        raise
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        LLM_CALL_SECONDS.labels(call_site, outcome).observe(time.perf_counter() - started)
+
+
+async def _llm_stream(call_site: str, create_kwargs: dict):
+    if llm_client is None:
+        raise LLMUnavailable("Azure OpenAI client is not configured")
+    deadline, request_bound = _call_deadline(call_site)
+    if not circuit_breaker.allow():
+        raise LLMUnavailable("LLM circuit breaker is open")
+
+    tier, create_kwargs = _with_model(call_site, dict(create_kwargs, stream=True))
+    stats = _stats_for(call_site)
+    started = time.monotonic()
+    sent = []
+    try:
+        # The admission slot covers establishing the stream, not reading it
+        stream = await asyncio.wait_for(
+            _admitted_create(priority_for(call_site), create_kwargs, sent), timeout=deadline
+        )
+    except asyncio.CancelledError:
+        _cancelled(create_kwargs)
+        raise
+    except Exception as e:
+        failure = _failure(call_site, stats, deadline, e, sent, create_kwargs, request_bound)
+        if failure is None:
+            raise
+        raise failure from e
+
+    circuit_breaker.record_success()
+    _record_latency(call_site, stats, tier, time.monotonic() - started)
+    return stream
+
+
+def record_usage(call_site: str, usage, session_id: Optional[str] = None):
+    token_ledger.record(call_site, session_id or current_session_id(), usage)
+
+
+def resilience_stats() -> dict:
+    return {
+        "circuit_breaker": circuit_breaker.stats(),
+        "admission": admission_stats(),
+        "tiers": model_tiers.stats(),
+        "call_sites": {
+            name: dict(stats.snapshot(), deadline_s=get_deadline(name), hedged=name in LLM_HEDGE_CALL_SITES)
+            for name, stats in sorted(_call_site_stats.items())
+        },
+    }
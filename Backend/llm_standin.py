@@ -0,0 +1,448 @@
+# llm_standin.py - Local OpenAI-compatible stand-in for Azure OpenAI
+#
+# Serves /openai/deployments/{deployment}/chat/completions (what the Azure
+# client calls) and /v1/chat/completions, with and without streaming, so
+# load tests and benchmarks run offline and deterministically. Point the app
+# at it with LLM_STANDIN_URL=http://localhost:8089 (see llm_client.py).
+#
+# Modes:
+#   scripted  rule-based answers for the router (single and batch), the
+#             single-pass respond tool, transaction-intent JSON and
+#             document-parsing JSON; a fixed reply for conversations
+#   record    forward to the real Azure deployment and append every
+#             exchange to the cassette (JSONL)
+#   replay    answer from the cassette; requests not in it are scripted
+#
+#     python llm_standin.py --mode scripted --port 8089
+#     python llm_standin.py --mode record --cassette cassettes/llm.jsonl
+#     python llm_standin.py --mode replay --cassette cassettes/llm.jsonl
+#
+# Latency per request kind is lognormal, given as p50:p95 in ms:
+#     LLM_STANDIN_LATENCY="router=250:700,chat=1200:3500,default=600:1500"
+import os
+import re
+import json
+import math
+import time
+import random
+import asyncio
+import hashlib
+import argparse
+import logging
+import itertools
+
+import httpx
+from dotenv import load_dotenv
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from routing.intent_rules import best_guess_flag
+from transaction_intent import basic_transaction_intent
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# ============================================
+# CONFIGURATION
+# ============================================
+
+LLM_STANDIN_LATENCY = os.getenv("LLM_STANDIN_LATENCY", "router=250:700,chat=1200:3500,default=600:1500")
+# Delay between streamed chunks
+LLM_STANDIN_TOKEN_MS = float(os.getenv("LLM_STANDIN_TOKEN_MS", "20"))
+# Simulated requests-per-minute quota (429 + x-ratelimit-* headers); 0 disables
+LLM_STANDIN_RPM = int(os.getenv("LLM_STANDIN_RPM", "0"))
+LLM_STANDIN_SEED = int(os.getenv("LLM_STANDIN_SEED", "7"))
+
+# Upstream for record mode (the real deployment)
+AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT", "").rstrip("/")
+AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY", "")
+AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION") or "2024-12-01-preview"
+
+SCRIPTED_CHAT_REPLY = (
+    "Thank you for your message. This is a scripted reply from the local test server. "
+    "Could you tell me a little more so I can help you further?"
+)
+
+MODE_SCRIPTED = "scripted"
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+
+
+def parse_latency_config(config: str) -> dict:
+    """'router=250:700,default=600:1500' -> {kind: (p50_s, p95_s)}"""
+    latencies = {}
+    for entry in config.split(","):
+        if "=" not in entry:
+            continue
+        kind, spec = entry.split("=", 1)
+        p50, _, p95 = spec.partition(":")
+        p50 = float(p50)
+        latencies[kind.strip()] = (p50 / 1000, float(p95 or p50) / 1000)
+    latencies.setdefault("default", (0.6, 1.5))
+    return latencies
+
+
+class LatencyModel:
+    """Lognormal latency per request kind, fitted to p50 / p95"""
+
+    def __init__(self, config: str, seed: int):
+        self.latencies = parse_latency_config(config)
+        self.random = random.Random(seed)
+
+    def sample(self, kind: str) -> float:
+        p50, p95 = self.latencies.get(kind) or self.latencies["default"]
+        if p50 <= 0:
+            return 0.0
+        sigma = max(0.0, math.log(max(p95, p50) / p50) / 1.645)
+        return self.random.lognormvariate(math.log(p50), sigma)
+
+
+# ============================================
+# SCRIPTED ANSWERS
+# ============================================
+
+FLAG_OPTIONS = re.compile(r'"flag_type"\s*:\s*((?:"\w+"\s*\|?\s*)+)')
+BATCH_ITEM = re.compile(
+    r"### Item \d+\s*Previous assistant response:\s*(.*?)\s*Current user message:\s*(.*?)\s*(?=### Item|\Z)", re.S
+)
+SINGLE_ITEM = re.compile(r"Previous assistant response:\s*(.*?)\s*Current user message:\s*(.*)", re.S)
+SINGLE_PASS_PREV = re.compile(r"Previous assistant response shown to the user:\s*(.*)\Z", re.S)
+DOCUMENT_FIELD = re.compile(r"^-\s*([a-z_]+)\b", re.M)
+
+DOCUMENT_VALUE_PATTERNS = [
+    ("aadhaar", re.compile(r"\b\d{4}\s?\d{4}\s?\d{4}\b")),
+    ("ifsc", re.compile(r"\b[A-Z]{4}0[A-Z0-9]{6}\b")),
+    ("account", re.compile(r"\b\d{9,18}\b")),
+    ("mobile", re.compile(r"\b[6-9]\d{9}\b")),
+    ("pin", re.compile(r"\b\d{6}\b")),
+    ("date", re.compile(r"\b\d{2}[/-]\d{2}[/-]\d{4}\b")),
+    ("dob", re.compile(r"\b\d{2}[/-]\d{2}[/-]\d{4}\b")),
+    ("income", re.compile(r"\b\d[\d,]{3,}\b")),
+]
+
+
+def _none_if_empty(text: str):
+    text = text.strip()
+    return None if not text or text == "None" else text
+
+
+def _allowed_flags(system_prompt: str) -> list:
+    match = FLAG_OPTIONS.search(system_prompt)
+    if not match:
+        return ["eligible", "form_filling", "post_application"]
+    return re.findall(r'"(\w+)"', match.group(1))
+
+
+def _message_text(message: dict) -> str:
+    content = message.get("content")
+    return content if isinstance(content, str) else ""
+
+
+def classify_request(body: dict) -> str:
+    """Request kind, used for the scripted answer and the latency distribution"""
+    messages = body.get("messages") or []
+    system = _message_text(messages[0]) if messages else ""
+    user = _message_text(messages[-1]) if messages else ""
+
+    if any(tool.get("function", {}).get("name") == "respond" for tool in body.get("tools") or []):
+        return "single_pass"
+    if "BATCH MODE" in system:
+        return "router_batch"
+    if '"flag_type"' in system:
+        return "router"
+    if "Extract transaction intent" in user:
+        return "transaction_intent"
+    if "OCR text" in system or "OCR Text:" in user:
+        return "document_parse"
+    return "chat"
+
+
+def _transaction_intent(user: str) -> dict:
+    # Same regex extraction the post-application agent falls back to
+    quoted = re.search(r'User message:\s*"(.*)"', user, re.S)
+    return basic_transaction_intent(quoted.group(1) if quoted else user)
+
+
+def _document_fields(user: str) -> dict:
+    fields_part, _, text = user.partition("OCR Text:")
+    text = text.replace("Return JSON only.", "").strip()
+    result = {}
+    for field in DOCUMENT_FIELD.findall(fields_part):
+        value = None
+        for hint, pattern in DOCUMENT_VALUE_PATTERNS:
+            if hint in field:
+                found = pattern.search(text)
+                value = found.group(0) if found else None
+                break
+        result[field] = value
+    return result
+
+
+def scripted_message(kind: str, body: dict) -> dict:
+    """The assistant message (content and/or tool_calls) for a scripted answer"""
+    messages = body.get("messages") or []
+    system = _message_text(messages[0]) if messages else ""
+    user = _message_text(messages[-1]) if messages else ""
+
+    if kind == "router":
+        match = SINGLE_ITEM.search(user)
+        prev_res, message = (match.group(1), match.group(2)) if match else (None, user)
+        flag = best_guess_flag(message.strip(), _none_if_empty(prev_res or ""), _allowed_flags(system))
+        return {"role": "assistant", "content": json.dumps({"flag_type": flag})}
+
+    if kind == "router_batch":
+        allowed = _allowed_flags(system)
+        flags = [
+            best_guess_flag(message.strip(), _none_if_empty(prev_res), allowed)
+            for prev_res, message in BATCH_ITEM.findall(user)
+        ]
+        return {"role": "assistant", "content": json.dumps({"flags": flags})}
+
+    if kind == "single_pass":
+        tool = next(t for t in body["tools"] if t["function"]["name"] == "respond")
+        allowed = tool["function"]["parameters"]["properties"]["flag_type"].get("enum") or ["eligible"]
+        prev = SINGLE_PASS_PREV.search(system)
+        flag = best_guess_flag(user, _none_if_empty(prev.group(1)) if prev else None, allowed)
+        arguments = {"flag_type": flag, "response": SCRIPTED_CHAT_REPLY if flag == "eligible" else ""}
+        return {
+            "role": "assistant",
+            "content": None,
+            "tool_calls": [{
+                "id": "call_standin",
+                "type": "function",
+                "function": {"name": "respond", "arguments": json.dumps(arguments)},
+            }],
+        }
+
+    if kind == "transaction_intent":
+        return {"role": "assistant", "content": json.dumps(_transaction_intent(user))}
+
+    if kind == "document_parse":
+        return {"role": "assistant", "content": json.dumps(_document_fields(user))}
+
+    return {"role": "assistant", "content": SCRIPTED_CHAT_REPLY}
+
+
+def _count_tokens(text: str) -> int:
+    return max(1, len(text) // 4) if text else 0
+
+
+def build_completion(body: dict, deployment: str, message: dict) -> dict:
+    prompt_tokens = sum(_count_tokens(_message_text(m)) for m in body.get("messages") or [])
+    completion_text = message.get("content") or json.dumps(message.get("tool_calls") or "")
+    completion_tokens = _count_tokens(completion_text)
+    return {
+        "id": f"chatcmpl-standin-{next(_completion_ids)}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": deployment,
+        "choices": [{
+            "index": 0,
+            "message": message,
+            "finish_reason": "tool_calls" if message.get("tool_calls") else "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+_completion_ids = itertools.count(1)
+
+
+# ============================================
+# CASSETTES
+# ============================================
+
+def cassette_key(body: dict) -> str:
+    """Request identity for record / replay; the deployment is left out so tiers can change"""
+    identity = {
+        name: body.get(name)
+        for name in ("messages", "tools", "tool_choice", "response_format", "temperature", "max_tokens")
+    }
+    return hashlib.sha256(json.dumps(identity, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {}
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry["key"]] = entry
+            logger.info(f"📼 Loaded {len(self.entries)} recorded exchanges from {path}")
+
+    def get(self, key: str):
+        return self.entries.get(key)
+
+    def record(self, key: str, kind: str, latency: float, response: dict):
+        entry = {"key": key, "kind": kind, "latency_ms": round(latency * 1000, 1), "response": response}
+        self.entries[key] = entry
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+# ============================================
+# SERVER
+# ============================================
+
+class StandinState:
+    def __init__(self, mode: str, cassette_path: str, latency_config: str, seed: int, rpm: int):
+        self.mode = mode
+        self.cassette = Cassette(cassette_path)
+        self.latency = LatencyModel(latency_config, seed)
+        self.rpm = rpm
+        self._window = []
+        self.counts = {"scripted": 0, "replayed": 0, "recorded": 0, "replay_misses": 0, "rate_limited": 0}
+        self.upstream = None
+        if mode == MODE_RECORD:
+            if not AZURE_OPENAI_ENDPOINT or not AZURE_OPENAI_API_KEY:
+                raise SystemExit("Record mode needs AZURE_OPENAI_ENDPOINT and AZURE_OPENAI_API_KEY")
+            self.upstream = httpx.AsyncClient(timeout=120)
+
+    def rate_limit_headers(self):
+        """(headers, retry_after_s or None) for the simulated RPM quota"""
+        if not self.rpm:
+            return {}, None
+        now = time.monotonic()
+        self._window = [at for at in self._window if now - at < 60]
+        if len(self._window) >= self.rpm:
+            retry = 60 - (now - self._window[0])
+            return {"retry-after-ms": str(int(retry * 1000)), "x-ratelimit-remaining-requests": "0"}, retry
+        self._window.append(now)
+        return {
+            "x-ratelimit-limit-requests": str(self.rpm),
+            "x-ratelimit-remaining-requests": str(self.rpm - len(self._window)),
+        }, None
+
+    async def forward(self, deployment: str, body: dict) -> dict:
+        upstream_body = {k: v for k, v in body.items() if k not in ("stream", "stream_options")}
+        response = await self.upstream.post(
+            f"{AZURE_OPENAI_ENDPOINT}/openai/deployments/{deployment}/chat/completions",
+            params={"api-version": AZURE_OPENAI_API_VERSION},
+            headers={"api-key": AZURE_OPENAI_API_KEY},
+            json=upstream_body,
+        )
+        response.raise_for_status()
+        return response.json()
+
+
+def _stream_chunks(completion: dict, include_usage: bool):
+    """Split a finished completion into chat.completion.chunk events"""
+    message = completion["choices"][0]["message"]
+    base = {"id": completion["id"], "object": "chat.completion.chunk",
+            "created": completion["created"], "model": completion["model"]}
+
+    def chunk(delta, finish_reason=None):
+        return dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": finish_reason}])
+
+    yield chunk({"role": "assistant", "content": ""})
+    if message.get("tool_calls"):
+        calls = [dict(call, index=i) for i, call in enumerate(message["tool_calls"])]
+        yield chunk({"tool_calls": calls})
+    for piece in re.findall(r"\S+\s*|\s+", message.get("content") or ""):
+        yield chunk({"content": piece})
+    yield chunk({}, completion["choices"][0]["finish_reason"])
+    if include_usage:
+        yield dict(base, choices=[], usage=completion.get("usage"))
+
+
+def create_app(state: StandinState) -> FastAPI:
+    app = FastAPI(title="LLM stand-in")
+
+    async def complete(deployment: str, body: dict):
+        kind = classify_request(body)
+
+        headers, retry_after = state.rate_limit_headers()
+        if retry_after is not None:
+            state.counts["rate_limited"] += 1
+            return JSONResponse(
+                {"error": {"code": "429", "message": "Rate limit exceeded (stand-in)"}},
+                status_code=429, headers=headers
+            )
+
+        key = cassette_key(body)
+        started = time.monotonic()
+        recorded = state.cassette.get(key) if state.mode == MODE_REPLAY else None
+
+        if recorded:
+            state.counts["replayed"] += 1
+            completion, source = recorded["response"], "replay"
+            latency = recorded["latency_ms"] / 1000
+        elif state.mode == MODE_RECORD:
+            completion = await state.forward(deployment, body)
+            state.cassette.record(key, kind, time.monotonic() - started, completion)
+            state.counts["recorded"] += 1
+            source, latency = "record", 0.0
+        else:
+            if state.mode == MODE_REPLAY:
+                state.counts["replay_misses"] += 1
+            state.counts["scripted"] += 1
+            completion = build_completion(body, deployment, scripted_message(kind, body))
+            source, latency = "scripted", state.latency.sample(kind)
+
+        headers["x-standin-source"] = source
+        headers["x-standin-kind"] = kind
+
+        if not body.get("stream"):
+            await asyncio.sleep(latency)
+            return JSONResponse(completion, headers=headers)
+
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+
+        async def events():
+            # The sampled latency is the time to first token
+            await asyncio.sleep(latency)
+            for chunk in _stream_chunks(completion, include_usage):
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                await asyncio.sleep(LLM_STANDIN_TOKEN_MS / 1000)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream", headers=headers)
+
+    @app.post("/openai/deployments/{deployment}/chat/completions")
+    async def azure_chat_completions(deployment: str, request: Request):
+        return await complete(deployment, await request.json())
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        return await complete(body.get("model", "standin"), body)
+
+    @app.get("/standin/stats")
+    async def stats():
+        return {"mode": state.mode, "cassette": state.cassette.path,
+                "recorded_exchanges": len(state.cassette.entries), **state.counts}
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stand-in for Azure OpenAI")
+    parser.add_argument("--mode", choices=[MODE_SCRIPTED, MODE_RECORD, MODE_REPLAY], default=MODE_SCRIPTED)
+    parser.add_argument("--cassette", default="cassettes/llm.jsonl")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", default=LLM_STANDIN_LATENCY, help="kind=p50:p95 ms, comma separated")
+    parser.add_argument("--seed", type=int, default=LLM_STANDIN_SEED)
+    parser.add_argument("--rpm", type=int, default=LLM_STANDIN_RPM, help="Simulated RPM quota (0 = off)")
+    args = parser.parse_args()
+
+    import uvicorn
+
+    logging.basicConfig(level=logging.INFO)
+    state = StandinState(args.mode, args.cassette, args.latency, args.seed, args.rpm)
+    uvicorn.run(create_app(state), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+# llm_tiers.py - Per-call-site model tiers with latency SLOs
+#
+# Each LLM call site runs on either the "small" (fast, cheap) or "large"
+# deployment. Simple extraction (router, transaction intent, document
+# parsing) defaults to small; the conversational agents default to large.
+# When a site's tier is saturated (its deployment is queueing or rate
+# limited, or its recent p95 latency breaks the site's SLO), the call falls
+# back to the other tier.
+#
+# Benchmark both tiers against a labelled sample set:
+#     python llm_tiers.py benchmark --samples tier_samples.jsonl [--runs 3]
+# One JSON object per line:
+#     {"call_site": "router", "messages": [...], "max_tokens": 50,
+#      "expected": {"flag_type": "eligible"}}
+# Accuracy is the share of expected keys the (JSON) answer gets right.
+import os
+import json
+import time
+import asyncio
+import argparse
+import threading
+from collections import deque
+
+from llm_client import llm_client, LLM_DEPLOYMENT
+from llm_admission import admission_for
+
+TIER_SMALL = "small"
+TIER_LARGE = "large"
+
+LLM_SMALL_DEPLOYMENT = os.getenv("LLM_SMALL_DEPLOYMENT") or LLM_DEPLOYMENT
+LLM_LARGE_DEPLOYMENT = os.getenv("LLM_LARGE_DEPLOYMENT") or LLM_DEPLOYMENT
+DEPLOYMENTS = {TIER_SMALL: LLM_SMALL_DEPLOYMENT, TIER_LARGE: LLM_LARGE_DEPLOYMENT}
+
+LLM_TIER_FALLBACK = os.getenv("LLM_TIER_FALLBACK", "true").lower() == "true"
+# Latency samples older than this no longer count towards the SLO check,
+# so a tier that was slow gets retried once things calm down
+LLM_TIER_WINDOW_SECONDS = float(os.getenv("LLM_TIER_WINDOW_SECONDS", "60"))
+LLM_TIER_MIN_SAMPLES = int(os.getenv("LLM_TIER_MIN_SAMPLES", "10"))
+
+# Override per call site with LLM_TIER_<CALL_SITE>=small|large
+DEFAULT_TIERS = {
+    "router": TIER_SMALL,
+    "router_batch": TIER_SMALL,
+    "transaction_intent": TIER_SMALL,
+    "document_parse": TIER_SMALL,
+    "single_pass": TIER_LARGE,
+    "eligibility": TIER_LARGE,
+    "eligibility_stream": TIER_LARGE,
+    "post_application": TIER_LARGE,
+}
+
+# p95 latency objective in ms; override with LLM_SLO_MS_<CALL_SITE>
+DEFAULT_SLOS_MS = {
+    "router": 800,
+    "router_batch": 1200,
+    "transaction_intent": 1000,
+    "document_parse": 5000,
+    "single_pass": 4000,
+    "eligibility": 6000,
+    "eligibility_stream": 1500,   # time to first token
+    "post_application": 5000,
+}
+LLM_DEFAULT_SLO_MS = float(os.getenv("LLM_DEFAULT_SLO_MS", "5000"))
+
+
+def tier_for(call_site: str) -> str:
+    tier = os.getenv(f"LLM_TIER_{call_site.upper()}", "").lower()
+    if tier in DEPLOYMENTS:
+        return tier
+    return DEFAULT_TIERS.get(call_site, TIER_LARGE)
+
+
+def slo_for(call_site: str) -> float:
+    """Latency SLO in seconds"""
+    override = os.getenv(f"LLM_SLO_MS_{call_site.upper()}")
+    return float(override or DEFAULT_SLOS_MS.get(call_site, LLM_DEFAULT_SLO_MS)) / 1000
+
+
+def _other(tier: str) -> str:
+    return TIER_LARGE if tier == TIER_SMALL else TIER_SMALL
+
+
+# ============================================
+# TIER SELECTION
+# ============================================
+
+class TierLatency:
+    """Recent (timestamp, latency) samples for one call site on one tier"""
+
+    def __init__(self):
+        self.samples = deque(maxlen=200)
+        self.calls = 0
+        self.slo_misses = 0
+
+    def record(self, latency: float, slo: float):
+        self.samples.append((time.monotonic(), latency))
+        self.calls += 1
+        if latency > slo:
+            self.slo_misses += 1
+
+    def p95(self):
+        """p95 over the window, or None with too few recent samples"""
+        cutoff = time.monotonic() - LLM_TIER_WINDOW_SECONDS
+        recent = sorted(latency for at, latency in self.samples if at >= cutoff)
+        if len(recent) < LLM_TIER_MIN_SAMPLES:
+            return None
+        return recent[min(len(recent) - 1, int(len(recent) * 0.95))]
+
+
+class ModelTiers:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latency = {}
+        self.fallbacks = {}
+
+    def _latency_for(self, call_site: str, tier: str) -> TierLatency:
+        key = (call_site, tier)
+        with self._lock:
+            latency = self._latency.get(key)
+            if latency is None:
+                latency = self._latency[key] = TierLatency()
+        return latency
+
+    def saturated(self, call_site: str, tier: str) -> bool:
+        if admission_for(DEPLOYMENTS[tier]).saturated():
+            return True
+        p95 = self._latency_for(call_site, tier).p95()
+        return p95 is not None and p95 > slo_for(call_site)
+
+    def select(self, call_site: str):
+        """(tier, deployment) for the next call from this site"""
+        tier = tier_for(call_site)
+        if (LLM_TIER_FALLBACK and DEPLOYMENTS[TIER_SMALL] != DEPLOYMENTS[TIER_LARGE]
+                and self.saturated(call_site, tier)):
+            fallback = _other(tier)
+            if not self.saturated(call_site, fallback):
+                with self._lock:
+                    self.fallbacks[call_site] = self.fallbacks.get(call_site, 0) + 1
+                tier = fallback
+        return tier, DEPLOYMENTS[tier]
+
+    def record(self, call_site: str, tier: str, latency: float):
+        self._latency_for(call_site, tier).record(latency, slo_for(call_site))
+
+    def stats(self) -> dict:
+        with self._lock:
+            latency = dict(self._latency)
+            fallbacks = dict(self.fallbacks)
+
+        sites = {}
+        for (call_site, tier), samples in sorted(latency.items()):
+            p95 = samples.p95()
+            sites.setdefault(call_site, {
+                "tier": tier_for(call_site),
+                "slo_ms": slo_for(call_site) * 1000,
+                "fallbacks": fallbacks.get(call_site, 0),
+            })[tier] = {
+                "calls": samples.calls,
+                "slo_misses": samples.slo_misses,
+                "recent_p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            }
+        return {"deployments": dict(DEPLOYMENTS), "fallback_enabled": LLM_TIER_FALLBACK, "call_sites": sites}
+
+
+model_tiers = ModelTiers()
+
+
+# ============================================
+# BENCHMARK
+# ============================================
+
+def _normalise(value):
+    if isinstance(value, str):
+        return value.strip().lower()
+    if isinstance(value, list):
+        return sorted(_normalise(item) for item in value)
+    return value
+
+
+def score_answer(content: str, expected: dict) -> float:
+    """Share of expected keys matched by the JSON answer (0 if it is not valid JSON)"""
+    text = (content or "").replace("```json", "").replace("```", "").strip()
+    try:
+        answer = json.loads(text)
+    except json.JSONDecodeError:
+        return 0.0
+    if not isinstance(answer, dict) or not expected:
+        return 0.0
+    matched = sum(1 for key, value in expected.items() if _normalise(answer.get(key)) == _normalise(value))
+    return matched / len(expected)
+
+
+async def run_benchmark(samples_path: str, runs: int = 1) -> dict:
+    if llm_client is None:
+        raise SystemExit("Azure OpenAI client is not configured")
+
+    with open(samples_path, encoding="utf-8") as f:
+        samples = [json.loads(line) for line in f if line.strip()]
+
+    results = {}
+    for tier, deployment in DEPLOYMENTS.items():
+        for sample in samples:
+            call_site = sample["call_site"]
+            entry = results.setdefault(call_site, {}).setdefault(tier, {"latencies": [], "scores": [], "errors": 0})
+            for _ in range(runs):
+                started = time.perf_counter()
+                try:
+                    response = await llm_client.chat.completions.create(
+                        model=deployment,
+                        messages=sample["messages"],
+                        temperature=0,
+                        max_tokens=sample.get("max_tokens", 200),
+                    )
+                except Exception as e:
+                    entry["errors"] += 1
+                    print(f"⚠️ {call_site}/{tier}: {e}")
+                    continue
+                entry["latencies"].append(time.perf_counter() - started)
+                entry["scores"].append(score_answer(response.choices[0].message.content, sample.get("expected", {})))
+
+    report = {}
+    for call_site, tiers in results.items():
+        report[call_site] = {"configured_tier": tier_for(call_site), "slo_ms": slo_for(call_site) * 1000}
+        for tier, entry in tiers.items():
+            latencies = sorted(entry["latencies"])
+            p50 = latencies[len(latencies) // 2] if latencies else None
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None
+            report[call_site][tier] = {
+                "deployment": DEPLOYMENTS[tier],
+                "calls": len(latencies),
+                "errors": entry["errors"],
+                "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+                "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+                "meets_slo": p95 is not None and p95 <= slo_for(call_site),
+                "accuracy": round(sum(entry["scores"]) / len(entry["scores"]), 3) if entry["scores"] else None,
+            }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LLM model tiers")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("benchmark", help="Latency / accuracy of each tier on a labelled sample set")
+    bench.add_argument("--samples", required=True, help="JSONL with call_site, messages, expected")
+    bench.add_argument("--runs", type=int, default=1, help="Calls per sample and tier")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_benchmark(args.samples, args.runs))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+# llm_usage.py - Token accounting and per-session LLM budgets
+#
+# Every LLM response's usage (prompt / completion / cached prompt tokens) is
+# recorded per call site and per session by llm_resilience. Sessions past
+# their budget degrade to a cheaper mode instead of failing:
+#   soft budget -> trimmed conversation history
+#   hard budget -> minimal history and a smaller completion limit
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from metrics import Counter
+
+# Total tokens (prompt + completion) per session; 0 disables the budget
+LLM_SESSION_SOFT_BUDGET = int(os.getenv("LLM_SESSION_SOFT_BUDGET_TOKENS", "40000"))
+LLM_SESSION_HARD_BUDGET = int(os.getenv("LLM_SESSION_HARD_BUDGET_TOKENS", "100000"))
+# History kept per budget level (eligibility messages / post-application turns)
+LLM_SOFT_HISTORY_MESSAGES = int(os.getenv("LLM_SOFT_HISTORY_MESSAGES", "8"))
+LLM_HARD_HISTORY_MESSAGES = int(os.getenv("LLM_HARD_HISTORY_MESSAGES", "2"))
+LLM_HARD_MAX_TOKENS = int(os.getenv("LLM_HARD_MAX_TOKENS", "300"))
+LLM_USAGE_MAX_SESSIONS = int(os.getenv("LLM_USAGE_MAX_SESSIONS", "50000"))
+
+LLM_TOKENS = Counter("llm_tokens", "LLM tokens by call site and kind", ("call_site", "kind"))
+LLM_BUDGET_DEGRADED = Counter("llm_budget_degraded", "LLM calls made in a degraded budget mode", ("level",))
+
+BUDGET_NORMAL = "normal"
+BUDGET_SOFT = "soft"
+BUDGET_HARD = "hard"
+
+
+class UsageTotals:
+    __slots__ = ("calls", "prompt_tokens", "completion_tokens", "cached_tokens")
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, prompt: int, completion: int, cached: int):
+        self.calls += 1
+        self.prompt_tokens += prompt
+        self.completion_tokens += completion
+        self.cached_tokens += cached
+
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens,
+            "total_tokens": self.total_tokens,
+        }
+
+
+def _usage_numbers(usage):
+    prompt = getattr(usage, "prompt_tokens", 0) or 0
+    completion = getattr(usage, "completion_tokens", 0) or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", 0) or 0
+    return prompt, completion, cached
+
+
+class TokenLedger:
+    """Usage totals per call site and per session (LRU-bounded), plus budget levels"""
+
+    def __init__(self, max_sessions: int = LLM_USAGE_MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._call_sites = {}
+        self._sessions = OrderedDict()
+        self._session_sites = {}
+
+    def record(self, call_site: str, session_id: Optional[str], usage):
+        if usage is None:
+            return
+        prompt, completion, cached = _usage_numbers(usage)
+        self._record_call_site(call_site, prompt, completion, cached)
+        if session_id:
+            with self._lock:
+                self._record_session(call_site, session_id, prompt, completion, cached)
+
+    def record_shared(self, call_site: str, session_ids, usage):
+        """One call made for several sessions: each is billed an equal share of its tokens"""
+        if usage is None:
+            return
+        prompt, completion, cached = _usage_numbers(usage)
+        self._record_call_site(call_site, prompt, completion, cached)
+        if not session_ids:
+            return
+        count = len(session_ids)
+        with self._lock:
+            for index, session_id in enumerate(session_ids):
+                if session_id:
+                    # The remainder goes to the first sessions so the shares add up
+                    self._record_session(
+                        call_site, session_id,
+                        prompt // count + (index < prompt % count),
+                        completion // count + (index < completion % count),
+                        cached // count + (index < cached % count),
+                    )
+
+    def _record_call_site(self, call_site: str, prompt: int, completion: int, cached: int):
+        LLM_TOKENS.labels(call_site, "prompt").inc(prompt)
+        LLM_TOKENS.labels(call_site, "completion").inc(completion)
+        LLM_TOKENS.labels(call_site, "cached").inc(cached)
+        with self._lock:
+            self._call_sites.setdefault(call_site, UsageTotals()).add(prompt, completion, cached)
+
+    def _record_session(self, call_site: str, session_id: str, prompt: int, completion: int, cached: int):
+        # Caller holds self._lock
+        totals = self._sessions.get(session_id)
+        if totals is None:
+            totals = self._sessions[session_id] = UsageTotals()
+            self._session_sites[session_id] = {}
+            while len(self._sessions) > self.max_sessions:
+                evicted, _ = self._sessions.popitem(last=False)
+                self._session_sites.pop(evicted, None)
+        else:
+            self._sessions.move_to_end(session_id)
+        totals.add(prompt, completion, cached)
+        self._session_sites[session_id].setdefault(call_site, UsageTotals()).add(prompt, completion, cached)
+
+    def session_total(self, session_id: Optional[str]) -> int:
+        with self._lock:
+            totals = self._sessions.get(session_id)
+            return totals.total_tokens if totals else 0
+
+    def budget_level(self, session_id: Optional[str]) -> str:
+        used = self.session_total(session_id)
+        if LLM_SESSION_HARD_BUDGET and used >= LLM_SESSION_HARD_BUDGET:
+            return BUDGET_HARD
+        if LLM_SESSION_SOFT_BUDGET and used >= LLM_SESSION_SOFT_BUDGET:
+            return BUDGET_SOFT
+        return BUDGET_NORMAL
+
+    def session(self, session_id: str) -> Optional[dict]:
+        with self._lock:
+            totals = self._sessions.get(session_id)
+            if totals is None:
+                return None
+            result = totals.to_dict()
+            result["by_call_site"] = {
+                name: site.to_dict() for name, site in self._session_sites[session_id].items()
+            }
+        result["budget_level"] = self.budget_level(session_id)
+        return result
+
+    def snapshot(self, top: int = 20) -> dict:
+        with self._lock:
+            call_sites = {name: totals.to_dict() for name, totals in self._call_sites.items()}
+            heaviest = sorted(self._sessions.items(), key=lambda item: item[1].total_tokens, reverse=True)[:top]
+            top_sessions = [dict(totals.to_dict(), session_id=sid) for sid, totals in heaviest]
+            tracked = len(self._sessions)
+
+        return {
+            "budgets": {
+                "soft_tokens": LLM_SESSION_SOFT_BUDGET,
+                "hard_tokens": LLM_SESSION_HARD_BUDGET,
+            },
+            "call_sites": call_sites,
+            "sessions_tracked": tracked,
+            "top_sessions": top_sessions,
+        }
+
+
+token_ledger = TokenLedger()
+
+
+# ============================================
+# DEGRADED MODES
+# ============================================
+
+def history_limit(session_id: Optional[str], default: Optional[int] = None,
+                  soft: int = LLM_SOFT_HISTORY_MESSAGES, hard: int = LLM_HARD_HISTORY_MESSAGES) -> Optional[int]:
+    """How many history entries to send for this session (None = all)"""
+    level = token_ledger.budget_level(session_id)
+    if level == BUDGET_NORMAL:
+        return default
+
+    LLM_BUDGET_DEGRADED.labels(level).inc()
+    limit = hard if level == BUDGET_HARD else soft
+    return limit if default is None else min(default, limit)
+
+
+def max_tokens_for(session_id: Optional[str], default: int) -> int:
+    """Completion limit for this session; reduced once the hard budget is reached"""
+    if token_ledger.budget_level(session_id) == BUDGET_HARD:
+        return min(default, LLM_HARD_MAX_TOKENS)
+    return default
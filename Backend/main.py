@@ -1,19 +1,47 @@
-from fastapi import FastAPI, Form, File, UploadFile, HTTPException
+from fastapi import FastAPI, Form, File, UploadFile, HTTPException, Request, Header, Depends
 import requests
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse
 from dotenv import load_dotenv
 import os
+import asyncio
 from typing import Optional
 import json
-from openai import AzureOpenAI
+import hmac
+from llm_client import close_llm_client
+from llm_resilience import llm_call, LLMUnavailable, resilience_stats, get_deadline
+from llm_admission import traffic_class, set_traffic_class, most_urgent_traffic_class
+from llm_usage import token_ledger
+from tracing import span, set_session_id, current_session_id, set_request_attribute, start_request, detach_request, finish_request
+from metrics import HTTP_REQUEST_SECONDS, ROUTED_TURN_SECONDS, STATE_SIZE, render_metrics
+from cancellation import (
+    cancel_scope, record_cancelled_request, RequestCancelled,
+    REQUEST_DEADLINE_SECONDS, REASON_DISCONNECT
+)
+from idempotency import idempotency_store, request_fingerprint, upload_fingerprint
+from session_store import session_store
 from pathlib import Path
-from api.pre_registration import get_ai_response
+from api.pre_registration import get_ai_response, stream_ai_response
+from api.pre_registration import sessions as ELIGIBILITY_SESSIONS, voice_sessions, call_center_clients
+from api.pre_registration import draft_ai_response, commit_ai_response, build_eligibility_messages
 from api.post_registration import post_chat
+from api.post_registration import draft_post_chat, commit_post_chat, SESSION_HISTORY
 from api.post_registration import ChatRequest
 from api.registration import get_bot_response
-from api.registration import initialize_blob_storage
+from api.registration import sessions as REGISTRATION_SESSIONS
+from api.registration import ensure_blob_storage, registration_actors
+from routing.intent_rules import classify_intent, best_guess_flag, fast_path_stats, FAST_PATH_MIN_CONFIDENCE
+from routing.cache import route_cache, make_route_key, prompt_fingerprint
+from routing.session_modes import SessionModeTracker, STICKY_MODES
+from routing.batcher import RouteBatcher, RouteBudgetExceeded, ROUTE_BATCH_ENABLED
+from routing.embedding_router import embedding_router, log_route_decision
+from routing.context import compact_for_routing, context_stats
+from routing.speculation import SPECULATIVE_ROUTING, speculation_stats, estimate_tokens
+from routing.single_pass import (
+    SINGLE_PASS_INSTRUCTIONS, SINGLE_PASS_TOOL_NAME,
+    single_pass_enabled, build_single_pass_tool, parse_single_pass
+)
 import logging
 
 logging.basicConfig(level=logging.INFO)
@@ -25,17 +53,6 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 
 # eligibilty_instance=EligibilityCheckRequest()
-# --------------------------------------------------
-# Azure OpenAI Client
-# --------------------------------------------------
-AZURE_CLIENT = AzureOpenAI(
-    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
-)
-
-AZURE_DEPLOYMENT = os.getenv("AZURE_OPENAI_DEPLOYMENT")
-
 # --------------------------------------------------
 # FastAPI App
 # --------------------------------------------------
@@ -46,8 +63,61 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """
+    Root span per request; child span timings are returned in a Server-Timing
+    header and the request latency is recorded per endpoint / route flag.
+    Event streams are still producing their body when the headers go out, so
+    their span ends with the stream and they get no Server-Timing header.
+    """
+    root, tokens = start_request(
+        f"{request.method} {request.url.path}",
+        **{"http.method": request.method, "http.target": request.url.path}
+    )
+    status_code = None
+    streaming = False
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        streaming = response.headers.get("content-type", "").startswith("text/event-stream")
+    finally:
+        spans = detach_request(tokens)
+        if not streaming:
+            timing = record_request(request, root, spans, status_code)
+
+    if streaming:
+        response.body_iterator = traced_stream(response.body_iterator, request, root, spans, status_code)
+    else:
+        response.headers["Server-Timing"] = timing
+    return response
+
+
+def record_request(request: Request, root, spans: list, status_code: Optional[int]) -> str:
+    """End the root span and record the request latency; returns the Server-Timing value"""
+    timing = finish_request(root, spans, status_code)
+    route = request.scope.get("route")
+    endpoint = getattr(route, "path", "unmatched")
+    seconds = root.duration_ms / 1000
+    HTTP_REQUEST_SECONDS.labels(endpoint, request.method, status_code or 500).observe(seconds)
+    flag = root.attributes.get("route.flag")
+    if flag:
+        ROUTED_TURN_SECONDS.labels(endpoint, flag, root.attributes.get("route.source", "llm")).observe(seconds)
+    return timing
+
+
+async def traced_stream(body, request: Request, root, spans: list, status_code: Optional[int]):
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        record_request(request, root, spans, status_code)
+
+
 # Mount static files
 app.mount("/static", StaticFiles(directory="frontend/static"), name="static")
 
@@ -59,7 +129,19 @@ async def root():
     return FileResponse("frontend/index.html")
 
 
-SESSION_MODE = {}
+# Server-side routing mode per session (sticky eligible / post_application)
+SESSION_MODE = SessionModeTracker(session_store.namespace("session_modes"))
+
+# Sizes of the in-memory session structures, read when /metrics is scraped
+for _structure, _container in (
+    ("eligibility_sessions", ELIGIBILITY_SESSIONS),
+    ("registration_sessions", REGISTRATION_SESSIONS),
+    ("post_application_history", SESSION_HISTORY),
+    ("voice_sessions", voice_sessions),
+    ("call_center_clients", call_center_clients),
+    ("session_modes", SESSION_MODE),
+):
+    STATE_SIZE.labels(_structure).set_function(_container.__len__)
 # --------------------------------------------------
 # SMART ROUTER SYSTEM PROMPT (UPDATED)
 # --------------------------------------------------
@@ -279,7 +361,40 @@ Output format:
 # --------------------------------------------------
 # ROUTER FUNCTION (UPDATED)
 # --------------------------------------------------
-def route_message(message: str, prev_res: Optional[str]):
+ROUTER_FLAGS = ("eligible", "form_filling", "post_application")
+CALL_CENTER_ROUTER_FLAGS = ("eligible", "post_application")
+
+# Cache keys include the prompt fingerprint, so editing a prompt never serves stale flags
+ROUTER_PROMPT_ID = prompt_fingerprint(ROUTER_SYSTEM_PROMPT)
+CALL_CENTER_ROUTER_PROMPT_ID = prompt_fingerprint(CALL_CENTER__CHATBOT_ROUTER_SYSTEM_PROMPT)
+ROUTER_PROMPT_FLAGS = {
+    ROUTER_PROMPT_ID: ROUTER_FLAGS,
+    CALL_CENTER_ROUTER_PROMPT_ID: CALL_CENTER_ROUTER_FLAGS,
+}
+
+# Nearest-neighbour index built offline from logged LLM decisions (optional)
+embedding_router.load()
+
+
+def fast_path_route(message: str, prev_res: Optional[str], allowed_flags):
+    """
+    Try the local rule tables first.
+    Returns a routing result dict, or None when the LLM must decide.
+    """
+    match = classify_intent(message, prev_res, allowed_flags)
+    if match.flag_type and match.confidence >= FAST_PATH_MIN_CONFIDENCE:
+        fast_path_stats.record_local(match.rule)
+        return {"flag_type": match.flag_type, "confidence": match.confidence, "source": "rules"}
+    return None
+
+
+def fallback_route(message: str, prev_res: Optional[str], allowed_flags):
+    """Best local guess when the LLM router is unavailable (deadline / breaker open)"""
+    return {"flag_type": best_guess_flag(message, prev_res, allowed_flags), "source": "fallback"}
+
+
+async def llm_route(system_prompt: str, message: str, prev_res: Optional[str]):
+    """Classify intent with Azure OpenAI"""
     user_payload = f"""
 Previous assistant response:
 {prev_res or "None"}
@@ -288,39 +403,340 @@ Current user message:
 {message}
 """
 
-    response = AZURE_CLIENT.chat.completions.create(
-        model=AZURE_DEPLOYMENT,
+    response = await llm_call(
+        "router",
         messages=[
-            {"role": "system", "content": ROUTER_SYSTEM_PROMPT},
+            {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_payload}
         ],
         temperature=0,
         max_tokens=50
     )
 
+    fast_path_stats.record_llm()
     return json.loads(response.choices[0].message.content)
 
 
-def route_message_call_center(message: str, prev_res: Optional[str]):
-    user_payload = f"""
+BATCH_ROUTER_INSTRUCTIONS = """
+
+--------------------------------------------------
+BATCH MODE
+--------------------------------------------------
+You will be given several numbered, unrelated conversations.
+Classify EACH one independently with the rules above.
+
+Output format (one flag per item, in the same order):
+{
+  "flags": ["<flag_type of item 1>", "<flag_type of item 2>", ...]
+}
+"""
+
+
+async def llm_route_batch(system_prompt: str, items, session_ids):
+    """Classify several (message, prev_res) pairs in one Azure OpenAI call, billed to all their sessions"""
+    user_payload = "\n".join(
+        f"""
+### Item {index}
 Previous assistant response:
 {prev_res or "None"}
 
 Current user message:
 {message}
 """
+        for index, (message, prev_res) in enumerate(items, start=1)
+    )
 
-    response = AZURE_CLIENT.chat.completions.create(
-        model=AZURE_DEPLOYMENT,
+    response = await llm_call(
+        "router_batch",
+        shared_by=session_ids,
         messages=[
-            {"role": "system", "content": CALL_CENTER__CHATBOT_ROUTER_SYSTEM_PROMPT},
+            {"role": "system", "content": system_prompt + BATCH_ROUTER_INSTRUCTIONS},
             {"role": "user", "content": user_payload}
         ],
         temperature=0,
-        max_tokens=50
+        max_tokens=20 + 12 * len(items)
     )
 
-    return json.loads(response.choices[0].message.content)
+    for _ in items:
+        fast_path_stats.record_llm()
+    return json.loads(response.choices[0].message.content).get("flags", [])
+
+
+def build_route_batcher(system_prompt: str, allowed_flags):
+    async def classify_batch(items, contexts):
+        # Runs in the batcher's clean context: admit at the most urgent caller's priority
+        set_traffic_class(most_urgent_traffic_class([context.run(traffic_class) for context in contexts]))
+        session_ids = [context.run(current_session_id) for context in contexts]
+        return await llm_route_batch(system_prompt, items, session_ids)
+
+    async def classify_one(message, prev_res):
+        return await llm_route(system_prompt, message, prev_res)
+
+    return RouteBatcher(classify_batch, classify_one, allowed_flags, deadline=get_deadline("router"))
+
+
+# Optional micro-batching of concurrent router calls, one batcher per router prompt
+ROUTE_BATCHERS = {}
+if ROUTE_BATCH_ENABLED:
+    ROUTE_BATCHERS[ROUTER_PROMPT_ID] = build_route_batcher(ROUTER_SYSTEM_PROMPT, ROUTER_FLAGS)
+    ROUTE_BATCHERS[CALL_CENTER_ROUTER_PROMPT_ID] = build_route_batcher(
+        CALL_CENTER__CHATBOT_ROUTER_SYSTEM_PROMPT, CALL_CENTER_ROUTER_FLAGS
+    )
+
+
+async def cached_llm_route(system_prompt: str, prompt_id: str, message: str, prev_res: Optional[str]):
+    """LLM routing behind the LRU+TTL decision cache and the embedding index"""
+    # The router only needs the question prev_res asked, not the whole answer
+    prev_res = compact_for_routing(prev_res)
+    cache_key = make_route_key(prompt_id, message, prev_res)
+    routing_result = route_cache.get(cache_key)
+    if routing_result:
+        routing_result["source"] = "cache"
+        return routing_result
+
+    neighbour = None
+    if embedding_router.loaded:
+        neighbour = embedding_router.lookup(prompt_id, message, prev_res, ROUTER_PROMPT_FLAGS.get(prompt_id))
+
+    if neighbour:
+        flag_type, similarity = neighbour
+        routing_result = {"flag_type": flag_type, "confidence": round(similarity, 4), "source": "embedding"}
+    else:
+        batcher = ROUTE_BATCHERS.get(prompt_id)
+        try:
+            if batcher:
+                routing_result = await batcher.classify(message, prev_res)
+            else:
+                routing_result = await llm_route(system_prompt, message, prev_res)
+        except (LLMUnavailable, RouteBudgetExceeded) as e:
+            # Not cached: the next turn should ask the LLM again
+            logger.warning(f"⚠️ LLM router unavailable, using local fallback: {e}")
+            return fallback_route(message, prev_res, ROUTER_PROMPT_FLAGS.get(prompt_id, ROUTER_FLAGS))
+
+        if routing_result.get("flag_type"):
+            log_route_decision(prompt_id, message, prev_res, routing_result["flag_type"])
+
+    if routing_result.get("flag_type"):
+        route_cache.put(cache_key, routing_result)
+    return routing_result
+
+
+async def route_message(message: str, prev_res: Optional[str], fast_path: bool = True):
+    routing_result = fast_path_route(message, prev_res, ROUTER_FLAGS) if fast_path else None
+    if routing_result:
+        return routing_result
+
+    return await cached_llm_route(ROUTER_SYSTEM_PROMPT, ROUTER_PROMPT_ID, message, prev_res)
+
+
+async def route_message_call_center(message: str, prev_res: Optional[str], fast_path: bool = True):
+    routing_result = fast_path_route(message, prev_res, CALL_CENTER_ROUTER_FLAGS) if fast_path else None
+    if routing_result:
+        return routing_result
+
+    return await cached_llm_route(
+        CALL_CENTER__CHATBOT_ROUTER_SYSTEM_PROMPT, CALL_CENTER_ROUTER_PROMPT_ID, message, prev_res
+    )
+
+
+async def resolve_route(session_id: str, message: str, prev_res: Optional[str], call_center: bool = False,
+                        local_checked: bool = False):
+    """
+    Keep the session in its current agent when no topic switch is signalled,
+    otherwise run the router and remember its decision. local_checked: the
+    sticky mode and the rule tables already declined this turn (single-pass
+    fallback), so only the router runs.
+    """
+    allowed_flags = CALL_CENTER_ROUTER_FLAGS if call_center else ROUTER_FLAGS
+
+    if not local_checked:
+        routing_result = await SESSION_MODE.sticky_route(session_id, message, prev_res, allowed_flags)
+        if routing_result:
+            return routing_result
+
+    if call_center:
+        routing_result = await route_message_call_center(message, prev_res, fast_path=not local_checked)
+    else:
+        routing_result = await route_message(message, prev_res, fast_path=not local_checked)
+
+    if routing_result.get("flag_type"):
+        await SESSION_MODE.set(session_id, routing_result["flag_type"])
+    return routing_result
+
+
+# --------------------------------------------------
+# SPECULATIVE ROUTING
+# --------------------------------------------------
+async def draft_agent(route: str, session_id: str, message: str, aadhaar_last4: Optional[str]):
+    """
+    Run an agent without touching its session history.
+    Returns (commit, output_text); await commit() records the turn and returns the API response.
+    """
+    with span(f"agent.{route}", speculative=True):
+        if route == "eligible":
+            ai_response = await draft_ai_response(session_id, message)
+
+            async def commit():
+                await commit_ai_response(session_id, message, ai_response)
+                return {"response": {"response": ai_response}, "mode": "eligible"}
+
+            return commit, ai_response
+
+        bot_reply, chart_url = await draft_post_chat(ChatRequest(
+            session_id=session_id,
+            message=message,
+            aadhaar_last4=aadhaar_last4,
+        ))
+
+        async def commit():
+            return {
+                "response": await commit_post_chat(session_id, message, bot_reply, chart_url),
+                "mode": "post_application"
+            }
+
+        return commit, bot_reply or ""
+
+
+async def agent_prompt_tokens(route: str, session_id: str, message: str) -> int:
+    """Estimated prompt size of a discarded speculative agent call"""
+    if route == "eligible":
+        messages = await build_eligibility_messages(session_id, message)
+        return sum(estimate_tokens(m["content"]) for m in messages)
+    return estimate_tokens(str((await SESSION_HISTORY.aget(session_id, []))[-5:]) + message)
+
+
+async def route_with_speculation(session_id: str, message: str, prev_res: Optional[str],
+                                 aadhaar_last4: Optional[str], call_center: bool = False,
+                                 local_checked: bool = False):
+    """
+    Start the agent predicted from the session mode together with the router.
+    Returns (routing_result, agent_response); agent_response is only set when
+    the router agreed and the speculative draft was committed.
+    """
+    predicted = await SESSION_MODE.get(session_id)
+    if not SPECULATIVE_ROUTING or predicted not in STICKY_MODES:
+        routing_result = await resolve_route(
+            session_id, message, prev_res, call_center=call_center, local_checked=local_checked
+        )
+        return routing_result, None
+
+    draft_task = asyncio.create_task(draft_agent(predicted, session_id, message, aadhaar_last4))
+    try:
+        routing_result = await resolve_route(
+            session_id, message, prev_res, call_center=call_center, local_checked=local_checked
+        )
+    except BaseException:
+        draft_task.cancel()
+        raise
+
+    # Sticky turns skip the router, so there is nothing to overlap or score
+    router_ran = routing_result.get("source") != "session"
+
+    if routing_result.get("flag_type") == predicted:
+        try:
+            commit, _ = await draft_task
+        except Exception as e:
+            logger.warning(f"⚠️ Speculative {predicted} agent failed, running it again: {e}")
+            speculation_stats.record_error()
+            return routing_result, None
+
+        if router_ran:
+            speculation_stats.record_hit()
+        return routing_result, await commit()
+
+    # Free the draft's LLM slot before the store round trip below
+    cancelled = not draft_task.done()
+    if cancelled:
+        draft_task.cancel()
+    wasted_tokens = await agent_prompt_tokens(predicted, session_id, message)
+    if not cancelled and not draft_task.cancelled() and draft_task.exception() is None:
+        _, output_text = draft_task.result()
+        wasted_tokens += estimate_tokens(output_text)
+
+    speculation_stats.record_miss(wasted_tokens, cancelled)
+    return routing_result, None
+
+
+# --------------------------------------------------
+# SINGLE-PASS ROUTING
+# --------------------------------------------------
+async def single_pass_route(session_id: str, message: str, prev_res: Optional[str], call_center: bool = False):
+    """
+    Classify the turn and answer it as the eligibility agent in one completion.
+    Returns (routing_result, agent_response) like route_with_speculation, or
+    None when the dedicated router has to decide.
+    """
+    allowed_flags = CALL_CENTER_ROUTER_FLAGS if call_center else ROUTER_FLAGS
+    router_prompt = CALL_CENTER__CHATBOT_ROUTER_SYSTEM_PROMPT if call_center else ROUTER_SYSTEM_PROMPT
+
+    # Free decisions first: sticky session mode, then the local rule tables
+    routing_result = await SESSION_MODE.sticky_route(session_id, message, prev_res, allowed_flags)
+    if routing_result:
+        return routing_result, None
+
+    routing_result = fast_path_route(message, prev_res, allowed_flags)
+    if routing_result:
+        await SESSION_MODE.set(session_id, routing_result["flag_type"])
+        return routing_result, None
+
+    messages = await build_eligibility_messages(session_id, message)
+    messages[0] = {
+        "role": "system",
+        "content": messages[0]["content"] + SINGLE_PASS_INSTRUCTIONS.format(
+            router_rules=router_prompt,
+            prev_res=compact_for_routing(prev_res) or "None"
+        )
+    }
+
+    try:
+        response = await llm_call(
+            "single_pass",
+            messages=messages,
+            tools=[build_single_pass_tool(allowed_flags)],
+            tool_choice={"type": "function", "function": {"name": SINGLE_PASS_TOOL_NAME}},
+            max_tokens=1024
+        )
+        parsed = parse_single_pass(response.choices[0].message, allowed_flags)
+    except RequestCancelled:
+        raise
+    except Exception as e:
+        logger.warning(f"⚠️ Single-pass routing failed, using the dedicated router: {e}")
+        return None
+
+    if not parsed:
+        return None
+
+    fast_path_stats.record_llm()
+    flag_type, answer = parsed
+    await SESSION_MODE.set(session_id, flag_type)
+    routing_result = {"flag_type": flag_type, "source": "single_pass"}
+
+    if flag_type == "eligible" and answer:
+        await commit_ai_response(session_id, message, answer)
+        return routing_result, {"response": {"response": answer}, "mode": "eligible"}
+
+    return routing_result, None
+
+
+async def route_turn(session_id: str, message: str, prev_res: Optional[str],
+                     aadhaar_last4: Optional[str], call_center: bool = False):
+    """
+    Pick the routing strategy for a turn. Single-pass applies while the
+    session is (or may be) with the eligibility agent; other agents use a
+    different system prompt, so those turns go through the dedicated router.
+    """
+    endpoint = "call_center" if call_center else "web"
+    with span("router", endpoint=endpoint):
+        if single_pass_enabled(endpoint) and await SESSION_MODE.get(session_id) in (None, "eligible"):
+            result = await single_pass_route(session_id, message, prev_res, call_center=call_center)
+            if result:
+                return result
+            # Single-pass already ran the sticky check and the rule tables for this turn
+            return await route_with_speculation(
+                session_id, message, prev_res, aadhaar_last4, call_center=call_center, local_checked=True
+            )
+
+        return await route_with_speculation(session_id, message, prev_res, aadhaar_last4, call_center=call_center)
 
 
 @app.on_event("startup")
@@ -328,8 +744,8 @@ async def startup_event():
     try:
         logger.info("🚀 Starting application initialization...")
 
-        if not initialize_blob_storage():
-            logger.warning("⚠️ Blob storage initialization failed. Document uploads will not work.")
+        # Connect off the boot path; uploads call ensure_blob_storage() themselves
+        asyncio.get_running_loop().run_in_executor(None, ensure_blob_storage)
 
         logger.info("✅ Application startup complete!")
 
@@ -338,34 +754,132 @@ async def startup_event():
         raise
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    await close_llm_client()
+
+
+# --------------------------------------------------
+# AGENT DISPATCH
+# --------------------------------------------------
+async def dispatch_route(routing_result: dict, session_id: str, message: str, aadhaar_last4: Optional[str]):
+    """Run the agent selected by the router and shape the API response"""
+    route = routing_result["flag_type"]
+    with span(f"agent.{route}", route_source=routing_result.get("source", "llm")):
+        if route == 'eligible':
+            print("Routed to Eligibility Agent")
+
+            ai_response = await get_ai_response(
+                session_id=session_id,
+                user_message=message
+            )
+
+            structured_response = {
+                "response": {
+                    "response": ai_response
+                },
+                "mode": "eligible"
+            }
+
+            return structured_response
+
+
+
+
+
+        elif route == 'form_filling':
+            print("Routed to Form Filling Agent")
+
+            # first_response_form_filling = (
+            #     "We welcome you to Agripilot for filling chatbot. "
+            #     "Kindly give your full name."
+            # )
+
+            first_response_form_filling = (
+                "Kindly select your preferred language / कृपया आपली प्राधान्य भाषा निवडा / कृपया अपनी पसंदीदा भाषा चुनें:\n"
+
+            )
+
+            # first_response_form_filling=(
+            #     "🙏 नमस्कार! लाडकी बहीण योजनेत आपले स्वागत आहे!\n🙏 नमस्कार! लाडकी बहन योजना में आपका स्वागत है!\n"
+            #     "🙏 Welcome to Ladki Bahin Yojana!\n\n✅ आपण या योजनेसाठी पात्र आहात!\n✅ आप इस योजना के लिए पात्र हैं!"
+            #     "\n✅ You are eligible for this scheme!"
+            # )
+
+            return {
+                "response": first_response_form_filling,
+                "mode": "form_filling"
+            }
+
+
+
+        elif route == 'post_application':
+            print("Routed to Post Application Agent")
+            res_post_application = await post_chat(ChatRequest(
+                session_id=session_id,
+                message=message,
+                aadhaar_last4=aadhaar_last4,
+
+            ))
+            print(f"Post Application Agent Response: {res_post_application}")
+
+            return {
+                "response": res_post_application,
+                "mode": "post_application"
+            }
+
+        return {
+            "session_id": session_id,
+            "flag_type": routing_result["flag_type"]
+        }
+
+
 # --------------------------------------------------
 # ROUTER API (UPDATED INPUT)
 # --------------------------------------------------
 @app.post("/smart-chat-router-ladki-bahin")
-def smart_chat_router(
+async def smart_chat_router(
+        request: Request,
         message: str = Form(...),
         session_id: str = Form(...),
         prev_res: Optional[str] = Form(None),
         aadhaar_last4: Optional[str] = Form(None),
         doc_type: Optional[str] = Form(None),
         file: Optional[UploadFile] = File(None),
-        prev_res_mode: Optional[str] = Form(None)
+        prev_res_mode: Optional[str] = Form(None),
+        idempotency_key: Optional[str] = Header(None)
 ):
     """
     Smart router for Ladki Bahin Yojana chatbot
     Uses previous response for better routing
     """
+    return await idempotency_store.run(
+        request,
+        idempotency_key,
+        request_fingerprint(session_id, message, prev_res, aadhaar_last4, doc_type,
+                            upload_fingerprint(file), prev_res_mode),
+        lambda: smart_chat_turn(message, session_id, prev_res, aadhaar_last4, doc_type, file, prev_res_mode),
+        endpoint="web"
+    )
+
+
+async def smart_chat_turn(message: str, session_id: str, prev_res: Optional[str], aadhaar_last4: Optional[str],
+                          doc_type: Optional[str], file: Optional[UploadFile], prev_res_mode: Optional[str]):
+    """One web chat turn; cancelled with the request (see cancellation.py)"""
     print(f"Received message: {message}")
+    set_session_id(session_id)
 
     if prev_res_mode == "form_filling":
         print("Previous mode was form filling")
+        set_request_attribute("route.flag", "form_filling")
+        set_request_attribute("route.source", "client")
 
         user_msg = message.strip().lower()
 
         file_uploaded = None
         if file and file.filename:
             file_uploaded = {
-                "content": file.file.read(),  # sync read is OK here
+                "content": await file.read(),
                 "name": file.filename,
                 "extension": Path(file.filename).suffix,
                 "doc_type": doc_type
@@ -376,7 +890,7 @@ def smart_chat_router(
         # -----------------------------
         if user_msg == "submit":
             print("User chose to submit form")
-            bot_response = get_bot_response(
+            bot_response = await get_bot_response(
                 session_id,
                 message,
                 file_uploaded
@@ -392,6 +906,7 @@ def smart_chat_router(
         # -----------------------------
         elif user_msg == "exit":
             print("User chose to exit form filling")
+            await SESSION_MODE.clear(session_id)
             final_msg_registration = "Thank you for interacting with registration agent"
 
             return {
@@ -404,7 +919,7 @@ def smart_chat_router(
         # -----------------------------
         else:
             print("Else - continue form filling")
-            bot_response = get_bot_response(
+            bot_response = await get_bot_response(
                 session_id,
                 message,
                 file_uploaded
@@ -415,139 +930,209 @@ def smart_chat_router(
                 "mode": "form_filling"
             }
 
-    routing_result = route_message(message, prev_res)
+    routing_result, agent_response = await route_turn(
+        session_id, message, prev_res, aadhaar_last4
+    )
     print(f"Routing result: {routing_result}")
+    set_request_attribute("route.flag", routing_result.get("flag_type"))
+    set_request_attribute("route.source", routing_result.get("source", "llm"))
 
-    route = routing_result["flag_type"]
-
-    if route == 'eligible':
-        print("Routed to Eligibility Agent")
-
-        ai_response = get_ai_response(
-            session_id=session_id,
-            user_message=message
-        )
-
-        structured_response = {
-            "response": {
-                "response": ai_response
-            },
-            "mode": "eligible"
-        }
-
-        return structured_response
-
-
-
+    if agent_response:
+        print("Agent response already produced during routing")
+        return agent_response
 
+    return await dispatch_route(routing_result, session_id, message, aadhaar_last4)
 
-    elif route == 'form_filling':
-        print("Routed to Form Filling Agent")
-        SESSION_MODE[session_id] = "form_filling"
 
-        # first_response_form_filling = (
-        #     "We welcome you to Agripilot for filling chatbot. "
-        #     "Kindly give your full name."
-        # )
-
-        first_response_form_filling = (
-            "Kindly select your preferred language / कृपया आपली प्राधान्य भाषा निवडा / कृपया अपनी पसंदीदा भाषा चुनें:\n"
-
-        )
-
-        # first_response_form_filling=(
-        #     "🙏 नमस्कार! लाडकी बहीण योजनेत आपले स्वागत आहे!\n🙏 नमस्कार! लाडकी बहन योजना में आपका स्वागत है!\n"
-        #     "🙏 Welcome to Ladki Bahin Yojana!\n\n✅ आपण या योजनेसाठी पात्र आहात!\n✅ आप इस योजना के लिए पात्र हैं!"
-        #     "\n✅ You are eligible for this scheme!"
-        # )
+@app.post("/call-center-smart-chat-router-ladki-bahin")
+async def call_center_smart_chat_router(
+        request: Request,
+        message: str = Form(...),
+        session_id: str = Form(...),
+        prev_res: Optional[str] = Form(None),
+        aadhaar_last4: Optional[str] = Form(None),
+        prev_res_mode: Optional[str] = Form(None),
+        idempotency_key: Optional[str] = Header(None)
+):
+    """
+    Smart router for Ladki Bahin Yojana chatbot
+    Uses previous response for better routing
+    """
+    return await idempotency_store.run(
+        request,
+        idempotency_key,
+        request_fingerprint(session_id, message, prev_res, aadhaar_last4),
+        lambda: call_center_chat_turn(message, session_id, prev_res, aadhaar_last4),
+        endpoint="call_center"
+    )
 
-        return {
-            "response": first_response_form_filling,
-            "mode": "form_filling"
-        }
 
+async def call_center_chat_turn(message: str, session_id: str, prev_res: Optional[str],
+                                aadhaar_last4: Optional[str]):
+    print(f"Received message: {message}")
+    set_session_id(session_id)
 
+    routing_result, agent_response = await route_turn(
+        session_id, message, prev_res, aadhaar_last4, call_center=True
+    )
+    print(f"Routing result: {routing_result}")
+    set_request_attribute("route.flag", routing_result.get("flag_type"))
+    set_request_attribute("route.source", routing_result.get("source", "llm"))
 
-    elif route == 'post_application':
-        print("Routed to Post Application Agent")
-        res_post_application = post_chat(ChatRequest(
-            session_id=session_id,
-            message=message,
-            aadhaar_last4=aadhaar_last4,
+    if agent_response:
+        print("Agent response already produced during routing")
+        return agent_response
 
-        ))
-        print(f"Post Application Agent Response: {res_post_application}")
+    return await dispatch_route(routing_result, session_id, message, aadhaar_last4)
 
-        return {
-            "response": res_post_application,
-            "mode": "post_application"
-        }
 
-    return {
-        "session_id": session_id,
-        "flag_type": routing_result["flag_type"]
-    }
+# --------------------------------------------------
+# STREAMING ROUTER API (SSE)
+# --------------------------------------------------
+def sse_event(event: str, data) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
 
 
-@app.post("/call-center-smart-chat-router-ladki-bahin")
-def call_center_smart_chat_router(
+@app.post("/smart-chat-router-ladki-bahin/stream")
+async def smart_chat_router_stream(
         message: str = Form(...),
         session_id: str = Form(...),
         prev_res: Optional[str] = Form(None),
         aadhaar_last4: Optional[str] = Form(None),
+        doc_type: Optional[str] = Form(None),
+        file: Optional[UploadFile] = File(None),
         prev_res_mode: Optional[str] = Form(None)
 ):
     """
-    Smart router for Ladki Bahin Yojana chatbot
-    Uses previous response for better routing
+    Streaming variant of the smart router.
+    Emits a "route" event first, then "token" events for the eligibility
+    agent, and finally a "final" event with the usual {response, mode} body.
     """
-    print(f"Received message: {message}")
+    print(f"Received message (stream): {message}")
+    set_session_id(session_id)
+
+    async def event_stream():
+        # StreamingResponse cancels this generator when the client disconnects
+        with cancel_scope(REQUEST_DEADLINE_SECONDS) as scope:
+            try:
+                if prev_res_mode == "form_filling":
+                    yield sse_event("route", {"flag_type": "form_filling", "source": "client"})
+                    final = await smart_chat_turn(
+                        message, session_id, prev_res, aadhaar_last4, doc_type, file, prev_res_mode
+                    )
+                    yield sse_event("final", final)
+                    return
+
+                routing_result, agent_response = await route_turn(session_id, message, prev_res, aadhaar_last4)
+                print(f"Routing result: {routing_result}")
+                set_request_attribute("route.flag", routing_result.get("flag_type"))
+                set_request_attribute("route.source", routing_result.get("source", "llm"))
+                yield sse_event("route", routing_result)
+
+                if agent_response:
+                    # Single-pass or speculation already produced the answer
+                    final = agent_response
+                elif routing_result.get("flag_type") == "eligible":
+                    print("Streaming from Eligibility Agent")
+                    chunks = []
+                    async for delta in stream_ai_response(session_id, message):
+                        chunks.append(delta)
+                        yield sse_event("token", {"delta": delta})
+
+                    final = {"response": {"response": "".join(chunks)}, "mode": "eligible"}
+                else:
+                    final = await dispatch_route(routing_result, session_id, message, aadhaar_last4)
+
+                yield sse_event("final", final)
+
+            except asyncio.CancelledError:
+                scope.cancel(REASON_DISCONNECT)
+                record_cancelled_request("stream", REASON_DISCONNECT)
+                raise
+            except RequestCancelled as e:
+                record_cancelled_request("stream", e.reason)
+                yield sse_event("error", {"detail": "Request deadline exceeded"})
+            except Exception as e:
+                logger.error(f"❌ Streaming router error: {e}")
+                yield sse_event("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-    routing_result = route_message_call_center(message, prev_res)
-    print(f"Routing result: {routing_result}")
 
-    route = routing_result["flag_type"]
+# --------------------------------------------------
+# ADMIN: LLM TOKEN USAGE
+# --------------------------------------------------
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN", "")
 
-    if route == 'eligible':
-        print("Routed to Eligibility Agent")
 
-        ai_response = get_ai_response(
-            session_id=session_id,
-            user_message=message
-        )
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Admin endpoints need X-Admin-Token; they are disabled until ADMIN_API_TOKEN is configured"""
+    if not ADMIN_API_TOKEN:
+        raise HTTPException(status_code=503, detail="Admin endpoints are disabled (ADMIN_API_TOKEN is not set)")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, ADMIN_API_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
 
-        structured_response = {
-            "response": {
-                "response": ai_response
-            },
-            "mode": "eligible"
-        }
 
-        return structured_response
+@app.get("/admin/llm-usage", dependencies=[Depends(require_admin)])
+async def llm_usage(top: int = 20):
+    """Token usage per call site, budgets and the heaviest sessions"""
+    return token_ledger.snapshot(top=top)
 
 
+@app.get("/admin/llm-usage/{session_id}", dependencies=[Depends(require_admin)])
+async def llm_usage_for_session(session_id: str):
+    """Token usage of one session, per call site, with its budget level"""
+    usage = token_ledger.session(session_id)
+    if usage is None:
+        raise HTTPException(status_code=404, detail="No LLM usage recorded for this session")
+    return dict(usage, session_id=session_id)
 
-    elif route == 'post_application':
-        print("Routed to Post Application Agent")
-        res_post_application = post_chat(ChatRequest(
-            session_id=session_id,
-            message=message,
-            aadhaar_last4=aadhaar_last4,
 
-        ))
-        print(f"Post Application Agent Response: {res_post_application}")
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus text exposition of the in-process metrics registry"""
+    # Gauge callbacks may count sessions in a shared store: keep that off the loop
+    body = await asyncio.to_thread(render_metrics)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4; charset=utf-8")
 
-        return {
-            "response": res_post_application,
-            "mode": "post_application"
-        }
 
+@app.get("/router-stats")
+async def router_stats():
+    """How many routing decisions were served by the local rules vs. the LLM"""
     return {
-        "session_id": session_id,
-        "flag_type": routing_result["flag_type"]
+        "fast_path": fast_path_stats.snapshot(),
+        "cache": route_cache.stats(),
+        "session_modes": await asyncio.to_thread(SESSION_MODE.stats),
+        "session_store": await asyncio.to_thread(session_store.stats),
+        "session_actors": registration_actors.stats(),
+        "speculation": speculation_stats.snapshot(),
+        "embedding": embedding_router.stats(),
+        "context_compaction": context_stats.snapshot(),
+        "llm": resilience_stats(),
+        "idempotency": idempotency_store.stats(),
+        "batching": {
+            name: batcher.stats()
+            for name, batcher in (
+                ("web", ROUTE_BATCHERS.get(ROUTER_PROMPT_ID)),
+                ("call_center", ROUTE_BATCHERS.get(CALL_CENTER_ROUTER_PROMPT_ID)),
+            )
+            if batcher
+        }
     }
 
 
+@app.post("/router-cache/invalidate", dependencies=[Depends(require_admin)])
+async def invalidate_router_cache():
+    """Drop cached routing decisions (e.g. after editing the router prompts)"""
+    route_cache.invalidate()
+    return {"status": "Router cache invalidated", "cache": route_cache.stats()}
+
+
 # --------------------------------------------------
 # RUN
 # --------------------------------------------------
@@ -572,7 +1157,7 @@ async def get_speech_token():
     }
 
     try:
-        response = requests.post(fetch_token_url, headers=headers, timeout=10)
+        response = await asyncio.to_thread(requests.post, fetch_token_url, headers=headers, timeout=10)
 
         if response.status_code == 200:
             return {
@@ -613,7 +1198,9 @@ async def generate_tts(request: dict):
         # For now, let's pass a default or let the function handle it. 
         # The existing function signature is text_to_speech(text, language_code="en-IN", ...)
         
-        audio_content = text_to_speech_gemini(filename="output.wav", api_key=api_key, text=text)
+        audio_content = await asyncio.to_thread(
+            text_to_speech_gemini, filename="output.wav", api_key=api_key, text=text
+        )
         
         if not audio_content:
              raise HTTPException(status_code=500, detail="Failed to generate audio")
@@ -0,0 +1,286 @@
+# metrics.py - In-process Prometheus-style metrics
+#
+# Counter / Gauge / Histogram with labels, rendered in the Prometheus text
+# format by render_metrics() (served at /metrics by main.py).
+#
+# Recording is lock-free: every thread writes to its own shard (a plain list
+# in threading.local), and shards are only summed when /metrics is scraped.
+# Locks are taken once per thread per label set, never per observation.
+import math
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0)
+
+_registry = []
+
+
+class _Shards:
+    """Per-thread value vectors, summed on read"""
+
+    def __init__(self, size: int):
+        self._size = size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []
+
+    def local(self) -> list:
+        shard = getattr(self._local, "values", None)
+        if shard is None:
+            shard = [0.0] * self._size
+            self._local.values = shard
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def totals(self) -> list:
+        with self._lock:
+            shards = list(self._shards)
+        totals = [0.0] * self._size
+        for shard in shards:
+            for i, value in enumerate(shard):
+                totals[i] += value
+        return totals
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(str(kwargs[name]) for name in self.labelnames)
+        else:
+            values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+# ============================================
+# COUNTER
+# ============================================
+
+class _CounterChild:
+    __slots__ = ("_shards",)
+
+    def __init__(self):
+        self._shards = _Shards(1)
+
+    def inc(self, amount: float = 1.0):
+        self._shards.local()[0] += amount
+
+    def value(self) -> float:
+        return self._shards.totals()[0]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            yield f"{self.name}_total{_format_labels(self.labelnames, values)} {_format_value(child.value())}"
+
+
+# ============================================
+# GAUGE
+# ============================================
+
+class _GaugeChild:
+    __slots__ = ("_shards", "_function")
+
+    def __init__(self):
+        self._shards = _Shards(1)
+        self._function: Optional[Callable[[], float]] = None
+
+    def inc(self, amount: float = 1.0):
+        self._shards.local()[0] += amount
+
+    def dec(self, amount: float = 1.0):
+        self._shards.local()[0] -= amount
+
+    def set_function(self, function: Callable[[], float]):
+        """Read the value from function() at scrape time (e.g. len() of a dict)"""
+        self._function = function
+
+    def value(self) -> float:
+        if self._function is not None:
+            try:
+                return float(self._function())
+            except Exception:
+                return float("nan")
+        return self._shards.totals()[0]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self.labels().dec(amount)
+
+    def set_function(self, function: Callable[[], float]):
+        self.labels().set_function(function)
+
+    def track_inprogress(self):
+        return _InProgress(self.labels())
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value())}"
+
+
+class _InProgress:
+    __slots__ = ("_child",)
+
+    def __init__(self, child: _GaugeChild):
+        self._child = child
+
+    def __enter__(self):
+        self._child.inc()
+
+    def __exit__(self, *exc):
+        self._child.dec()
+
+
+# ============================================
+# HISTOGRAM
+# ============================================
+
+class _HistogramChild:
+    __slots__ = ("_bounds", "_shards")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self._bounds = bounds
+        # one slot per bucket (+Inf last), then sum, then count
+        self._shards = _Shards(len(bounds) + 3)
+
+    def observe(self, value: float):
+        shard = self._shards.local()
+        shard[bisect_left(self._bounds, value)] += 1
+        shard[-2] += value
+        shard[-1] += 1
+
+    def totals(self):
+        return self._shards.totals()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.bounds = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _samples(self):
+        for values, child in list(self._children.items()):
+            totals = child.totals()
+            cumulative = 0.0
+            for bound, count in zip(self.bounds + (float("inf"),), totals):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {_format_value(cumulative)}"
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}_sum{labels} {_format_value(totals[-2])}"
+            yield f"{self.name}_count{labels} {_format_value(totals[-1])}"
+
+
+def render_metrics() -> str:
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+# ============================================
+# APPLICATION METRICS
+# ============================================
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by endpoint",
+    ("endpoint", "method", "status")
+)
+ROUTED_TURN_SECONDS = Histogram(
+    "router_turn_duration_seconds", "Smart router request latency by route flag and decision source",
+    ("endpoint", "flag", "source")
+)
+LLM_CALL_SECONDS = Histogram(
+    "llm_call_duration_seconds", "LLM call latency (count = number of calls) by call site and outcome",
+    ("call_site", "outcome"), buckets=LLM_BUCKETS
+)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds", "Database query latency", ("query",)
+)
+DB_CONNECTIONS_IN_USE = Gauge(
+    "db_connections_in_use", "Database queries currently holding a connection"
+)
+DB_CONNECTIONS_OPENED = Counter(
+    "db_connections_opened", "New database connections opened"
+)
+OCR_QUEUE_DEPTH = Gauge(
+    "ocr_queue_depth", "OCR jobs waiting for or running in the worker thread pool"
+)
+VOICE_ACTIVE_CALLS = Gauge(
+    "voice_active_calls", "Voice calls with an open media stream"
+)
+STATE_SIZE = Gauge(
+    "app_state_entries", "Entries in in-memory session structures", ("structure",)
+)
@@ -0,0 +1,226 @@
+# registration_session.py - Compact session model for the registration state machine
+#
+# One RegistrationSession (slotted dataclass) per get_bot_response session
+# instead of a dict of a dozen nested dicts and lists:
+#   - conversation is a ring buffer of (role, message) tuples, bounded by
+#     REGISTRATION_CONVERSATION_TURNS
+#   - step / language / document-type names are interned, so sessions loaded
+#     from a shared store share one copy of each
+#   - OCR results (fields, raw_text) live in the "registration_documents"
+#     session_store namespace; the session keeps a DocumentRef per document
+#     (store key, blob URL, validity), so per-turn saves stay small
+#
+#   python registration_session.py benchmark [--sessions 1000] [--turns 60]
+#       Per-session memory and serialized size, old dict layout vs this model
+import os
+import sys
+import logging
+import argparse
+import tracemalloc
+from collections import deque
+from dataclasses import dataclass, field, fields
+from typing import Any, Dict, List, Optional
+
+from session_store import SessionStore, MemoryBackend, session_store, session_type, encode
+
+logger = logging.getLogger(__name__)
+
+REGISTRATION_CONVERSATION_TURNS = int(os.getenv("REGISTRATION_CONVERSATION_TURNS", "20"))
+
+STEP_WELCOME = "welcome"
+
+DOCUMENTS = session_store.namespace("registration_documents")
+# A session's OCR payloads are never evicted while the session is live
+session_store.own("registration_documents", "registration")
+
+
+def _conversation() -> deque:
+    return deque(maxlen=REGISTRATION_CONVERSATION_TURNS)
+
+
+@session_type("document_ref")
+class DocumentRef:
+    """An uploaded document: the OCR payload stays in DOCUMENTS under `key`"""
+
+    __slots__ = ("key", "blob_url", "is_valid")
+
+    def __init__(self, key: str, blob_url: str, is_valid: bool):
+        self.key = key
+        self.blob_url = blob_url
+        self.is_valid = is_valid
+
+    def to_state(self) -> list:
+        return [self.key, self.blob_url, self.is_valid]
+
+    @classmethod
+    def from_state(cls, state: list) -> "DocumentRef":
+        return cls(*state)
+
+
+@session_type("registration")
+@dataclass(slots=True)
+class RegistrationSession:
+    session_id: str
+    step: str = STEP_WELCOME
+    language: Optional[str] = None
+    personal_info: Dict[str, Any] = field(default_factory=dict)
+    contact_info: Dict[str, Any] = field(default_factory=dict)
+    bank_info: Dict[str, Any] = field(default_factory=dict)
+    income_info: Dict[str, Any] = field(default_factory=dict)
+    domicile_info: Dict[str, Any] = field(default_factory=dict)
+    extracted_data: Dict[str, Any] = field(default_factory=dict)
+    documents: Dict[str, DocumentRef] = field(default_factory=dict)
+    uploaded_docs: List[str] = field(default_factory=list)
+    conversation: deque = field(default_factory=_conversation)
+    ration_card_color: Optional[str] = None
+    domicile_proof_type: Optional[str] = None
+    beneficiary_id: Optional[Any] = None
+    application_id: Optional[str] = None
+    declaration_accepted: bool = False
+    status: Optional[str] = None
+    submitted_at: Optional[str] = None
+
+    def add_turn(self, role: str, message: str):
+        self.conversation.append((sys.intern(role), message))
+
+    async def attach_document(self, doc_type: str, result: Dict[str, Any]):
+        """Keep the analysis result in the document store and a reference in the session"""
+        await DOCUMENTS.aset(self._reference(doc_type, result), result)
+
+    def _reference(self, doc_type: str, result: Dict[str, Any]) -> str:
+        key = f"{self.session_id}:{doc_type}"
+        self.documents[sys.intern(doc_type)] = DocumentRef(key, result.get("blob_url", ""), bool(result.get("is_valid")))
+        return key
+
+    async def document(self, doc_type: str) -> Dict[str, Any]:
+        """Full analysis result for an uploaded document ({} if none or expired)"""
+        ref = self.documents.get(doc_type)
+        if ref is None:
+            return {}
+        result = await DOCUMENTS.aget(ref.key)
+        if result is None:
+            # Payload expired in a shared store: the blob is still there
+            logger.warning(f"⚠️ OCR result {ref.key} is no longer stored; using the blob reference only")
+            return {"blob_url": ref.blob_url, "is_valid": ref.is_valid, "fields": {}}
+        return result
+
+    def to_state(self) -> dict:
+        state = {f.name: getattr(self, f.name) for f in fields(self)}
+        state["conversation"] = [list(turn) for turn in self.conversation]
+        return state
+
+    @classmethod
+    def from_state(cls, state: dict) -> "RegistrationSession":
+        session = cls(**{**state, "conversation": _conversation()})
+        session.step = sys.intern(session.step)
+        if session.language:
+            session.language = sys.intern(session.language)
+        session.uploaded_docs = [sys.intern(doc_type) for doc_type in session.uploaded_docs]
+        session.documents = {sys.intern(doc_type): ref for doc_type, ref in session.documents.items()}
+        for role, message in state.get("conversation", []):
+            session.add_turn(role, message)
+        return session
+
+
+# ============================================
+# BENCHMARK
+# ============================================
+
+_DOC_TYPES = ("aadhaar", "ration_card", "income_certificate", "bank_passbook", "photograph")
+
+
+def _sample_result(doc_type: str, index: int) -> dict:
+    return {
+        "document_type": doc_type,
+        "raw_text": f"GOVERNMENT OF MAHARASHTRA {doc_type} {index} " * 12,
+        "fields": {"name": f"Applicant {index}", "number": f"{index:012d}", "issue_date": "01/01/2020",
+                   "district": "Pune", "taluka": "Haveli", "village": "Wagholi"},
+        "is_valid": True,
+        "validation_error": None,
+        "blob_url": f"https://account.blob.core.windows.net/ladki-bahin-documents/{index}/{doc_type}.pdf"
+                    f"?se=2030-01-01&sp=r&sv=2022-11-02&sr=b&sig={'x' * 64}",
+    }
+
+
+def _legacy_session(index: int, turns: int) -> dict:
+    session = {
+        "step": "completed",
+        "documents": {},
+        "extracted_data": {"aadhaar_number": f"{index:012d}", "name_from_aadhaar": f"Applicant {index}"},
+        "personal_info": {"name": f"Applicant {index}", "dob": "01/01/1990", "age": 34, "marital_status": "Married"},
+        "contact_info": {"mobile": "9876543210", "email": "", "address": "Wagholi, Pune"},
+        "bank_info": {"account_number": "1234567890", "ifsc": "SBIN0000001", "bank_name": "SBI"},
+        "income_info": {"ration_card_type": "yellow", "annual_income": "As per Ration Card", "source": "ration_card"},
+        "domicile_info": {},
+        "uploaded_docs": [],
+        "conversation": [],
+        "ration_card_color": "yellow",
+        "domicile_proof_type": "ration_card",
+        "beneficiary_id": None,
+        "application_id": f"APP{index:08d}",
+        "language": "marathi",
+    }
+    for doc_type in _DOC_TYPES:
+        session["documents"][doc_type] = _sample_result(doc_type, index)
+        session["uploaded_docs"].append(doc_type)
+    for turn in range(turns):
+        session["conversation"].append({"role": "user", "message": f"answer {turn}"})
+        session["conversation"].append({"role": "assistant", "message": f"✅ Question {turn} recorded. " * 4})
+    return session
+
+
+def _compact_session(index: int, turns: int) -> RegistrationSession:
+    legacy = _legacy_session(index, 0)
+    session = RegistrationSession(f"bench-{index}")
+    for name in ("step", "extracted_data", "personal_info", "contact_info", "bank_info", "income_info",
+                 "ration_card_color", "domicile_proof_type", "application_id", "language"):
+        setattr(session, name, legacy[name])
+    for doc_type, result in legacy["documents"].items():
+        DOCUMENTS.set(session._reference(doc_type, result), result)
+        session.uploaded_docs.append(doc_type)
+    for turn in range(turns):
+        session.add_turn("user", f"answer {turn}")
+        session.add_turn("assistant", f"✅ Question {turn} recorded. " * 4)
+    return session
+
+
+def _measure(build, count: int):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sessions = [build(index) for index in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return sessions, (after - before) / count
+
+
+def benchmark(count: int, turns: int):
+    global DOCUMENTS
+    store = SessionStore(MemoryBackend())
+    store.own("registration_documents", "registration")
+    DOCUMENTS = store.namespace("registration_documents")
+
+    legacy, legacy_bytes = _measure(lambda index: _legacy_session(index, turns), count)
+    compact, compact_bytes = _measure(lambda index: _compact_session(index, turns), count)
+    payload_bytes = sum(len(encode(DOCUMENTS.get(ref.key))) for ref in compact[0].documents.values())
+
+    print(f"{count} completed registrations, {turns} conversation turns each "
+          f"(ring buffer keeps {REGISTRATION_CONVERSATION_TURNS} messages)\n")
+    print(f"{'':32}{'old dict':>12}{'compact':>12}")
+    print(f"{'resident bytes / session':32}{legacy_bytes:12,.0f}{compact_bytes:12,.0f}"
+          f"  (compact includes its OCR payloads in the document store)")
+    print(f"{'serialized bytes / turn save':32}{len(encode(legacy[0])):12,}{len(encode(compact[0])):12,}"
+          f"  (+{payload_bytes:,} once per upload)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Registration session memory benchmark")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("benchmark", help="Compare the old dict layout with RegistrationSession")
+    bench.add_argument("--sessions", type=int, default=1000)
+    bench.add_argument("--turns", type=int, default=60)
+    args = parser.parse_args()
+    benchmark(args.sessions, args.turns)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Micro-batcher for LLM intent routing.
+
+Concurrent routing requests are collected for a few milliseconds and
+classified together in one structured LLM call; each flag is fanned back
+out to the caller waiting on it.
+
+The shared call runs in a clean context, so no single caller's cancel scope,
+traffic class or session applies to it; classify_batch receives every
+caller's context to attribute the call itself. Each caller has a routing
+budget of `deadline` seconds from the moment it enqueued: items the batch
+did not classify are retried in their caller's own context with whatever
+is left of it, or fail fast with RouteBudgetExceeded.
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ROUTE_BATCH_ENABLED = os.getenv("ROUTE_BATCH_ENABLED", "false").lower() in ("1", "true", "yes")
+ROUTE_BATCH_MAX_SIZE = int(os.getenv("ROUTE_BATCH_MAX_SIZE", "16"))
+ROUTE_BATCH_MAX_WAIT_MS = float(os.getenv("ROUTE_BATCH_MAX_WAIT_MS", "5"))
+
+# A retry needs at least this long to be worth sending
+ROUTE_RETRY_MIN_SECONDS = 0.25
+
+RouteItem = Tuple[str, Optional[str]]
+
+
+class RouteBudgetExceeded(Exception):
+    """A caller's routing budget ran out before its item was classified"""
+
+
+class _Pending:
+    __slots__ = ("message", "prev_res", "future", "context", "deadline")
+
+    def __init__(self, message: str, prev_res: Optional[str], future, deadline: float):
+        self.message = message
+        self.prev_res = prev_res
+        self.future = future
+        self.context = contextvars.copy_context()
+        self.deadline = deadline
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+
+class RouteBatcher:
+    """
+    Collects (message, prev_res) pairs and classifies them in batches.
+
+    classify_batch(items, contexts) must return one flag per item, in order;
+    contexts are the callers' contextvars.Context objects, in the same order.
+    classify_one(message, prev_res) is used for single-item batches and for
+    items the batch call did not return a valid flag for.
+    """
+
+    def __init__(self,
+                 classify_batch: Callable[[List[RouteItem], List[contextvars.Context]], Awaitable[List[Optional[str]]]],
+                 classify_one: Callable[[str, Optional[str]], Awaitable[dict]],
+                 allowed_flags,
+                 max_batch_size: int = ROUTE_BATCH_MAX_SIZE,
+                 max_wait_ms: float = ROUTE_BATCH_MAX_WAIT_MS,
+                 deadline: float = 4.0):
+        self.classify_batch = classify_batch
+        self.classify_one = classify_one
+        self.allowed_flags = set(allowed_flags)
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self.deadline = deadline
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+        self.batches = 0
+        self.items = 0
+        self.fallbacks = 0
+        self.expired = 0
+
+    async def classify(self, message: str, prev_res: Optional[str]) -> dict:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append(_Pending(message, prev_res, future, time.monotonic() + self.deadline))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        if len(batch) == 1:
+            # Nothing shared: classify in the caller's own context
+            self._spawn(batch[0].context, self._resolve_one(batch[0]))
+        else:
+            self._spawn(contextvars.Context(), self._run(batch))
+        self.batches += 1
+        self.items += len(batch)
+
+    def _spawn(self, context: contextvars.Context, coro):
+        task = context.run(asyncio.ensure_future, coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run(self, batch):
+        live = [item for item in batch if not item.future.done()]
+        if not live:
+            return
+
+        try:
+            # The batch may run as long as its most patient caller
+            budget = max(item.remaining() for item in live)
+            flags = await asyncio.wait_for(
+                self.classify_batch([(item.message, item.prev_res) for item in live],
+                                    [item.context for item in live]),
+                timeout=max(0.0, budget)
+            )
+        except Exception as e:
+            # Includes the batch's own timeout and RequestCancelled: retried per item
+            logger.warning(f"⚠️ Batched routing failed for {len(live)} items: {e!r}")
+            flags = []
+
+        for index, item in enumerate(live):
+            flag = flags[index] if index < len(flags) else None
+            if flag in self.allowed_flags:
+                if not item.future.done():
+                    item.future.set_result({"flag_type": flag, "source": "batch"})
+            elif not item.future.done():
+                self.fallbacks += 1
+                self._spawn(item.context, self._resolve_one(item))
+
+    async def _resolve_one(self, item: _Pending):
+        left = item.remaining()
+        if left < ROUTE_RETRY_MIN_SECONDS:
+            self.expired += 1
+            if not item.future.done():
+                item.future.set_exception(RouteBudgetExceeded(f"routing budget of {self.deadline}s used up"))
+            return
+        try:
+            result = await asyncio.wait_for(self.classify_one(item.message, item.prev_res), timeout=left)
+        except asyncio.TimeoutError:
+            self.expired += 1
+            result = None
+            error = RouteBudgetExceeded(f"routing budget of {self.deadline}s used up")
+        except Exception as e:
+            result = None
+            error = e
+        if item.future.done():
+            return
+        if result is None:
+            item.future.set_exception(error)
+        else:
+            item.future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": True,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "fallbacks": self.fallbacks,
+            "expired": self.expired,
+            "pending": len(self._pending),
+        }
@@ -0,0 +1,113 @@
+"""
+Router context compaction.
+
+The LLM router only needs to know what the previous assistant response
+was asking, not the whole answer. compact_prev_res() reduces prev_res to
+its last question sentence plus the routing keywords it contains, so
+router latency and cost track the user's message.
+"""
+
+import logging
+import os
+import re
+import threading
+import unicodedata
+from typing import Optional
+
+from routing.intent_rules import prompt_keywords
+from routing.speculation import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+ROUTER_CONTEXT_COMPACTION = os.getenv("ROUTER_CONTEXT_COMPACTION", "true").lower() in ("1", "true", "yes")
+# prev_res at or below this length is passed through unchanged
+ROUTER_CONTEXT_MAX_CHARS = int(os.getenv("ROUTER_CONTEXT_MAX_CHARS", "240"))
+MAX_KEYWORDS = 8
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.?!।])\s+|\n+")
+_TABLE_LINE = re.compile(r"^\s*(\|.*\||[-|:\s]+)$")
+_MARKDOWN = re.compile(r"[*_#`>]+")
+
+
+def _sentences(text: str):
+    for line in text.splitlines():
+        if _TABLE_LINE.match(line):
+            continue
+        for sentence in _SENTENCE_SPLIT.split(_MARKDOWN.sub("", line)):
+            sentence = sentence.strip(" -•\t")
+            if sentence:
+                yield sentence
+
+
+def compact_prev_res(prev_res: Optional[str]) -> Optional[str]:
+    """
+    Reduce prev_res to what routing needs: the last question sentence
+    (or last sentence), any closing sentence after it, and detected keywords.
+    """
+    if not ROUTER_CONTEXT_COMPACTION or not prev_res or len(prev_res) <= ROUTER_CONTEXT_MAX_CHARS:
+        return prev_res
+
+    text = unicodedata.normalize("NFC", prev_res)
+    sentences = list(_sentences(text))
+    if not sentences:
+        return prev_res[-ROUTER_CONTEXT_MAX_CHARS:]
+
+    questions = [s for s in sentences if "?" in s]
+    focus = (questions or sentences)[-1]
+    # Keep a closing instruction ("Please share your mobile number.") after the question
+    if questions and sentences[-1] != focus:
+        focus = f"{focus} {sentences[-1]}"
+    focus = focus[-ROUTER_CONTEXT_MAX_CHARS:]
+
+    keywords = prompt_keywords(text)
+    compacted = focus
+    if keywords:
+        compacted += f"\n(keywords: {', '.join(keywords[:MAX_KEYWORDS])})"
+    return compacted
+
+
+class ContextCompactionStats:
+    """Router prompt tokens saved by prev_res compaction"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.compacted = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+
+    def record(self, before: int, after: int):
+        with self._lock:
+            self.requests += 1
+            if after < before:
+                self.compacted += 1
+            self.tokens_before += before
+            self.tokens_after += after
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": ROUTER_CONTEXT_COMPACTION,
+                "requests": self.requests,
+                "compacted": self.compacted,
+                "prev_res_tokens_before": self.tokens_before,
+                "prev_res_tokens_after": self.tokens_after,
+                "tokens_saved": self.tokens_before - self.tokens_after,
+                "avg_tokens_saved": (
+                    round((self.tokens_before - self.tokens_after) / self.requests, 2)
+                    if self.requests else 0.0
+                ),
+            }
+
+
+context_stats = ContextCompactionStats()
+
+
+def compact_for_routing(prev_res: Optional[str]) -> Optional[str]:
+    """compact_prev_res() plus per-request token accounting"""
+    compacted = compact_prev_res(prev_res)
+    before, after = estimate_tokens(prev_res), estimate_tokens(compacted)
+    context_stats.record(before, after)
+    if after < before:
+        logger.info(f"✂️ prev_res compacted for routing: {before} → {after} tokens ({before - after} saved)")
+    return compacted
@@ -0,0 +1,268 @@
+"""
+Embedding nearest-neighbour intent router.
+
+Embeds the normalized (prev_res, message) pair with a hashed character
+n-gram vector and looks up the nearest labelled examples in an
+in-process NumPy index built from logged `route_message` decisions.
+Above the similarity threshold the neighbours' label is returned without
+calling the chat model.
+
+The index is rebuilt offline from the decision log and stored as plain
+.npy files, which workers memory-map at startup:
+
+    python -m routing.embedding_router build --log route_decisions.jsonl --out route_index
+
+NumPy is imported lazily: workers without an index configured never load it.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import threading
+import zlib
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+if __package__ in (None, ""):
+    import sys
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from routing.intent_rules import normalize_text
+from lazy_imports import lazy_import
+
+np = lazy_import("numpy")
+
+logger = logging.getLogger(__name__)
+
+ROUTER_EMBEDDING_INDEX_DIR = os.getenv("ROUTER_EMBEDDING_INDEX_DIR", "")
+ROUTER_EMBEDDING_THRESHOLD = float(os.getenv("ROUTER_EMBEDDING_THRESHOLD", "0.92"))
+ROUTER_EMBEDDING_TOP_K = int(os.getenv("ROUTER_EMBEDDING_TOP_K", "5"))
+ROUTE_DECISION_LOG = os.getenv("ROUTE_DECISION_LOG", "")
+
+DEFAULT_DIM = 512
+NGRAM_SIZE = 3
+# prev_res only provides context - weight it below the user's message
+PREV_RES_WEIGHT = 0.35
+# Only the tail of prev_res (where the question usually is) is embedded
+PREV_RES_TAIL_CHARS = 300
+
+
+# ============================================
+# DECISION LOG
+# ============================================
+
+decision_logger = logging.getLogger("route_decisions")
+decision_logger.propagate = False
+if ROUTE_DECISION_LOG:
+    _handler = logging.FileHandler(ROUTE_DECISION_LOG, encoding="utf-8")
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    decision_logger.addHandler(_handler)
+    decision_logger.setLevel(logging.INFO)
+
+
+def log_route_decision(prompt_id: str, message: str, prev_res: Optional[str], flag_type: str):
+    """Append an LLM routing decision to the JSONL log used to build the index"""
+    if not ROUTE_DECISION_LOG:
+        return
+    decision_logger.info(json.dumps({
+        "prompt_id": prompt_id,
+        "prev_res": prev_res,
+        "message": message,
+        "flag_type": flag_type,
+    }, ensure_ascii=False))
+
+
+# ============================================
+# EMBEDDING
+# ============================================
+
+def _add_features(vector: np.ndarray, text: str, prefix: str, weight: float):
+    dim = vector.shape[0]
+    features = []
+    for word in text.split():
+        features.append(f"{prefix}w:{word}")
+        padded = f" {word} "
+        for i in range(max(1, len(padded) - NGRAM_SIZE + 1)):
+            features.append(f"{prefix}c:{padded[i:i + NGRAM_SIZE]}")
+
+    for feature in features:
+        # crc32 is stable across processes (unlike hash())
+        h = zlib.crc32(feature.encode("utf-8"))
+        sign = 1.0 if h & 0x80000000 else -1.0
+        vector[h % dim] += sign * weight
+
+
+def embed_pair(message: str, prev_res: Optional[str], dim: int = DEFAULT_DIM) -> np.ndarray:
+    """L2-normalized hashed n-gram embedding of a (prev_res, message) pair"""
+    vector = np.zeros(dim, dtype=np.float32)
+    _add_features(vector, normalize_text(message), "m", 1.0)
+
+    prev = normalize_text(prev_res)[-PREV_RES_TAIL_CHARS:]
+    if prev:
+        _add_features(vector, prev, "p", PREV_RES_WEIGHT)
+
+    norm = float(np.linalg.norm(vector))
+    if norm > 0:
+        vector /= norm
+    return vector
+
+
+# ============================================
+# INDEX
+# ============================================
+
+class EmbeddingRouterIndex:
+    """Memory-mapped nearest-neighbour index, one matrix per router prompt"""
+
+    def __init__(self, index_dir: str = ROUTER_EMBEDDING_INDEX_DIR,
+                 threshold: float = ROUTER_EMBEDDING_THRESHOLD,
+                 top_k: int = ROUTER_EMBEDDING_TOP_K):
+        self.index_dir = index_dir
+        self.threshold = threshold
+        self.top_k = top_k
+        self.dim = DEFAULT_DIM
+        self.flags = []
+        self._vectors: Dict[str, np.ndarray] = {}
+        self._labels: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def loaded(self) -> bool:
+        return bool(self._vectors)
+
+    def load(self) -> bool:
+        """Memory-map every per-prompt matrix in index_dir"""
+        if not self.index_dir:
+            return False
+
+        meta_path = Path(self.index_dir) / "meta.json"
+        if not meta_path.exists():
+            logger.warning(f"⚠️ Embedding router index not found at {self.index_dir}")
+            return False
+
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        self.dim = meta["dim"]
+        self.flags = meta["flags"]
+        for prompt_id in meta["prompts"]:
+            base = Path(self.index_dir) / prompt_id
+            self._vectors[prompt_id] = np.load(f"{base}.vectors.npy", mmap_mode="r")
+            self._labels[prompt_id] = np.load(f"{base}.labels.npy", mmap_mode="r")
+
+        total = sum(v.shape[0] for v in self._vectors.values())
+        logger.info(f"✅ Embedding router index loaded: {total} examples, {len(self._vectors)} prompts")
+        return True
+
+    def lookup(self, prompt_id: str, message: str, prev_res: Optional[str],
+               allowed_flags=None) -> Optional[Tuple[str, float]]:
+        """
+        Return (flag_type, similarity) when the nearest neighbours agree above
+        the threshold, otherwise None.
+        """
+        vectors = self._vectors.get(prompt_id)
+        if vectors is None or vectors.shape[0] == 0:
+            return None
+
+        query = embed_pair(message, prev_res, self.dim)
+        similarities = vectors @ query
+
+        k = min(self.top_k, similarities.shape[0])
+        top = np.argpartition(-similarities, k - 1)[:k]
+        top = top[similarities[top] >= self.threshold]
+
+        result = None
+        if top.size:
+            votes = Counter()
+            for i in top:
+                votes[int(self._labels[prompt_id][i])] += float(similarities[i])
+            label, _ = votes.most_common(1)[0]
+            flag_type = self.flags[label]
+            if allowed_flags is None or flag_type in allowed_flags:
+                result = (flag_type, float(similarities[top].max()))
+
+        with self._lock:
+            if result:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "loaded": self.loaded,
+                "examples": {pid: int(v.shape[0]) for pid, v in self._vectors.items()},
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def build_index(log_path: str, out_dir: str, dim: int = DEFAULT_DIM) -> dict:
+    """
+    Build the index from a JSONL decision log.
+    Identical normalized pairs are collapsed to their majority label.
+    """
+    examples = defaultdict(lambda: defaultdict(Counter))
+    originals = {}
+
+    with open(log_path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            flag_type = record.get("flag_type")
+            if not flag_type:
+                continue
+            key = (normalize_text(record.get("prev_res")), normalize_text(record.get("message")))
+            examples[record.get("prompt_id", "default")][key][flag_type] += 1
+            originals[key] = (record.get("message", ""), record.get("prev_res"))
+
+    flags = sorted({flag for pairs in examples.values() for votes in pairs.values() for flag in votes})
+    flag_ids = {flag: i for i, flag in enumerate(flags)}
+
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    counts = {}
+    for prompt_id, pairs in examples.items():
+        vectors = np.zeros((len(pairs), dim), dtype=np.float32)
+        labels = np.zeros(len(pairs), dtype=np.int16)
+        for row, (key, votes) in enumerate(pairs.items()):
+            message, prev_res = originals[key]
+            vectors[row] = embed_pair(message, prev_res, dim)
+            labels[row] = flag_ids[votes.most_common(1)[0][0]]
+        np.save(out / f"{prompt_id}.vectors.npy", vectors)
+        np.save(out / f"{prompt_id}.labels.npy", labels)
+        counts[prompt_id] = len(pairs)
+
+    meta = {"dim": dim, "flags": flags, "prompts": sorted(counts)}
+    (out / "meta.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    return counts
+
+
+embedding_router = EmbeddingRouterIndex()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embedding router index tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Build the index from a routing decision log")
+    build_parser.add_argument("--log", required=True, help="JSONL decision log (ROUTE_DECISION_LOG)")
+    build_parser.add_argument("--out", required=True, help="Output directory (ROUTER_EMBEDDING_INDEX_DIR)")
+    build_parser.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    args = parser.parse_args()
+
+    built = build_index(args.log, args.out, args.dim)
+    for pid, count in built.items():
+        print(f"{pid}: {count} examples")
@@ -0,0 +1,332 @@
+"""
+Rule-based fast-path intent classifier for the Smart Chat Router.
+
+Encodes the override rules of ROUTER_SYSTEM_PROMPT (main.py) as
+English / Hindi / Marathi phrase and pattern tables, so that obvious
+turns ("I want to apply", "अर्ज करायचा आहे", a bare mobile number after a
+"verify" prompt, "yes" / "no") are routed locally without an
+Azure OpenAI call.
+"""
+
+import os
+import re
+import threading
+import unicodedata
+from typing import Iterable, NamedTuple, Optional
+
+# Minimum confidence for a local decision; anything below goes to the LLM
+FAST_PATH_MIN_CONFIDENCE = float(os.getenv("ROUTER_FAST_PATH_MIN_CONFIDENCE", "0.8"))
+
+# ============================================
+# PHRASE TABLES (matched on normalized text)
+# ============================================
+
+# Explicit intent to START / DO a new application
+FORM_FILLING_PHRASES = [
+    # English
+    "i want to apply", "i would like to apply", "want to apply", "apply for ladki bahin",
+    "apply for the scheme", "apply now", "start application", "start my application",
+    "start the application", "new application", "fill the form", "fill form",
+    "fill application", "submit application", "register me",
+    # Marathi
+    "अर्ज करायचा आहे", "अर्ज करायचा", "नवीन अर्ज", "अर्ज भरायचा आहे", "अर्ज भरायचा",
+    "फॉर्म भरायचा", "नोंदणी करायची",
+    # Hindi
+    "आवेदन करना है", "आवेदन करना चाहती", "आवेदन करना चाहता", "नया आवेदन",
+    "फॉर्म भरना है", "फॉर्म भरना", "अप्लाई करना",
+]
+
+# Questions about an application that was already submitted
+POST_APPLICATION_PHRASES = [
+    # English
+    "application status", "my status", "check status", "payment status", "payment received",
+    "payment credited", "my payment", "installment", "instalment", "transaction", "not received", "not credited",
+    "credited", "money not", "dbt", "linked", "linkage", "seeded", "seeding",
+    "approved", "rejected", "pending", "my application",
+    # Marathi
+    "अर्जाची स्थिती", "स्थिती", "हप्ता", "हप्ते", "पैसे आले नाहीत", "पैसे मिळाले नाहीत",
+    "जमा झाले", "लिंक", "मंजूर", "नाकारल",
+    # Hindi
+    "आवेदन की स्थिति", "स्थिति", "किस्त", "भुगतान की स्थिति", "भुगतान नहीं", "पैसे नहीं आए", "पैसे नहीं मिले",
+    "जमा नहीं", "लिंक है", "स्वीकृत", "अस्वीकृत",
+]
+
+# Questions about qualifying for the scheme
+ELIGIBILITY_PHRASES = [
+    # English
+    "am i eligible", "eligible", "eligibility", "qualify", "who can apply",
+    "criteria", "documents required", "required documents",
+    # Marathi
+    "पात्र आहे का", "पात्रता", "मी पात्र", "कोण पात्र", "कागदपत्रे लागतात",
+    # Hindi
+    "पात्र हूँ", "पात्र हूं", "योग्यता", "कौन पात्र", "दस्तावेज़ चाहिए",
+]
+
+# Words in prev_res that mark a verification / post-submission question
+VERIFICATION_PROMPT_KEYWORDS = [
+    # English
+    "check", "verify", "validate", "confirm", "linked", "link", "status", "payment",
+    "installment", "transaction", "pending", "approved", "rejected",
+    # Marathi
+    "तपास", "पडताळ", "पुष्टी", "लिंक", "स्थिती", "हप्ता", "व्यवहार",
+    # Hindi
+    "जांच", "जाँच", "सत्यापित", "पुष्टि", "स्थिति", "किस्त", "भुगतान", "लेनदेन",
+]
+
+# Words in prev_res that mark an eligibility question
+ELIGIBILITY_PROMPT_KEYWORDS = [
+    # English
+    "age", "income", "marital", "married", "resident", "family", "income tax",
+    "government employee", "pension", "four-wheeler", "four wheeler",
+    # Marathi
+    "वय", "उत्पन्न", "वैवाहिक", "रहिवासी", "कुटुंब", "आयकर", "पेन्शन", "चारचाकी",
+    # Hindi
+    "आयु", "वार्षिक आय", "निवासी", "परिवार", "पेंशन",
+]
+
+# Negation words that cancel an apply phrase when they appear just before it
+# ("i don't want to apply") or, for Marathi / Hindi word order, just after it
+# ("अर्ज करायचा नाही"); such turns are left to the LLM
+NEGATION_WORDS = {
+    "not", "dont", "don", "never",
+    "नको", "नाही", "नहीं", "नही", "मत",
+}
+NEGATION_WINDOW_BEFORE = 3
+NEGATION_WINDOW_AFTER = 2
+
+# Short confirmation replies (exact match on the whole message)
+YES_NO_REPLIES = {
+    "yes", "y", "yeah", "yep", "ok", "okay", "no", "n", "nope",
+    "हो", "होय", "नाही", "हां", "हाँ", "हा", "जी", "नहीं", "नही", "ना",
+}
+
+# ============================================
+# DATA PATTERNS
+# ============================================
+
+MOBILE_PATTERN = re.compile(r"^(?:\+?91[\s-]?)?[6-9]\d{9}$")
+AADHAAR_PATTERN = re.compile(r"^\d{4}\s?\d{4}\s?\d{4}$")
+ACCOUNT_PATTERN = re.compile(r"^\d{9,18}$")
+IFSC_PATTERN = re.compile(r"^[a-z]{4}0[a-z0-9]{6}$")
+NUMERIC_PATTERN = re.compile(r"^\d{1,4}$")
+
+_PUNCTUATION = re.compile(r"[^\w\sऀ-ॿ+-]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+class IntentMatch(NamedTuple):
+    flag_type: Optional[str]
+    confidence: float
+    rule: str
+
+
+NO_MATCH = IntentMatch(None, 0.0, "none")
+
+
+# ============================================
+# HELPERS
+# ============================================
+
+def normalize_text(text: Optional[str]) -> str:
+    """Lowercase, NFC-normalize and strip punctuation / extra whitespace"""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFC", text).lower()
+    text = _PUNCTUATION.sub(" ", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def _compile_phrases(phrases: Iterable[str]) -> "re.Pattern":
+    """
+    Build one alternation for a phrase table.
+    English phrases match on word boundaries (with an optional plural "s");
+    Devanagari phrases match as substrings so inflected forms still hit.
+    """
+    parts = []
+    for phrase in phrases:
+        escaped = re.escape(phrase)
+        if phrase.isascii():
+            parts.append(rf"\b{escaped}s?\b")
+        else:
+            parts.append(escaped)
+    return re.compile("|".join(parts))
+
+
+_FORM_FILLING_RE = _compile_phrases(FORM_FILLING_PHRASES)
+_POST_APPLICATION_RE = _compile_phrases(POST_APPLICATION_PHRASES)
+_ELIGIBILITY_RE = _compile_phrases(ELIGIBILITY_PHRASES)
+_VERIFICATION_PROMPT_RE = _compile_phrases(VERIFICATION_PROMPT_KEYWORDS)
+_ELIGIBILITY_PROMPT_RE = _compile_phrases(ELIGIBILITY_PROMPT_KEYWORDS)
+
+
+def _is_negated(msg: str, match: "re.Match") -> bool:
+    before = msg[:match.start()].split()[-NEGATION_WINDOW_BEFORE:]
+    after = msg[match.end():].split()[:NEGATION_WINDOW_AFTER]
+    return any(word in NEGATION_WORDS for word in before + after)
+
+
+def has_apply_phrase(msg: str) -> Optional[bool]:
+    """True for an apply phrase, None when one is negated (let the LLM decide), else False"""
+    matches = list(_FORM_FILLING_RE.finditer(msg))
+    if not matches:
+        return False
+    if any(_is_negated(msg, match) for match in matches):
+        return None
+    return True
+
+
+def is_data_reply(message: str) -> bool:
+    """True if the message is only a mobile / Aadhaar / account / IFSC / yes-no / numeric reply"""
+    if message in YES_NO_REPLIES:
+        return True
+    compact = message.replace(" ", "")
+    return bool(
+        MOBILE_PATTERN.match(compact)
+        or AADHAAR_PATTERN.match(message)
+        or ACCOUNT_PATTERN.match(compact)
+        or IFSC_PATTERN.match(compact)
+        or NUMERIC_PATTERN.match(compact)
+    )
+
+
+# ============================================
+# CLASSIFIER
+# ============================================
+
+def classify_intent(message: str, prev_res: Optional[str], allowed_flags: Iterable[str]) -> IntentMatch:
+    """
+    Classify a turn using the router override rules.
+
+    Returns an IntentMatch; flag_type is None (confidence 0.0) when no rule
+    fires, an apply phrase is negated, the rules disagree, or the winning
+    flag is not allowed for the calling endpoint.
+    """
+    allowed = set(allowed_flags)
+    msg = normalize_text(message)
+    prev = normalize_text(prev_res)
+
+    if not msg:
+        return NO_MATCH
+
+    wants_form = has_apply_phrase(msg)
+    if wants_form is None:
+        return NO_MATCH
+    asks_post = bool(_POST_APPLICATION_RE.search(msg))
+    asks_eligibility = bool(_ELIGIBILITY_RE.search(msg))
+    data_reply = is_data_reply(msg)
+
+    prev_verification = bool(_VERIFICATION_PROMPT_RE.search(prev)) if prev else False
+    prev_eligibility = bool(_ELIGIBILITY_PROMPT_RE.search(prev)) if prev else False
+
+    candidates = []
+
+    # Override 1: explicit application intent
+    if wants_form and not asks_post:
+        candidates.append(IntentMatch("form_filling", 0.95, "explicit_apply_phrase"))
+
+    # Override 2: data / confirmation reply to a verification-style prompt
+    if data_reply and prev_verification and not prev_eligibility:
+        candidates.append(IntentMatch("post_application", 0.95, "verification_reply"))
+
+    # Data / confirmation reply to an eligibility question
+    if data_reply and prev_eligibility and not prev_verification:
+        candidates.append(IntentMatch("eligible", 0.9, "eligibility_reply"))
+
+    # Direct topic phrases
+    if asks_post and not wants_form and not asks_eligibility:
+        candidates.append(IntentMatch("post_application", 0.85, "post_application_phrase"))
+    if asks_eligibility and not wants_form and not asks_post:
+        candidates.append(IntentMatch("eligible", 0.85, "eligibility_phrase"))
+
+    flags = {c.flag_type for c in candidates}
+    if len(flags) != 1:
+        return NO_MATCH
+
+    best = max(candidates, key=lambda c: c.confidence)
+    if best.flag_type not in allowed:
+        return NO_MATCH
+    return best
+
+
+def detect_topics(message: str, prev_res: Optional[str]) -> set:
+    """
+    Cheap topic signals for a turn: every flag whose phrases appear in the
+    message, plus post_application for a data reply to a verification prompt.
+    Unlike classify_intent this never resolves conflicts.
+    """
+    msg = normalize_text(message)
+    topics = set()
+    if _FORM_FILLING_RE.search(msg):
+        topics.add("form_filling")
+    if _POST_APPLICATION_RE.search(msg):
+        topics.add("post_application")
+    if _ELIGIBILITY_RE.search(msg):
+        topics.add("eligible")
+
+    prev = normalize_text(prev_res)
+    if prev and is_data_reply(msg) and _VERIFICATION_PROMPT_RE.search(prev):
+        topics.add("post_application")
+    return topics
+
+
+def best_guess_flag(message: str, prev_res: Optional[str], allowed_flags: Iterable[str]) -> str:
+    """
+    Local decision when no router is available: any rule match, else a
+    single detected topic, else the eligibility agent.
+    """
+    match = classify_intent(message, prev_res, allowed_flags)
+    if match.flag_type:
+        return match.flag_type
+
+    topics = detect_topics(message, prev_res) & set(allowed_flags)
+    if len(topics) == 1:
+        return topics.pop()
+    return "eligible"
+
+
+def prompt_keywords(prev_res: Optional[str]) -> list:
+    """Verification / eligibility keywords found in prev_res, in order, without duplicates"""
+    prev = normalize_text(prev_res)
+    keywords = []
+    for pattern in (_VERIFICATION_PROMPT_RE, _ELIGIBILITY_PROMPT_RE):
+        for keyword in pattern.findall(prev):
+            if keyword not in keywords:
+                keywords.append(keyword)
+    return keywords
+
+
+# ============================================
+# FAST-PATH STATISTICS
+# ============================================
+
+class FastPathStats:
+    """Counts routing decisions served locally vs. by the LLM"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.local = 0
+        self.llm = 0
+        self.by_rule = {}
+
+    def record_local(self, rule: str):
+        with self._lock:
+            self.local += 1
+            self.by_rule[rule] = self.by_rule.get(rule, 0) + 1
+
+    def record_llm(self):
+        with self._lock:
+            self.llm += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            total = self.local + self.llm
+            return {
+                "local": self.local,
+                "llm": self.llm,
+                "total": total,
+                "local_ratio": round(self.local / total, 4) if total else 0.0,
+                "by_rule": dict(self.by_rule),
+            }
+
+
+fast_path_stats = FastPathStats()
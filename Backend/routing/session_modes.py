@@ -0,0 +1,89 @@
+"""
+Server-side session mode tracker for the Smart Chat Router.
+
+Remembers which agent each session was last routed to and keeps
+follow-up turns inside the eligibility / post-application agents
+without another router LLM call, until a cheap topic-switch signal
+(or the re-check interval) says the router should decide again.
+
+State lives in a session_store namespace, so every worker sees the same mode;
+lookups are coroutines so shared backends stay off the event loop.
+"""
+
+import os
+import threading
+import time
+from typing import Iterable, Optional
+
+from routing.intent_rules import detect_topics
+
+# Modes a session may stick to between router calls
+STICKY_MODES = ("eligible", "post_application")
+
+# Force a router re-check after this many consecutive sticky turns
+STICKY_MAX_TURNS = int(os.getenv("ROUTER_STICKY_MAX_TURNS", "6"))
+
+
+class SessionModeTracker:
+    """Per-session routing mode with sticky-turn accounting"""
+
+    def __init__(self, modes, max_sticky_turns: int = STICKY_MAX_TURNS):
+        self.max_sticky_turns = max_sticky_turns
+        self._modes = modes
+        self._lock = threading.Lock()
+        self.sticky_hits = 0
+        self.reroutes = 0
+
+    def __len__(self):
+        return len(self._modes)
+
+    async def get(self, session_id: str) -> Optional[str]:
+        state = await self._modes.aget(session_id)
+        return state["mode"] if state else None
+
+    async def set(self, session_id: str, mode: str):
+        """Record a router decision for the session"""
+        await self._modes.aset(session_id, {"mode": mode, "sticky_turns": 0, "updated_at": time.time()})
+
+    async def clear(self, session_id: str):
+        await self._modes.adelete(session_id)
+
+    async def sticky_route(self, session_id: str, message: str, prev_res: Optional[str],
+                           allowed_flags: Iterable[str]) -> Optional[dict]:
+        """
+        Return a routing result that keeps the session in its current agent,
+        or None when the router should run (no sticky mode, topic switch
+        signal, or too many sticky turns in a row).
+        """
+        state = await self._modes.aget(session_id)
+        if not state or state["mode"] not in STICKY_MODES or state["mode"] not in allowed_flags:
+            return None
+
+        mode = state["mode"]
+        if state["sticky_turns"] >= self.max_sticky_turns:
+            self._count("reroutes")
+            return None
+
+        if detect_topics(message, prev_res) - {mode}:
+            self._count("reroutes")
+            return None
+
+        state["sticky_turns"] += 1
+        state["updated_at"] = time.time()
+        await self._modes.aset(session_id, state)
+        self._count("sticky_hits")
+        return {"flag_type": mode, "source": "session"}
+
+    def _count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def stats(self) -> dict:
+        with self._lock:
+            decisions = self.sticky_hits + self.reroutes
+            return {
+                "sessions": len(self._modes),
+                "sticky_hits": self.sticky_hits,
+                "reroutes": self.reroutes,
+                "sticky_ratio": round(self.sticky_hits / decisions, 4) if decisions else 0.0,
+            }
@@ -0,0 +1,89 @@
+"""
+Single-pass routing for the Smart Chat Router.
+
+One eligibility-agent completion both classifies the turn (through a
+forced `respond` tool call) and, when the turn belongs to the
+eligibility agent, carries the answer. Other routes fall through to
+their own agents without a separate router call.
+"""
+
+import json
+import os
+from typing import Iterable, Optional, Tuple
+
+# Comma separated endpoint names: "web", "call_center"
+SINGLE_PASS_ENDPOINTS = {
+    name.strip()
+    for name in os.getenv("SINGLE_PASS_ROUTING_ENDPOINTS", "").split(",")
+    if name.strip()
+}
+
+SINGLE_PASS_TOOL_NAME = "respond"
+
+SINGLE_PASS_INSTRUCTIONS = """
+
+--------------------------------------------------
+ROUTING (decide BEFORE answering)
+--------------------------------------------------
+You are also the intent router for this conversation. Classify the current
+user message with the router rules below, then call the `respond` tool
+exactly once:
+- flag_type = "eligible": put your full answer (following BEHAVIOR above)
+  in "response"
+- any other flag_type: leave "response" empty, another agent will answer
+
+Report the flag only through the tool; ignore the router's JSON output format.
+
+ROUTER RULES:
+{router_rules}
+
+Previous assistant response shown to the user:
+{prev_res}
+"""
+
+
+def single_pass_enabled(endpoint: str) -> bool:
+    return endpoint in SINGLE_PASS_ENDPOINTS
+
+
+def build_single_pass_tool(allowed_flags: Iterable[str]) -> dict:
+    """`respond` tool schema restricted to the endpoint's flags"""
+    return {
+        "type": "function",
+        "function": {
+            "name": SINGLE_PASS_TOOL_NAME,
+            "description": "Report the routing flag and, for eligibility turns, the answer to the user.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "flag_type": {"type": "string", "enum": list(allowed_flags)},
+                    "response": {
+                        "type": "string",
+                        "description": "Answer to the user when flag_type is eligible, otherwise empty."
+                    }
+                },
+                "required": ["flag_type", "response"]
+            }
+        }
+    }
+
+
+def parse_single_pass(message, allowed_flags: Iterable[str]) -> Optional[Tuple[str, str]]:
+    """
+    Read (flag_type, response) from a chat completion message.
+    Returns None when the model did not produce a usable tool call.
+    """
+    for tool_call in message.tool_calls or []:
+        if tool_call.function.name != SINGLE_PASS_TOOL_NAME:
+            continue
+        try:
+            arguments = json.loads(tool_call.function.arguments)
+        except (TypeError, ValueError):
+            return None
+
+        flag_type = arguments.get("flag_type")
+        if flag_type not in allowed_flags:
+            return None
+        return flag_type, (arguments.get("response") or "").strip()
+
+    return None
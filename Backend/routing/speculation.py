@@ -0,0 +1,63 @@
+"""
+Speculative routing support for the Smart Chat Router.
+
+The agent predicted from the session's last mode is started alongside the
+router; its draft is committed when the router agrees and discarded
+otherwise. SpeculationStats tracks whether that pays for itself.
+"""
+
+import math
+import os
+import threading
+
+SPECULATIVE_ROUTING = os.getenv("SPECULATIVE_ROUTING", "false").lower() in ("1", "true", "yes")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token) for metrics, not billing"""
+    if not text:
+        return 0
+    return math.ceil(len(text) / 4)
+
+
+class SpeculationStats:
+    """Hit-rate and wasted-token accounting for speculative agent runs"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.wasted_tokens = 0
+
+    def record_hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def record_miss(self, wasted_tokens: int, cancelled: bool):
+        with self._lock:
+            self.misses += 1
+            self.wasted_tokens += wasted_tokens
+            if cancelled:
+                self.cancelled += 1
+
+    def record_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            attempts = self.hits + self.misses
+            return {
+                "enabled": SPECULATIVE_ROUTING,
+                "hits": self.hits,
+                "misses": self.misses,
+                "errors": self.errors,
+                "cancelled": self.cancelled,
+                "hit_rate": round(self.hits / attempts, 4) if attempts else 0.0,
+                "wasted_tokens_estimate": self.wasted_tokens,
+            }
+
+
+speculation_stats = SpeculationStats()
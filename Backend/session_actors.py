@@ -0,0 +1,209 @@
+# session_actors.py - Per-session mailboxes that run one turn at a time
+#
+# Two requests for the same session (a double-tap, or a retry while OCR is
+# still running) must not run a state machine turn concurrently: both would
+# advance session.step, generate an application id or upload the same
+# document. SessionActors gives every active session a mailbox drained by one
+# task, so turns for one session run in arrival order while different
+# sessions stay fully parallel. Mailboxes exist only while they have work.
+#
+# A message whose key matches the last turn queued or running for the session
+# is coalesced: the duplicate waits for that turn's result instead of running
+# again. Only the tail is joined, so ["yes", "2", "yes"] still runs three
+# turns in order. A turn runs in its first sender's context (tracing, traffic
+# class) under its own cancel scope; it is cancelled, or dropped if still
+# queued, once every request waiting on it has gone, except while it is
+# inside a protected() section (a DB write and the session save recording it).
+#
+# Mailboxes live in one process. With a session store shared by several
+# workers (SESSION_STORE=sqlite / redis), each turn also holds the session's
+# lease in that store (SessionStore.acquire_lock), renewed while it runs, so
+# a request for the same session on another worker waits for it as well.
+import os
+import uuid
+import asyncio
+import logging
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Hashable
+
+from cancellation import cancel_scope, record_cancelled_work, REQUEST_DEADLINE_SECONDS, REASON_DISCONNECT
+from metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+# A turn's lease on its session outlives a crashed worker by at most this long
+SESSION_LOCK_TTL_SECONDS = float(os.getenv("SESSION_LOCK_TTL_SECONDS", "30"))
+SESSION_LOCK_POLL_SECONDS = float(os.getenv("SESSION_LOCK_POLL_SECONDS", "0.05"))
+SESSION_LOCK_POLL_MAX_SECONDS = 0.5
+
+ACTOR_MESSAGES = Counter(
+    "session_actor_messages", "Messages handled by per-session mailboxes by outcome", ("actor", "outcome")
+)
+ACTOR_QUEUED = Gauge(
+    "session_actor_queued", "Turns queued or running in per-session mailboxes", ("actor",)
+)
+
+
+_current_turn = contextvars.ContextVar("session_actor_turn", default=None)
+
+
+class _Turn:
+    __slots__ = ("key", "make_work", "context", "done", "task", "scope", "waiters", "protected", "token")
+
+    def __init__(self, key: Hashable, make_work: Callable, loop: asyncio.AbstractEventLoop):
+        self.key = key
+        self.make_work = make_work
+        self.context = contextvars.copy_context()
+        self.done = loop.create_future()
+        self.task = None
+        self.scope = None
+        self.waiters = 0
+        self.protected = 0
+        self.token = uuid.uuid4().hex
+
+
+@contextmanager
+def protected():
+    """Keep the current turn running even if every sender leaves while inside"""
+    turn = _current_turn.get()
+    if turn is not None:
+        turn.protected += 1
+    try:
+        yield
+    finally:
+        if turn is not None:
+            turn.protected -= 1
+
+
+class SessionActors:
+    """
+    Serialized, coalescing execution per session id (event loop only).
+    `locks` (a SessionStore) extends the serialization to other workers.
+    """
+
+    def __init__(self, name: str, locks=None):
+        self.name = name
+        self.locks = locks
+        self._mailboxes = {}
+        self._drains = set()
+        self.processed = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.lock_waits = 0
+        ACTOR_QUEUED.labels(name).set_function(self.queued)
+
+    def queued(self) -> int:
+        return sum(len(mailbox) for mailbox in self._mailboxes.values())
+
+    async def submit(self, session_id: str, key: Hashable, make_work: Callable[[], Any]) -> Any:
+        """Run make_work() after the session's earlier turns, or join the last turn if it has the same key"""
+        mailbox = self._mailboxes.get(session_id)
+        turn = mailbox[-1] if mailbox and mailbox[-1].key == key else None
+
+        if turn is not None:
+            self.coalesced += 1
+            ACTOR_MESSAGES.labels(self.name, "coalesced").inc()
+        else:
+            turn = _Turn(key, make_work, asyncio.get_running_loop())
+            if mailbox is None:
+                mailbox = self._mailboxes[session_id] = deque()
+                drain = asyncio.ensure_future(self._drain(session_id, mailbox))
+                self._drains.add(drain)
+                drain.add_done_callback(self._drains.discard)
+            mailbox.append(turn)
+
+        turn.waiters += 1
+        try:
+            return await asyncio.shield(turn.done)
+        finally:
+            turn.waiters -= 1
+            if turn.waiters == 0 and turn.task is not None and not turn.task.done() and not turn.protected:
+                turn.scope.cancel(REASON_DISCONNECT)
+                turn.task.cancel()
+
+    def _start(self, turn: _Turn):
+        # Runs inside turn.context, which the task copies along with the new scope
+        _current_turn.set(turn)
+        with cancel_scope(REQUEST_DEADLINE_SECONDS) as scope:
+            turn.task = asyncio.ensure_future(turn.make_work())
+        turn.scope = scope
+
+    def _lock_name(self, session_id: str) -> str:
+        return f"{self.name}:{session_id}"
+
+    async def _acquire(self, session_id: str, turn: _Turn) -> bool:
+        """Wait for the session's lease; False if every sender left while waiting"""
+        if self.locks is None:
+            return True
+        name, delay, waited = self._lock_name(session_id), SESSION_LOCK_POLL_SECONDS, False
+        while not await self.locks.acquire_lock(name, turn.token, SESSION_LOCK_TTL_SECONDS):
+            if not waited:
+                waited = True
+                self.lock_waits += 1
+                ACTOR_MESSAGES.labels(self.name, "lock_wait").inc()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, SESSION_LOCK_POLL_MAX_SECONDS)
+            if turn.waiters == 0:
+                return False
+        return True
+
+    async def _renew(self, session_id: str, turn: _Turn):
+        name = self._lock_name(session_id)
+        while True:
+            await asyncio.sleep(SESSION_LOCK_TTL_SECONDS / 3)
+            if not await self.locks.renew_lock(name, turn.token, SESSION_LOCK_TTL_SECONDS):
+                logger.warning(f"⚠️ Session lease '{name}' was lost while its turn was running")
+
+    async def _drain(self, session_id: str, mailbox: deque):
+        try:
+            while mailbox:
+                turn = mailbox[0]
+                if turn.waiters == 0 or not await self._acquire(session_id, turn):
+                    # Every sender left while it was queued
+                    self.dropped += 1
+                    ACTOR_MESSAGES.labels(self.name, "dropped").inc()
+                    record_cancelled_work("queued_turn")
+                    turn.done.cancel()
+                    mailbox.popleft()
+                    continue
+
+                renew = asyncio.ensure_future(self._renew(session_id, turn)) if self.locks is not None else None
+                turn.context.run(self._start, turn)
+                try:
+                    await asyncio.wait({turn.task})
+                except asyncio.CancelledError:
+                    turn.task.cancel()
+                    raise
+                finally:
+                    mailbox.popleft()
+                    if renew is not None:
+                        renew.cancel()
+                        await self.locks.release_lock(self._lock_name(session_id), turn.token)
+
+                self.processed += 1
+                ACTOR_MESSAGES.labels(self.name, "processed").inc()
+                error = None if turn.task.cancelled() else turn.task.exception()
+                if turn.task.cancelled() or turn.waiters == 0:
+                    turn.done.cancel()
+                elif error is not None:
+                    turn.done.set_exception(error)
+                else:
+                    turn.done.set_result(turn.task.result())
+        finally:
+            if self._mailboxes.get(session_id) is mailbox:
+                del self._mailboxes[session_id]
+            for turn in mailbox:
+                if not turn.done.done():
+                    turn.done.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "active_sessions": len(self._mailboxes),
+            "queued": self.queued(),
+            "processed": self.processed,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "lock_waits": self.lock_waits,
+        }
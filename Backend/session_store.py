@@ -0,0 +1,861 @@
+# session_store.py - Pluggable store for conversational session state
+#
+# Router modes, eligibility / registration / post-application conversations
+# and live voice calls are kept in a SessionStore instead of per-process dicts,
+# so several uvicorn workers can serve the same session and a restart keeps
+# half-finished registrations (and the OCR results already paid for):
+#
+#   SESSION_STORE=memory   per-process (default); values are kept as live objects
+#   SESSION_STORE=sqlite   SESSION_STORE_URL=sessions.db, shared by workers on one host
+#   SESSION_STORE=redis    SESSION_STORE_URL=redis://host:6379/0, any Redis-protocol server
+#
+# Each structure is a namespace with its own idle TTL (DEFAULT_TTLS, overridden
+# by SESSION_TTL_<NAMESPACE> in seconds). Callers read a value, change it and
+# write it back with set(), which also renews the TTL. The memory backend
+# hands out the stored object itself, so a forgotten set() only shows up on
+# the shared backends.
+#
+# Coroutines use the async methods (aget / aset / adelete / aitems / acount),
+# which run SQLite and Redis calls in a worker thread instead of on the event
+# loop. When a shared backend fails, a namespace degrades to a per-process
+# copy (session_store_errors_total{namespace,operation}) until it answers.
+# Shared values carry the wall-clock time they were written and deletes leave
+# a tombstone, so a local copy is written back only if nothing newer reached
+# the shared backend in the meantime (workers need roughly synced clocks).
+#
+# The memory backend is bounded: reads renew the idle TTL, a background
+# sweeper drops expired sessions every SESSION_SWEEP_INTERVAL_SECONDS, and
+# once the estimated resident size passes SESSION_MEMORY_BUDGET_BYTES the
+# least recently used sessions are evicted. Payloads stored next to a session
+# (SessionStore.own(), e.g. registration documents) live and die with it.
+# Sizes are estimated per write, reusing a recent estimate when the same
+# live object is written back (SESSION_SIZE_REFRESH_SECONDS). Evictions and
+# resident bytes are exported as session_evictions_total{namespace,reason}
+# and session_resident_bytes{namespace}.
+#
+# SessionStore.acquire_lock / renew_lock / release_lock are leases shared by
+# every worker on a shared backend (a row in SQLite, SET NX PX in Redis), used
+# to run one turn per session at a time across workers (session_actors). The
+# memory backend is one process, so its locks always succeed.
+#
+# Shared backends serialize values as compact JSON (datetime / date / set and
+# classes registered with @session_type are tagged), zlib-compressed from
+# SESSION_COMPRESS_MIN_BYTES up.
+import os
+import sys
+import json
+import asyncio
+import time
+import zlib
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict, deque
+from datetime import date, datetime
+from typing import Any, Iterator, Optional, Tuple
+
+from lazy_imports import lazy_import
+from metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+SESSION_STORE = os.getenv("SESSION_STORE", "memory").lower()
+SESSION_STORE_URL = os.getenv("SESSION_STORE_URL", "")
+SESSION_STORE_PREFIX = os.getenv("SESSION_STORE_PREFIX", "ladki")
+SESSION_COMPRESS_MIN_BYTES = int(os.getenv("SESSION_COMPRESS_MIN_BYTES", "1024"))
+SESSION_MEMORY_BUDGET_BYTES = int(os.getenv("SESSION_MEMORY_BUDGET_BYTES", str(256 * 1024 * 1024)))
+SESSION_SWEEP_INTERVAL_SECONDS = float(os.getenv("SESSION_SWEEP_INTERVAL_SECONDS", "60"))
+# A live session written back unchanged in identity is re-measured at most this often
+SESSION_SIZE_REFRESH_SECONDS = float(os.getenv("SESSION_SIZE_REFRESH_SECONDS", "30"))
+
+EVICT_TTL = "ttl"
+EVICT_MEMORY = "memory"
+
+SESSION_EVICTIONS = Counter(
+    "session_evictions", "Sessions dropped from the in-process store by namespace and reason", ("namespace", "reason")
+)
+SESSION_STORE_ERRORS = Counter(
+    "session_store_errors", "Shared session store operations that failed and used the local copy",
+    ("namespace", "operation")
+)
+SESSION_RESIDENT_BYTES = Gauge(
+    "session_resident_bytes", "Estimated bytes held by in-process sessions", ("namespace",)
+)
+
+# Seconds a session survives without being read or written
+DEFAULT_TTLS = {
+    "session_modes": 6 * 3600,
+    "eligibility": 24 * 3600,
+    "registration": 7 * 24 * 3600,
+    "registration_documents": 7 * 24 * 3600,
+    "post_application": 24 * 3600,
+    "voice": 4 * 3600,
+}
+DEFAULT_TTL_SECONDS = 24 * 3600
+
+redis = lazy_import("redis")
+
+
+def ttl_for(namespace: str) -> Optional[float]:
+    """TTL in seconds for a namespace; 0 or less means keep forever"""
+    override = os.getenv(f"SESSION_TTL_{namespace.upper()}")
+    ttl = float(override) if override else DEFAULT_TTLS.get(namespace, DEFAULT_TTL_SECONDS)
+    return ttl if ttl > 0 else None
+
+
+# ============================================
+# SERIALIZATION
+# ============================================
+
+_PLAIN = b"j"
+_COMPRESSED = b"z"
+
+_SESSION_TYPES = {}
+
+
+def session_type(name: str):
+    """Class decorator: store instances via to_state() / cls.from_state(state)"""
+    def register(cls):
+        cls.SESSION_TYPE = name
+        _SESSION_TYPES[name] = cls
+        return cls
+    return register
+
+
+def _tag(value):
+    if getattr(type(value), "SESSION_TYPE", None) in _SESSION_TYPES:
+        return {"__type__": value.SESSION_TYPE, "state": value.to_state()}
+    if isinstance(value, datetime):
+        return {"__dt__": value.isoformat()}
+    if isinstance(value, date):
+        return {"__date__": value.isoformat()}
+    if isinstance(value, (set, frozenset)):
+        return {"__set__": list(value)}
+    raise TypeError(f"{type(value).__name__} cannot be stored in a session")
+
+
+def _untag(obj: dict):
+    if len(obj) == 1:
+        if "__dt__" in obj:
+            return datetime.fromisoformat(obj["__dt__"])
+        if "__date__" in obj:
+            return date.fromisoformat(obj["__date__"])
+        if "__set__" in obj:
+            return set(obj["__set__"])
+    elif len(obj) == 2 and "__type__" in obj and "state" in obj:
+        return _SESSION_TYPES[obj["__type__"]].from_state(obj["state"])
+    return obj
+
+
+def encode(value: Any) -> bytes:
+    raw = json.dumps(value, default=_tag, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    if len(raw) >= SESSION_COMPRESS_MIN_BYTES:
+        return _COMPRESSED + zlib.compress(raw, 6)
+    return _PLAIN + raw
+
+
+def decode(blob: bytes) -> Any:
+    """Decode a stored value; an empty blob is a tombstone and decodes to None"""
+    if not blob:
+        return None
+    marker, body = blob[:1], blob[1:]
+    if marker == _COMPRESSED:
+        body = zlib.decompress(body)
+    return json.loads(body.decode("utf-8"), object_hook=_untag)
+
+
+# ============================================
+# BACKENDS
+# ============================================
+
+def estimate_size(value: Any) -> int:
+    """Deep sys.getsizeof of a session value (containers, slotted objects and their contents)"""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += estimate_size(key) + estimate_size(item)
+    elif isinstance(value, (list, tuple, set, frozenset, deque)):
+        for item in value:
+            size += estimate_size(item)
+    elif hasattr(type(value), "__slots__"):
+        for name in type(value).__slots__:
+            size += estimate_size(getattr(value, name, None))
+    return size
+
+
+class _Entry:
+    __slots__ = ("value", "ttl", "expires_at", "size", "sized_at")
+
+    def __init__(self, value: Any, ttl: Optional[float], size: int, sized_at: float):
+        self.value = value
+        self.ttl = ttl
+        self.size = size
+        self.sized_at = sized_at
+        self.expires_at = sized_at + ttl if ttl else None
+
+    def expired(self, now: float) -> bool:
+        return self.expires_at is not None and self.expires_at <= now
+
+    def touch(self, now: float):
+        if self.ttl:
+            self.expires_at = now + self.ttl
+
+
+class MemoryBackend:
+    """
+    Per-process dicts, one per namespace, under one LRU memory budget; values
+    are not copied. A namespace can be owned by another (own()): its entries
+    belong to the parent session named by the key prefix ("<parent>:<name>"),
+    are never evicted on their own, have their TTL renewed with the parent and
+    are dropped together with it.
+    """
+
+    name = "memory"
+    blocking = False
+    errors = ()
+
+    def __init__(self, max_bytes: int = SESSION_MEMORY_BUDGET_BYTES,
+                 sweep_interval: float = SESSION_SWEEP_INTERVAL_SECONDS):
+        self.max_bytes = max_bytes
+        self.sweep_interval = sweep_interval
+        self._data = {}
+        self._lru: "OrderedDict[tuple, None]" = OrderedDict()
+        self._bytes = {}
+        self.resident_bytes = 0
+        self.evictions = {EVICT_TTL: 0, EVICT_MEMORY: 0}
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self._owners = {}      # child namespace -> parent namespace
+        self._children = {}    # parent namespace -> child namespaces
+        self._owned = {}       # (parent namespace, parent key) -> {(child namespace, child key)}
+
+    def own(self, child: str, parent: str):
+        """Tie every `child` entry keyed "<parent key>:..." to that `parent` session"""
+        with self._lock:
+            self._owners[child] = parent
+            self._children.setdefault(parent, set()).add(child)
+
+    def _owner(self, namespace: str, key: str) -> Optional[tuple]:
+        parent = self._owners.get(namespace)
+        if parent is None:
+            return None
+        return parent, key.rpartition(":")[0]
+
+    def _namespace(self, namespace: str) -> dict:
+        entries = self._data.get(namespace)
+        if entries is None:
+            entries = self._data[namespace] = {}
+            self._bytes[namespace] = 0
+            SESSION_RESIDENT_BYTES.labels(namespace).set_function(lambda: self._bytes.get(namespace, 0))
+        return entries
+
+    def _drop(self, namespace: str, key: str, reason: Optional[str] = None):
+        entry = self._data.get(namespace, {}).pop(key, None)
+        if entry is None:
+            return
+        self._lru.pop((namespace, key), None)
+        self._bytes[namespace] -= entry.size
+        self.resident_bytes -= entry.size
+        if reason:
+            self.evictions[reason] += 1
+            SESSION_EVICTIONS.labels(namespace, reason).inc()
+
+        owner = self._owner(namespace, key)
+        if owner is not None:
+            owned = self._owned.get(owner)
+            if owned is not None:
+                owned.discard((namespace, key))
+                if not owned:
+                    del self._owned[owner]
+        if namespace in self._children:
+            for child_namespace, child_key in self._owned.pop((namespace, key), ()):
+                self._drop(child_namespace, child_key, reason)
+
+    def _touch_owned(self, namespace: str, key: str, now: float):
+        for child_namespace, child_key in self._owned.get((namespace, key), ()):
+            child = self._data.get(child_namespace, {}).get(child_key)
+            if child is not None:
+                child.touch(now)
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(namespace, {}).get(key)
+            if entry is None:
+                return None
+            if entry.expired(now):
+                self._drop(namespace, key, EVICT_TTL)
+                return None
+            entry.touch(now)
+            if namespace in self._owners:
+                return entry.value
+            self._lru.move_to_end((namespace, key))
+            self._touch_owned(namespace, key, now)
+            return entry.value
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float]):
+        now = time.monotonic()
+        current = self._data.get(namespace, {}).get(key)
+        if current is not None and current.value is value and now - current.sized_at < SESSION_SIZE_REFRESH_SECONDS:
+            # The same live object written back after a turn: reuse the recent estimate
+            entry = _Entry(value, ttl, current.size, current.sized_at)
+            entry.touch(now)
+        else:
+            entry = _Entry(value, ttl, estimate_size(value), now)
+        with self._lock:
+            entries = self._namespace(namespace)
+            previous = entries.pop(key, None)
+            if previous is not None:
+                self._bytes[namespace] -= previous.size
+                self.resident_bytes -= previous.size
+            entries[key] = entry
+            owner = self._owner(namespace, key)
+            if owner is not None:
+                # Owned entries are evicted with their parent, never on their own
+                self._owned.setdefault(owner, set()).add((namespace, key))
+            else:
+                self._lru[(namespace, key)] = None
+                self._lru.move_to_end((namespace, key))
+                self._touch_owned(namespace, key, now)
+            self._bytes[namespace] += entry.size
+            self.resident_bytes += entry.size
+            # Oldest first; the session just written is never evicted
+            while self.resident_bytes > self.max_bytes and len(self._lru) > 1:
+                oldest_namespace, oldest_key = next(iter(self._lru))
+                self._drop(oldest_namespace, oldest_key, EVICT_MEMORY)
+        if self._sweeper is None:
+            self._start_sweeper()
+
+    def delete(self, namespace: str, key: str, ttl: Optional[float] = None):
+        with self._lock:
+            self._drop(namespace, key)
+
+    def count(self, namespace: str) -> int:
+        return len(self._data.get(namespace, ()))
+
+    def items(self, namespace: str) -> Iterator[Tuple[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            entries = list(self._data.get(namespace, {}).items())
+        for key, entry in entries:
+            if not entry.expired(now):
+                yield key, entry.value
+
+    def sweep(self) -> int:
+        """Drop every expired session; returns how many were removed"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [
+                (namespace, key)
+                for namespace, entries in self._data.items()
+                for key, entry in entries.items()
+                if entry.expired(now)
+            ]
+            for namespace, key in expired:
+                self._drop(namespace, key, EVICT_TTL)
+        return len(expired)
+
+    def _start_sweeper(self):
+        with self._lock:
+            if self._sweeper is None and self.sweep_interval > 0:
+                self._sweeper = threading.Thread(target=self._run_sweeper, name="session-sweeper", daemon=True)
+                self._sweeper.start()
+
+    def _run_sweeper(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                removed = self.sweep()
+                if removed:
+                    logger.info(f"🧹 Swept {removed} expired sessions")
+            except Exception as e:
+                logger.warning(f"⚠️ Session sweep failed: {e}")
+
+    # One process: SessionActors already serializes turns, nothing to share
+    def acquire_lock(self, name: str, token: str, ttl: float) -> bool:
+        return True
+
+    def renew_lock(self, name: str, token: str, ttl: float) -> bool:
+        return True
+
+    def release_lock(self, name: str, token: str):
+        pass
+
+    def stats(self) -> dict:
+        return {
+            "resident_bytes": self.resident_bytes,
+            "max_bytes": self.max_bytes,
+            "evictions": dict(self.evictions),
+            "bytes_by_namespace": dict(self._bytes),
+        }
+
+
+class SQLiteBackend:
+    """
+    One table in a local SQLite file (WAL), shared by the workers on a host.
+    Rows record when they were written; a delete leaves an empty value as a
+    tombstone until the namespace TTL passes.
+    """
+
+    name = "sqlite"
+    blocking = True
+    errors = (sqlite3.Error,)
+
+    # Expired rows are purged every this many writes
+    PURGE_EVERY = 500
+
+    def __init__(self, path: str):
+        self.path = path or "sessions.db"
+        self._conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, expires_at REAL,"
+            " updated_at REAL NOT NULL DEFAULT 0,"
+            " PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(sessions)")}
+        if "updated_at" not in columns:
+            self._conn.execute("ALTER TABLE sessions ADD COLUMN updated_at REAL NOT NULL DEFAULT 0")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_locks ("
+            " name TEXT PRIMARY KEY, token TEXT NOT NULL, expires_at REAL NOT NULL) WITHOUT ROWID"
+        )
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM sessions WHERE namespace = ? AND key = ?"
+                " AND (expires_at IS NULL OR expires_at > ?)",
+                (namespace, key, time.time())
+            ).fetchone()
+        return decode(row[0]) if row else None
+
+    def _write(self, namespace: str, key: str, blob: bytes, ttl: Optional[float]):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (namespace, key, value, expires_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (namespace, key, blob, now + ttl if ttl else None, now)
+            )
+            self._purge()
+
+    def _purge(self):
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self._conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),))
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float]):
+        self._write(namespace, key, encode(value), ttl)
+
+    def delete(self, namespace: str, key: str, ttl: Optional[float] = None):
+        self._write(namespace, key, b"", ttl or DEFAULT_TTL_SECONDS)
+
+    def restore(self, namespace: str, key: str, value: Any, ttl: Optional[float], updated_at: float) -> bool:
+        """
+        Write a value (None: a delete) made at `updated_at` unless the stored
+        row is newer; returns whether it was written
+        """
+        if value is None:
+            blob, ttl = b"", ttl or DEFAULT_TTL_SECONDS
+        else:
+            blob = encode(value)
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO sessions (namespace, key, value, expires_at, updated_at) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (namespace, key) DO UPDATE SET"
+                " value = excluded.value, expires_at = excluded.expires_at, updated_at = excluded.updated_at"
+                " WHERE sessions.updated_at < excluded.updated_at"
+                " OR (sessions.expires_at IS NOT NULL AND sessions.expires_at <= ?)",
+                (namespace, key, blob, now + ttl if ttl else None, updated_at, now)
+            )
+            self._purge()
+            return cursor.rowcount > 0
+
+    def count(self, namespace: str) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM sessions WHERE namespace = ? AND length(value) > 0"
+                " AND (expires_at IS NULL OR expires_at > ?)",
+                (namespace, time.time())
+            ).fetchone()[0]
+
+    def items(self, namespace: str) -> Iterator[Tuple[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value FROM sessions WHERE namespace = ? AND length(value) > 0"
+                " AND (expires_at IS NULL OR expires_at > ?)",
+                (namespace, time.time())
+            ).fetchall()
+        for key, blob in rows:
+            yield key, decode(blob)
+
+    def acquire_lock(self, name: str, token: str, ttl: float) -> bool:
+        """Take the lease unless another holder's is still running"""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO session_locks (name, token, expires_at) VALUES (?, ?, ?)"
+                " ON CONFLICT (name) DO UPDATE SET token = excluded.token, expires_at = excluded.expires_at"
+                " WHERE session_locks.expires_at <= ?",
+                (name, token, now + ttl, now)
+            )
+            return cursor.rowcount > 0
+
+    def renew_lock(self, name: str, token: str, ttl: float) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE session_locks SET expires_at = ? WHERE name = ? AND token = ?",
+                (time.time() + ttl, name, token)
+            )
+            return cursor.rowcount > 0
+
+    def release_lock(self, name: str, token: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM session_locks WHERE name = ? AND token = ?", (name, token))
+
+
+class RedisBackend:
+    """
+    Redis / Valkey / KeyDB / Azure Cache for Redis; TTLs are native key expiries.
+    Each namespace also has a sorted set of its keys scored by expiry time, so
+    counting and listing a namespace never scans the keyspace. Values are
+    prefixed with the time they were written; a delete leaves just that
+    prefix as a tombstone until the namespace TTL passes.
+    """
+
+    name = "redis"
+    blocking = True
+
+    # Index entries of expired keys are trimmed every this many writes
+    PURGE_EVERY = 500
+    STAMP_BYTES = 17
+
+    # KEYS: value key, index; ARGV: stamped blob, updated_at, ttl ms ("" = none), index score, member
+    # (score "" removes the member: a tombstone)
+    RESTORE_SCRIPT = """
+local current = redis.call('GETRANGE', KEYS[1], 0, 16)
+if current ~= '' and tonumber(current) ~= nil and tonumber(current) >= tonumber(ARGV[2]) then
+  return 0
+end
+if ARGV[3] == '' then
+  redis.call('SET', KEYS[1], ARGV[1])
+else
+  redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[3])
+end
+if ARGV[4] == '' then
+  redis.call('ZREM', KEYS[2], ARGV[5])
+else
+  redis.call('ZADD', KEYS[2], ARGV[4], ARGV[5])
+end
+return 1
+"""
+    # KEYS: lock; ARGV: token, ttl ms
+    RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+    RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+    def __init__(self, url: str, prefix: str = SESSION_STORE_PREFIX):
+        self.url = url or "redis://localhost:6379/0"
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(self.url, socket_timeout=2, socket_connect_timeout=2)
+        self._restore = self._client.register_script(self.RESTORE_SCRIPT)
+        self._renew = self._client.register_script(self.RENEW_SCRIPT)
+        self._release = self._client.register_script(self.RELEASE_SCRIPT)
+        self.errors = (redis.RedisError, OSError)
+        self._writes = 0
+
+    def _key(self, namespace: str, key: str) -> str:
+        return f"{self.prefix}:{namespace}:{key}"
+
+    def _index(self, namespace: str) -> str:
+        return f"{self.prefix}:index:{namespace}"
+
+    def _stamp(self, updated_at: float) -> bytes:
+        return f"{updated_at:0{self.STAMP_BYTES}.6f}".encode("ascii")
+
+    def _value(self, blob: Optional[bytes]) -> Optional[Any]:
+        if blob is None:
+            return None
+        if blob[:1] in (_PLAIN, _COMPRESSED):
+            # Written before values were stamped
+            return decode(blob)
+        return decode(blob[self.STAMP_BYTES:])
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        return self._value(self._client.get(self._key(namespace, key)))
+
+    def set(self, namespace: str, key: str, value: Any, ttl: Optional[float]):
+        expires_at = time.time() + ttl if ttl else float("inf")
+        pipe = self._client.pipeline()
+        pipe.set(self._key(namespace, key), self._stamp(time.time()) + encode(value),
+                 px=int(ttl * 1000) if ttl else None)
+        pipe.zadd(self._index(namespace), {key: expires_at})
+        self._purge(pipe, namespace)
+        pipe.execute()
+
+    def _purge(self, pipe, namespace: str):
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            pipe.zremrangebyscore(self._index(namespace), "-inf", time.time())
+
+    def delete(self, namespace: str, key: str, ttl: Optional[float] = None):
+        pipe = self._client.pipeline()
+        pipe.set(self._key(namespace, key), self._stamp(time.time()),
+                 px=int((ttl or DEFAULT_TTL_SECONDS) * 1000))
+        pipe.zrem(self._index(namespace), key)
+        pipe.execute()
+
+    def restore(self, namespace: str, key: str, value: Any, ttl: Optional[float], updated_at: float) -> bool:
+        """
+        Write a value (None: a delete) made at `updated_at` unless the stored
+        one is newer; returns whether it was written
+        """
+        if value is None:
+            blob, ttl, score = self._stamp(updated_at), ttl or DEFAULT_TTL_SECONDS, ""
+        else:
+            blob = self._stamp(updated_at) + encode(value)
+            score = repr(time.time() + ttl) if ttl else "+inf"
+        written = self._restore(
+            keys=[self._key(namespace, key), self._index(namespace)],
+            args=[blob, repr(updated_at), int(ttl * 1000) if ttl else "", score, key],
+        )
+        return bool(written)
+
+    def count(self, namespace: str) -> int:
+        return self._client.zcount(self._index(namespace), f"({time.time()}", "+inf")
+
+    def items(self, namespace: str) -> Iterator[Tuple[str, Any]]:
+        keys = [key.decode("utf-8") for key in
+                self._client.zrangebyscore(self._index(namespace), f"({time.time()}", "+inf")]
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            blobs = self._client.mget([self._key(namespace, key) for key in chunk])
+            for key, blob in zip(chunk, blobs):
+                value = self._value(blob)
+                if value is not None:
+                    yield key, value
+
+    def _lock_key(self, name: str) -> str:
+        return f"{self.prefix}:lock:{name}"
+
+    def acquire_lock(self, name: str, token: str, ttl: float) -> bool:
+        return bool(self._client.set(self._lock_key(name), token, nx=True, px=int(ttl * 1000)))
+
+    def renew_lock(self, name: str, token: str, ttl: float) -> bool:
+        return bool(self._renew(keys=[self._lock_key(name)], args=[token, int(ttl * 1000)]))
+
+    def release_lock(self, name: str, token: str):
+        self._release(keys=[self._lock_key(name)], args=[token])
+
+
+# ============================================
+# STORE
+# ============================================
+
+class SessionNamespace:
+    """
+    Dict-like view of one namespace; write changes back with set().
+
+    get / set / delete / items / len() block on the backend: use them from
+    threads (Speech SDK callbacks, executors). Coroutines use aget / aset /
+    adelete / aitems / acount, which run shared backends in a worker thread
+    and the memory backend inline.
+
+    When a shared backend fails, reads and writes fall back to a per-process
+    memory copy (session_store_errors_total counts the failures); deletes are
+    kept there as tombstones. On the key's next read once the backend answers,
+    the local copy is written back only if the shared one is older, otherwise
+    it is discarded in favour of the shared one.
+    """
+
+    def __init__(self, backend, name: str, ttl: Optional[float], fallback: Optional[MemoryBackend] = None):
+        self.backend = backend
+        self.name = name
+        self.ttl = ttl
+        self.fallback = fallback
+
+    def _failed(self, operation: str, error: Exception):
+        SESSION_STORE_ERRORS.labels(self.name, operation).inc()
+        logger.warning(f"⚠️ Session store {operation} on '{self.name}' failed, using local copy: {error}")
+
+    def get(self, key: str, default: Any = None) -> Any:
+        key = str(key)
+        if self.fallback is None:
+            value = self.backend.get(self.name, key)
+            return default if value is None else value
+
+        local = self.fallback.get(self.name, key)
+        if local is not None:
+            # Written or deleted while the backend was failing: hand it back unless superseded
+            value, updated_at = local
+            try:
+                if not self.backend.restore(self.name, key, value, self.ttl, updated_at):
+                    value = self.backend.get(self.name, key)
+                self.fallback.delete(self.name, key)
+            except self.backend.errors as e:
+                self._failed("get", e)
+            return default if value is None else value
+        try:
+            value = self.backend.get(self.name, key)
+        except self.backend.errors as e:
+            self._failed("get", e)
+            value = None
+        return default if value is None else value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        key = str(key)
+        ttl = ttl if ttl is not None else self.ttl
+        if self.fallback is None:
+            self.backend.set(self.name, key, value, ttl)
+            return
+        try:
+            self.backend.set(self.name, key, value, ttl)
+        except self.backend.errors as e:
+            self._failed("set", e)
+            self.fallback.set(self.name, key, (value, time.time()), ttl)
+        else:
+            self.fallback.delete(self.name, key)
+
+    def delete(self, key: str):
+        key = str(key)
+        if self.fallback is None:
+            self.backend.delete(self.name, key, self.ttl)
+            return
+        try:
+            self.backend.delete(self.name, key, self.ttl)
+        except self.backend.errors as e:
+            self._failed("delete", e)
+            # Tombstone, so the shared copy does not come back once the backend answers
+            self.fallback.set(self.name, key, (None, time.time()), self.ttl)
+        else:
+            self.fallback.delete(self.name, key)
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        if self.fallback is None:
+            return self.backend.items(self.name)
+        local = dict(self.fallback.items(self.name))
+        try:
+            shared = [(key, value) for key, value in self.backend.items(self.name) if key not in local]
+        except self.backend.errors as e:
+            self._failed("items", e)
+            shared = []
+        pending = [(key, value) for key, (value, _) in local.items() if value is not None]
+        return iter(pending + shared)
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        if self.fallback is None or not self.fallback.count(self.name):
+            try:
+                return self.backend.count(self.name)
+            except self.backend.errors as e:
+                if self.fallback is None:
+                    raise
+                self._failed("count", e)
+                return 0
+        # Keys with a local copy may also be in the shared backend: count each once
+        return sum(1 for _ in self.items())
+
+    async def _run(self, function, *args):
+        if not self.backend.blocking:
+            return function(*args)
+        return await asyncio.to_thread(function, *args)
+
+    async def aget(self, key: str, default: Any = None) -> Any:
+        return await self._run(self.get, key, default)
+
+    async def aset(self, key: str, value: Any, ttl: Optional[float] = None):
+        await self._run(self.set, key, value, ttl)
+
+    async def adelete(self, key: str):
+        await self._run(self.delete, key)
+
+    async def aitems(self) -> list:
+        return await self._run(lambda: list(self.items()))
+
+    async def acount(self) -> int:
+        return await self._run(self.__len__)
+
+
+class SessionStore:
+    def __init__(self, backend):
+        self.backend = backend
+        self._namespaces = {}
+        # Per-process copy used while a shared backend is failing
+        self.fallback = MemoryBackend() if backend.blocking else None
+
+    def own(self, child: str, parent: str):
+        """In memory, keep `child` entries ("<parent key>:...") exactly as long as their parent session"""
+        for backend in (self.backend, self.fallback):
+            if isinstance(backend, MemoryBackend):
+                backend.own(child, parent)
+
+    async def _locked(self, operation: str, function, *args):
+        try:
+            if not self.backend.blocking:
+                return function(*args)
+            return await asyncio.to_thread(function, *args)
+        except self.backend.errors as e:
+            # Without the shared backend, serializing within this process is all that is left
+            SESSION_STORE_ERRORS.labels("locks", operation).inc()
+            logger.warning(f"⚠️ Session lock {operation} failed, continuing without it: {e}")
+            return True
+
+    async def acquire_lock(self, name: str, token: str, ttl: float) -> bool:
+        """Take the lease `name` for `ttl` seconds; False while another holder has it"""
+        return await self._locked("acquire", self.backend.acquire_lock, name, token, ttl)
+
+    async def renew_lock(self, name: str, token: str, ttl: float) -> bool:
+        return await self._locked("renew", self.backend.renew_lock, name, token, ttl)
+
+    async def release_lock(self, name: str, token: str):
+        await self._locked("release", self.backend.release_lock, name, token)
+
+    def namespace(self, name: str) -> SessionNamespace:
+        if name not in self._namespaces:
+            self._namespaces[name] = SessionNamespace(self.backend, name, ttl_for(name), self.fallback)
+        return self._namespaces[name]
+
+    def stats(self) -> dict:
+        stats = {
+            "backend": self.backend.name,
+            "namespaces": {
+                name: {"sessions": len(namespace), "ttl_seconds": namespace.ttl}
+                for name, namespace in self._namespaces.items()
+            },
+        }
+        if isinstance(self.backend, MemoryBackend):
+            stats["memory"] = self.backend.stats()
+        if self.fallback is not None:
+            stats["fallback"] = self.fallback.stats()
+        return stats
+
+
+def create_backend(kind: str = SESSION_STORE, url: str = SESSION_STORE_URL):
+    if kind == "sqlite":
+        return SQLiteBackend(url)
+    if kind == "redis":
+        return RedisBackend(url)
+    if kind != "memory":
+        logger.warning(f"⚠️ Unknown SESSION_STORE '{kind}', using memory")
+    return MemoryBackend()
+
+
+session_store = SessionStore(create_backend())
+logger.info(f"✅ Session store: {session_store.backend.name}")
@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from idempotency import IdempotencyStore  # noqa: E402
+
+
+class FakeRequest:
+    def __init__(self):
+        self.disconnected = False
+
+    async def is_disconnected(self):
+        return self.disconnected
+
+
+def slow_work(runs: list, release: asyncio.Event):
+    async def work():
+        runs.append(1)
+        await release.wait()
+        return {"reply": "ok"}
+    return work
+
+
+async def disconnect(store, runs, release, key="k1"):
+    """First request drops its connection while the work is still running"""
+    request = FakeRequest()
+    first = asyncio.ensure_future(store.run(request, key, "fp", slow_work(runs, release), "chat"))
+    await asyncio.sleep(0.05)
+    request.disconnected = True
+    response = await first
+    assert response.status_code == 499
+
+
+def test_retry_after_disconnect_joins_running_work():
+    async def scenario():
+        store, runs, release = IdempotencyStore(orphan_grace=5), [], asyncio.Event()
+        await disconnect(store, runs, release)
+
+        retry = asyncio.ensure_future(store.run(FakeRequest(), "k1", "fp", slow_work(runs, release), "chat"))
+        await asyncio.sleep(0.05)
+        release.set()
+        assert await retry == {"reply": "ok"}
+        assert len(runs) == 1
+
+    asyncio.run(scenario())
+
+
+def test_orphaned_work_that_finishes_is_replayed():
+    async def scenario():
+        store, runs, release = IdempotencyStore(orphan_grace=5), [], asyncio.Event()
+        await disconnect(store, runs, release)
+        release.set()
+        await asyncio.sleep(0.01)
+
+        response = await store.run(FakeRequest(), "k1", "fp", slow_work(runs, release), "chat")
+        assert response.headers["Idempotent-Replayed"] == "true"
+        assert response.body == b'{"reply": "ok"}'
+        assert len(runs) == 1
+
+    asyncio.run(scenario())
+
+
+def test_orphaned_work_is_cancelled_after_grace_period():
+    async def scenario():
+        store, runs, release = IdempotencyStore(orphan_grace=0.05), [], asyncio.Event()
+        await disconnect(store, runs, release)
+        await asyncio.sleep(0.1)
+
+        assert store.stats()["orphans_cancelled"] == 1
+        assert store.stats()["in_flight"] == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,42 @@
+import pytest
+
+from routing.intent_rules import classify_intent
+
+ALLOWED = ("eligible", "form_filling", "post_application")
+
+
+@pytest.mark.parametrize("message", [
+    "I want to apply",
+    "I want to apply now",
+    "मला अर्ज करायचा आहे",
+    "मुझे आवेदन करना है",
+])
+def test_apply_phrase_routes_to_form_filling(message):
+    match = classify_intent(message, None, ALLOWED)
+    assert match.flag_type == "form_filling"
+    assert match.rule == "explicit_apply_phrase"
+
+
+@pytest.mark.parametrize("message", [
+    "I don't want to apply",
+    "I do not want to apply now",
+    "I never want to apply",
+    "मला अर्ज करायचा नाही",
+    "अर्ज भरायचा नको",
+])
+def test_negated_apply_phrase_is_left_to_llm(message):
+    assert classify_intent(message, None, ALLOWED).flag_type is None
+
+
+def test_payment_amount_question_is_not_post_application():
+    match = classify_intent("What is the payment amount under the scheme?", None, ALLOWED)
+    assert match.flag_type != "post_application"
+
+
+@pytest.mark.parametrize("message", [
+    "What is my payment status?",
+    "payment received?",
+    "installment not credited",
+])
+def test_payment_follow_up_routes_to_post_application(message):
+    assert classify_intent(message, None, ALLOWED).flag_type == "post_application"
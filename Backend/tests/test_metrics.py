@@ -0,0 +1,25 @@
+from metrics import Counter, Gauge, render_metrics
+
+
+def _broken():
+    raise ConnectionError("session store unreachable")
+
+
+def test_gauge_callback_error_renders_nan():
+    gauge = Gauge("test_broken_gauge", "Gauge whose callback raises", ("structure",))
+    gauge.labels("sessions").set_function(_broken)
+
+    assert 'test_broken_gauge{structure="sessions"} NaN' in render_metrics()
+
+
+def test_special_values_render_in_text_format():
+    gauge = Gauge("test_special_gauge", "Gauge with non-finite values", ("kind",))
+    gauge.labels("inf").set_function(lambda: float("inf"))
+    gauge.labels("neg_inf").set_function(lambda: float("-inf"))
+    counter = Counter("test_plain_counter", "Counter with a fractional value")
+    counter.inc(1.5)
+
+    output = render_metrics()
+    assert 'test_special_gauge{kind="inf"} +Inf' in output
+    assert 'test_special_gauge{kind="neg_inf"} -Inf' in output
+    assert "test_plain_counter_total 1.5" in output
@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from session_actors import SessionActors, protected  # noqa: E402
+from session_store import SessionStore, SQLiteBackend  # noqa: E402
+
+
+def recording_turn(log: list, message: str, delay: float = 0.02):
+    async def work():
+        log.append(message)
+        await asyncio.sleep(delay)
+        return message
+    return work
+
+
+def test_duplicates_join_only_the_last_turn():
+    async def scenario():
+        actors, runs = SessionActors("test"), []
+        messages = ["yes", "2", "yes", "yes"]
+        results = await asyncio.gather(*(
+            actors.submit("s1", (message,), recording_turn(runs, message)) for message in messages
+        ))
+        assert results == messages
+        assert runs == ["yes", "2", "yes"]
+        assert actors.stats()["coalesced"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_running_turn_is_cancelled_when_its_sender_leaves():
+    async def scenario():
+        actors, cancelled = SessionActors("test"), asyncio.Event()
+
+        async def work():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        sender = asyncio.ensure_future(actors.submit("s1", ("ocr",), work))
+        await asyncio.sleep(0.02)
+        sender.cancel()
+        await asyncio.wait_for(cancelled.wait(), 1)
+
+    asyncio.run(scenario())
+
+
+def test_queued_turn_is_dropped_when_its_sender_leaves():
+    async def scenario():
+        actors, runs = SessionActors("test"), []
+        first = asyncio.ensure_future(actors.submit("s1", ("a",), recording_turn(runs, "a", 0.05)))
+        second = asyncio.ensure_future(actors.submit("s1", ("b",), recording_turn(runs, "b")))
+        await asyncio.sleep(0.01)
+        second.cancel()
+
+        assert await first == "a"
+        await asyncio.sleep(0.01)
+        assert runs == ["a"]
+        assert actors.stats()["dropped"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_protected_section_finishes_after_sender_leaves():
+    async def scenario():
+        actors, log = SessionActors("test"), []
+
+        async def submit_application():
+            with protected():
+                await asyncio.sleep(0.05)
+                log.append("committed")
+            return "submitted"
+
+        sender = asyncio.ensure_future(actors.submit("s1", ("submit",), submit_application))
+        await asyncio.sleep(0.01)
+        sender.cancel()
+        # A retry queued behind it sees the commit already made
+        retry = await actors.submit("s1", ("status",), recording_turn(log, "retry"))
+
+        assert retry == "retry"
+        assert log == ["committed", "retry"]
+
+    asyncio.run(scenario())
+
+
+def test_turns_for_one_session_do_not_overlap_across_workers(tmp_path):
+    async def scenario():
+        locks = SessionStore(SQLiteBackend(str(tmp_path / "sessions.db")))
+        workers = [SessionActors("test", locks=locks), SessionActors("test", locks=locks)]
+        running, overlaps = [], []
+
+        def turn(name):
+            async def work():
+                running.append(name)
+                if len(running) > 1:
+                    overlaps.append(tuple(running))
+                await asyncio.sleep(0.03)
+                running.remove(name)
+                return name
+            return work
+
+        results = await asyncio.gather(*(
+            workers[i % 2].submit("s1", (i,), turn(i)) for i in range(4)
+        ))
+        assert results == [0, 1, 2, 3]
+        assert overlaps == []
+        assert sum(worker.stats()["lock_waits"] for worker in workers) > 0
+
+    asyncio.run(scenario())
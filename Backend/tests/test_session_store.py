@@ -0,0 +1,109 @@
+import sqlite3
+
+import pytest
+
+from session_store import MemoryBackend, SessionNamespace, SQLiteBackend
+
+
+class FlakySQLite(SQLiteBackend):
+    """SQLite backend that raises like a locked / unreachable database while down"""
+
+    down = False
+
+    def _check(self):
+        if self.down:
+            raise sqlite3.OperationalError("database is locked")
+
+    def get(self, *args):
+        self._check()
+        return super().get(*args)
+
+    def set(self, *args):
+        self._check()
+        super().set(*args)
+
+    def delete(self, *args):
+        self._check()
+        super().delete(*args)
+
+    def restore(self, *args):
+        self._check()
+        return super().restore(*args)
+
+    def count(self, *args):
+        self._check()
+        return super().count(*args)
+
+    def items(self, *args):
+        self._check()
+        return super().items(*args)
+
+
+@pytest.fixture
+def backend(tmp_path):
+    return FlakySQLite(str(tmp_path / "sessions.db"))
+
+
+def worker(backend):
+    """One uvicorn worker's view: the shared backend plus its own fallback copy"""
+    return SessionNamespace(backend, "registration", 3600, MemoryBackend(sweep_interval=0))
+
+
+def test_local_copy_is_written_back_after_outage(backend):
+    a = worker(backend)
+    backend.down = True
+    a.set("s1", {"step": "aadhaar"})
+    backend.down = False
+
+    assert a.get("s1") == {"step": "aadhaar"}
+    assert backend.get("registration", "s1") == {"step": "aadhaar"}
+    assert a.fallback.count("registration") == 0
+
+
+def test_stale_local_copy_does_not_replace_newer_shared_write(backend):
+    a, b = worker(backend), worker(backend)
+    backend.down = True
+    a.set("s1", {"step": "aadhaar"})
+    backend.down = False
+    b.set("s1", {"step": "bank"})
+
+    assert a.get("s1") == {"step": "bank"}
+    assert backend.get("registration", "s1") == {"step": "bank"}
+
+
+def test_delete_during_outage_is_not_undone(backend):
+    a = worker(backend)
+    a.set("s1", {"step": "aadhaar"})
+    backend.down = True
+    a.delete("s1")
+    assert a.get("s1") is None
+    backend.down = False
+
+    assert a.get("s1") is None
+    assert backend.get("registration", "s1") is None
+
+
+def test_shared_delete_wins_over_older_local_copy(backend):
+    a, b = worker(backend), worker(backend)
+    backend.down = True
+    a.set("s1", {"step": "aadhaar"})
+    backend.down = False
+    b.set("s1", {"step": "bank"})
+    b.delete("s1")
+
+    assert a.get("s1") is None
+    assert len(b) == 0
+
+
+def test_keys_in_both_copies_are_counted_once(backend):
+    a = worker(backend)
+    a.set("s1", {"step": "aadhaar"})
+    a.set("s2", {"step": "aadhaar"})
+    backend.down = True
+    a.set("s1", {"step": "bank"})
+    a.set("s3", {"step": "aadhaar"})
+    a.delete("s2")
+    backend.down = False
+
+    assert len(a) == 2
+    assert dict(a.items()) == {"s1": {"step": "bank"}, "s3": {"step": "aadhaar"}}
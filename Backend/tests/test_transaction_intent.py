@@ -0,0 +1,30 @@
+import pytest
+
+from transaction_intent import basic_transaction_intent
+
+
+@pytest.mark.parametrize("message", [
+    "May I know my payment details?",
+    "Sir, may I see my transactions",
+    "The installment may be delayed?",
+])
+def test_modal_may_is_not_a_month(message):
+    intent = basic_transaction_intent(message)
+    assert intent["transaction_flag"] == 1
+    assert intent["month_list"] is None
+
+
+@pytest.mark.parametrize("message, months", [
+    ("Payment for May?", ["may"]),
+    ("Was the installment credited in may and june", ["may", "june"]),
+    ("May payment status", ["may"]),
+    ("May I know the amount credited in May?", ["may"]),
+    ("show 5 may transaction", ["may"]),
+])
+def test_may_as_a_month(message, months):
+    assert basic_transaction_intent(message)["month_list"] == months
+
+
+def test_month_range_and_last_n_months():
+    assert basic_transaction_intent("payments from may to july")["start_month"] == "may"
+    assert basic_transaction_intent("payments of last 3 months")["last_n_months"] == 3
@@ -0,0 +1,313 @@
+# tracing.py - Lightweight request tracing
+#
+# Spans are opened with `with span("name"):` or the @traced("name") decorator
+# (sync and async functions). Parent/child links and the session id travel in
+# contextvars, so spans inside asyncio.to_thread() work as well.
+#
+# Finished spans are:
+#   - collected per HTTP request and summarised in a Server-Timing header
+#   - exported in the background when TRACING_EXPORTER is set:
+#       file  -> one JSON span per line in TRACING_FILE
+#       otlp  -> OTLP/HTTP JSON to OTEL_EXPORTER_OTLP_ENDPOINT (/v1/traces)
+import os
+import json
+import time
+import queue
+import logging
+import functools
+import threading
+import inspect
+import contextvars
+from contextlib import contextmanager
+from typing import Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# ============================================
+# CONFIGURATION
+# ============================================
+
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "").lower()      # "", "file", "otlp"
+TRACING_FILE = os.getenv("TRACING_FILE", "traces.jsonl")
+OTEL_EXPORTER_OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4318").rstrip("/")
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "ladki-bahin-smart-router")
+TRACING_BATCH_SIZE = 256
+TRACING_FLUSH_SECONDS = 2.0
+TRACING_QUEUE_SIZE = 10000
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_request_spans = contextvars.ContextVar("request_spans", default=None)
+_session_id = contextvars.ContextVar("session_id", default=None)
+_request_root = contextvars.ContextVar("request_root", default=None)
+
+
+# ============================================
+# SPANS
+# ============================================
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns",
+                 "_start_perf", "duration_ms", "attributes", "error")
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: dict):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self._start_perf = time.perf_counter()
+        self.duration_ms = 0.0
+        self.attributes = attributes
+        self.error = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def finish(self):
+        self.duration_ms = (time.perf_counter() - self._start_perf) * 1000
+        self.end_ns = self.start_ns + int(self.duration_ms * 1_000_000)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+def _active() -> bool:
+    return bool(TRACING_EXPORTER) or _request_spans.get() is not None
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Open a child span of the current span. No-op outside requests when exporting is off."""
+    if not _active():
+        yield None
+        return
+
+    session_id = _session_id.get()
+    if session_id and "session.id" not in attributes:
+        attributes["session.id"] = session_id
+
+    current = Span(name, _current_span.get(), attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        current.finish()
+        _finish(current)
+
+
+def traced(name: str):
+    """Decorator form of span() for sync and async functions"""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def set_session_id(session_id: Optional[str]):
+    """Tag the current span (normally the request span) and all later child spans with the session id"""
+    if not session_id:
+        return
+    _session_id.set(session_id)
+    current = _current_span.get()
+    if current is not None:
+        current.set_attribute("session.id", session_id)
+
+
+def current_session_id() -> Optional[str]:
+    return _session_id.get()
+
+
+def set_request_attribute(key: str, value):
+    """Set an attribute on the request's root span (e.g. the routed flag, read by the metrics middleware)"""
+    root = _request_root.get()
+    if root is not None:
+        root.set_attribute(key, value)
+
+
+# ============================================
+# PER-REQUEST COLLECTION (Server-Timing)
+# ============================================
+
+def start_request(name: str, **attributes):
+    """
+    Start the root span of an HTTP request.
+    Returns (root_span, tokens); pass both to end_request().
+    """
+    spans = []
+    spans_token = _request_spans.set(spans)
+    root = Span(name, None, attributes)
+    span_token = _current_span.set(root)
+    root_token = _request_root.set(root)
+    return root, (spans_token, span_token, root_token)
+
+
+def end_request(root: Span, tokens, status_code: Optional[int] = None) -> str:
+    """Finish the request span and return its Server-Timing header value"""
+    return finish_request(root, detach_request(tokens), status_code)
+
+
+def detach_request(tokens) -> list:
+    """
+    Restore the context from before start_request() and return the request's
+    span list. Code still running in the request's context (a streaming
+    body) keeps adding to that list until finish_request() is called.
+    """
+    spans = _request_spans.get()
+    spans_token, span_token, root_token = tokens
+    _request_root.reset(root_token)
+    _current_span.reset(span_token)
+    _request_spans.reset(spans_token)
+    return spans if spans is not None else []
+
+
+def finish_request(root: Span, spans: list, status_code: Optional[int] = None) -> str:
+    """Finish a detached request span and return its Server-Timing header value"""
+    if status_code is not None:
+        root.set_attribute("http.status_code", status_code)
+    root.finish()
+    if TRACING_EXPORTER:
+        _exporter.submit(root)
+    return server_timing(root, spans)
+
+
+def server_timing(root: Span, spans) -> str:
+    """Total time plus the summed duration of each span name"""
+    totals = {}
+    for finished in spans:
+        key = finished.name.replace(" ", "_")
+        totals[key] = totals.get(key, 0.0) + finished.duration_ms
+
+    entries = [f"total;dur={root.duration_ms:.1f}"]
+    entries += [f"{name};dur={duration:.1f}" for name, duration in totals.items()]
+    return ", ".join(entries)
+
+
+def _finish(finished: Span):
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append(finished)
+    if TRACING_EXPORTER:
+        _exporter.submit(finished)
+
+
+# ============================================
+# EXPORT
+# ============================================
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_span(finished: Span) -> dict:
+    otlp = {
+        "traceId": finished.trace_id,
+        "spanId": finished.span_id,
+        "name": finished.name,
+        "kind": 1,
+        "startTimeUnixNano": str(finished.start_ns),
+        "endTimeUnixNano": str(finished.end_ns),
+        "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in finished.attributes.items()],
+        "status": {"code": 2, "message": finished.error} if finished.error else {"code": 1},
+    }
+    if finished.parent_id:
+        otlp["parentSpanId"] = finished.parent_id
+    return otlp
+
+
+class SpanExporter:
+    """Background thread that batches finished spans to a JSONL file or an OTLP/HTTP collector"""
+
+    def __init__(self, exporter: str):
+        self.exporter = exporter
+        self._queue = queue.Queue(maxsize=TRACING_QUEUE_SIZE)
+        self.dropped = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, finished: Span):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                    self._thread.start()
+        try:
+            self._queue.put_nowait(finished)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + TRACING_FLUSH_SECONDS
+            while len(batch) < TRACING_BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                self._export(batch)
+            except Exception as e:
+                logger.warning(f"⚠️ Span export failed ({len(batch)} spans): {e}")
+
+    def _export(self, batch):
+        if self.exporter == "file":
+            with open(TRACING_FILE, "a", encoding="utf-8") as f:
+                for finished in batch:
+                    f.write(json.dumps(finished.to_dict(), ensure_ascii=False, default=str) + "\n")
+            return
+
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [
+                    {"key": "service.name", "value": {"stringValue": OTEL_SERVICE_NAME}}
+                ]},
+                "scopeSpans": [{
+                    "scope": {"name": "ladki-bahin.tracing"},
+                    "spans": [_otlp_span(finished) for finished in batch],
+                }],
+            }]
+        }
+        requests.post(f"{OTEL_EXPORTER_OTLP_ENDPOINT}/v1/traces", json=payload, timeout=5)
+
+
+if TRACING_EXPORTER and TRACING_EXPORTER not in ("file", "otlp"):
+    logger.warning(f"⚠️ Unknown TRACING_EXPORTER '{TRACING_EXPORTER}', span export disabled")
+    TRACING_EXPORTER = ""
+
+_exporter = SpanExporter(TRACING_EXPORTER)
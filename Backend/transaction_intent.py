@@ -0,0 +1,65 @@
+# transaction_intent.py - Regex extraction of transaction questions
+#
+# Used by the post-application agent when the transaction_intent LLM call is
+# unavailable, and by llm_standin.py for scripted answers. Standard library
+# only, so the stand-in server does not import the app or the database layer.
+import re
+
+MONTH_MAP = {
+    "january": 1, "february": 2, "march": 3, "april": 4,
+    "may": 5, "june": 6, "july": 7, "august": 8,
+    "september": 9, "october": 10, "november": 11, "december": 12
+}
+
+TRANSACTION_KEYWORDS = re.compile(
+    r"\b(payment|paid|transaction|installment|instalment|credited|amount|money)s?\b"
+    r"|हप्ता|व्यवहार|पैसे|किस्त|भुगतान|लेनदेन"
+)
+LAST_N_MONTHS_PATTERN = re.compile(r"\blast\s+(\d{1,2})\s+months?\b")
+MONTH_RANGE_PATTERN = re.compile(rf"\b({'|'.join(MONTH_MAP)})\b\s*(?:to|till|until|-)\s*\b({'|'.join(MONTH_MAP)})\b")
+MONTH_PATTERN = re.compile(rf"\b({'|'.join(MONTH_MAP)})\b")
+# "may" is only a month after a month context ("in may", "5 may") or when it is
+# not the modal verb ("may I know", "it may be")
+MONTH_CONTEXT = re.compile(r"(?:\b(?:in|for|of|from|since|during|till|until|to|and|last|this|month)|\d)\s*$")
+MODAL_MAY = re.compile(
+    r"\s*(?:i|we|you|he|she|it|they|be|have|not|also|please|know|get|see|ask|check|help)\b"
+)
+
+
+def _is_modal_may(text: str, match: re.Match) -> bool:
+    if MONTH_CONTEXT.search(text, 0, match.start()):
+        return False
+    return MODAL_MAY.match(text, match.end()) is not None
+
+
+def _months(text: str) -> list:
+    months = []
+    for match in MONTH_PATTERN.finditer(text):
+        month = match.group(1)
+        if month == "may" and _is_modal_may(text, match):
+            continue
+        if month not in months:
+            months.append(month)
+    return months
+
+
+def basic_transaction_intent(user_prompt: str):
+    """Regex fallback for extract_transaction_intent_llm (same JSON shape)"""
+    text = user_prompt.lower()
+    intent = {
+        "transaction_flag": 1 if TRANSACTION_KEYWORDS.search(text) else 0,
+        "month_list": None,
+        "start_month": None,
+        "end_month": None,
+        "last_n_months": None
+    }
+
+    last_n = LAST_N_MONTHS_PATTERN.search(text)
+    month_range = MONTH_RANGE_PATTERN.search(text)
+    if last_n:
+        intent["last_n_months"] = int(last_n.group(1))
+    elif month_range:
+        intent["start_month"], intent["end_month"] = month_range.group(1), month_range.group(2)
+    else:
+        intent["month_list"] = _months(text) or None
+    return intent
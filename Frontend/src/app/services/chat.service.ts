@@ -1,17 +1,24 @@
 import { Injectable } from '@angular/core';
-import { HttpClient } from '@angular/common/http';
-import { Observable } from 'rxjs';
+import { HttpClient, HttpErrorResponse, HttpHeaders } from '@angular/common/http';
+import { Observable, retry, throwError, timer } from 'rxjs';
 
 export interface ChatResponse {
     response: string | any;
     mode: string;
 }
 
+export interface ChatStreamEvent {
+    event: 'route' | 'token' | 'final' | 'error';
+    data: any;
+}
+
 @Injectable({
     providedIn: 'root'
 })
 export class ChatService {
     private apiUrl = 'http://localhost:9015/smart-chat-router-ladki-bahin';
+    private streamUrl = 'http://localhost:9015/smart-chat-router-ladki-bahin/stream';
+    private maxRetries = 2;
 
     constructor(private http: HttpClient) { }
 
@@ -23,6 +30,92 @@ export class ChatService {
         file: File | null = null,
         docType: string | null = null
     ): Observable<ChatResponse | any> {
+        const formData = this.buildFormData(message, sessionId, prevRes, prevResMode, file, docType);
+        // One key per message: retries reuse it, so the backend replays the
+        // first result instead of running the turn (OCR, uploads, LLM) again
+        const headers = new HttpHeaders({ 'Idempotency-Key': crypto.randomUUID() });
+
+        return this.http.post<ChatResponse>(this.apiUrl, formData, { headers }).pipe(
+            retry({
+                count: this.maxRetries,
+                delay: (err: HttpErrorResponse, attempt: number) =>
+                    err.status === 0 ? timer(500 * attempt) : throwError(() => err)
+            })
+        );
+    }
+
+    /**
+     * Streaming variant of sendMessage: emits the route decision, then the
+     * agent's tokens, then a "final" event with the usual {response, mode}.
+     * Unsubscribing aborts the request.
+     */
+    streamMessage(
+        message: string,
+        sessionId: string,
+        prevRes: string | null = null,
+        prevResMode: string | null = null,
+        file: File | null = null,
+        docType: string | null = null
+    ): Observable<ChatStreamEvent> {
+        const formData = this.buildFormData(message, sessionId, prevRes, prevResMode, file, docType);
+
+        return new Observable<ChatStreamEvent>(observer => {
+            const controller = new AbortController();
+
+            fetch(this.streamUrl, { method: 'POST', body: formData, signal: controller.signal })
+                .then(async res => {
+                    if (!res.ok || !res.body) {
+                        throw new Error(`Stream request failed: ${res.status}`);
+                    }
+
+                    const reader = res.body.getReader();
+                    const decoder = new TextDecoder();
+                    let buffer = '';
+
+                    while (true) {
+                        const { done, value } = await reader.read();
+                        if (done) {
+                            break;
+                        }
+
+                        buffer += decoder.decode(value, { stream: true });
+                        let boundary = buffer.indexOf('\n\n');
+                        while (boundary >= 0) {
+                            const parsed = this.parseSseEvent(buffer.slice(0, boundary));
+                            buffer = buffer.slice(boundary + 2);
+                            if (parsed) {
+                                observer.next(parsed);
+                            }
+                            boundary = buffer.indexOf('\n\n');
+                        }
+                    }
+
+                    observer.complete();
+                })
+                .catch(err => {
+                    if (err?.name !== 'AbortError') {
+                        observer.error(err);
+                    }
+                });
+
+            return () => controller.abort();
+        });
+    }
+
+    getAudio(text: string): Observable<Blob> {
+        return this.http.post('http://localhost:9015/api/tts', { text: text }, {
+            responseType: 'blob'
+        });
+    }
+
+    private buildFormData(
+        message: string,
+        sessionId: string,
+        prevRes: string | null,
+        prevResMode: string | null,
+        file: File | null,
+        docType: string | null
+    ): FormData {
         const formData = new FormData();
         formData.append('message', message);
         formData.append('session_id', sessionId);
@@ -43,12 +136,25 @@ export class ChatService {
             formData.append('doc_type', docType);
         }
 
-        return this.http.post<ChatResponse>(this.apiUrl, formData);
+        return formData;
     }
 
-    getAudio(text: string): Observable<Blob> {
-        return this.http.post('http://localhost:9015/api/tts', { text: text }, {
-            responseType: 'blob'
-        });
+    private parseSseEvent(raw: string): ChatStreamEvent | null {
+        let event = 'message';
+        const dataLines: string[] = [];
+
+        for (const line of raw.split('\n')) {
+            if (line.startsWith('event:')) {
+                event = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+                dataLines.push(line.slice(5).trim());
+            }
+        }
+
+        if (!dataLines.length) {
+            return null;
+        }
+
+        return { event: event as ChatStreamEvent['event'], data: JSON.parse(dataLines.join('\n')) };
     }
 }